@@ -3,20 +3,22 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from .models import ChatSession, Message, BotPersonality, UserPreferences, ChatbotAnalytics
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from .message_search import get_backend
+from .models import ChatSession, Message, BotPersonality, UserPreferences, ChatbotAnalytics, ResponseJob
 
 @admin.register(ChatSession)
 class ChatSessionAdmin(admin.ModelAdmin):
-    list_display = ['id', 'session_name', 'user', 'message_count', 'created_at', 'updated_at', 'is_active']
+    list_display = ['id', 'session_name', 'user', 'message_count', 'last_message_at', 'created_at', 'updated_at', 'is_active']
     list_filter = ['is_active', 'created_at', 'updated_at']
     search_fields = ['session_name', 'user__username']
-    readonly_fields = ['id', 'created_at', 'updated_at', 'message_count']
+    readonly_fields = [
+        'id', 'created_at', 'updated_at', 'message_count', 'user_message_count',
+        'bot_message_count', 'last_message_preview', 'last_message_at'
+    ]
     date_hierarchy = 'created_at'
     
-    def message_count(self, obj):
-        return obj.message_count
-    message_count.short_description = 'Messages'
-    
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user')
 
@@ -40,6 +42,14 @@ class MessageAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('chat_session')
+    
+    def get_search_results(self, request, queryset, search_term):
+        """Match content through the full-text index instead of a LIKE scan"""
+        if not search_term.strip():
+            return queryset, False
+        sql, params = get_backend(queryset.db).matching_ids(search_term)
+        matches = Q(id__in=RawSQL(sql, params)) | Q(chat_session__session_name__icontains=search_term)
+        return queryset.filter(matches), False
 
 @admin.register(BotPersonality)
 class BotPersonalityAdmin(admin.ModelAdmin):
@@ -76,8 +86,12 @@ class UserPreferencesAdmin(admin.ModelAdmin):
 
 @admin.register(ChatbotAnalytics)
 class ChatbotAnalyticsAdmin(admin.ModelAdmin):
-    list_display = ['date', 'total_messages', 'total_sessions', 'unique_users', 'avg_response_time']
+    list_display = [
+        'date', 'total_messages', 'total_sessions', 'unique_users', 'avg_response_time',
+        'response_time_p50', 'response_time_p95', 'response_time_p99'
+    ]
     list_filter = ['date']
+    exclude = ['response_time_sketch', 'sessions_sketch', 'users_sketch']
     readonly_fields = ['date']
     date_hierarchy = 'date'
     
@@ -87,6 +101,15 @@ class ChatbotAnalyticsAdmin(admin.ModelAdmin):
     def has_change_permission(self, request, obj=None):
         return False  # Analytics should not be manually changed
 
+@admin.register(ResponseJob)
+class ResponseJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'bot_message', 'status', 'attempts', 'worker', 'created_at', 'started_at', 'finished_at']
+    list_filter = ['status', 'created_at']
+    readonly_fields = ['user_message', 'bot_message', 'worker', 'created_at', 'started_at', 'finished_at']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('bot_message')
+
 # Custom admin site configuration
 admin.site.site_header = "Chatbot Administration"
 admin.site.site_title = "Chatbot Admin"
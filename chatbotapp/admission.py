@@ -0,0 +1,258 @@
+# chatbot/admission.py
+# Admission control for Gemini calls. Each process runs at most
+# GEMINI_MAX_CONCURRENCY calls at once; callers beyond that wait in a bounded
+# queue where signed-in users go first, and are turned away at once when the
+# queue is full so the bot answers with its local fallback instead. Admitted
+# calls also draw on requests- and tokens-per-minute token buckets kept in the
+# cache, which every worker process (and host, with a shared cache) draws on.
+import contextvars
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from . import metrics, resilience
+from .conf import chatbot_setting, coordination_cache
+
+logger = logging.getLogger(__name__)
+
+# Lower goes first
+PRIORITIES = {'authenticated': 0, 'anonymous': 1}
+
+QUEUE_DEPTH = metrics.registry.gauge(
+    'chatbot_admission_queue_depth', "Calls waiting for admission to an upstream", ['upstream', 'priority']
+)
+IN_FLIGHT = metrics.registry.gauge(
+    'chatbot_admission_in_flight', "Admitted upstream calls in progress", ['upstream']
+)
+WAIT_DURATION = metrics.registry.histogram(
+    'chatbot_admission_wait_seconds', "Time upstream calls waited for admission, by how the wait ended",
+    ['upstream', 'priority', 'outcome'],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+
+class AdmissionRejected(Exception):
+    """The call was not admitted: the queue was full, or its turn would come too late"""
+
+    def __init__(self, upstream: str, reason: str):
+        super().__init__(f"{upstream} call not admitted: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+
+
+_priority: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('chatbot_admission_priority', default=None)
+
+
+def priority_of(chat_session=None) -> str:
+    """The queue priority of calls made for a chat session, or for the current block"""
+    if chat_session is not None and hasattr(chat_session, 'user_id'):
+        return 'authenticated' if chat_session.user_id else 'anonymous'
+    return _priority.get() or 'anonymous'
+
+
+@contextmanager
+def priority(name: str):
+    """Queue the calls made in the block (including nested ones, like summaries) at this priority"""
+    token = _priority.set(name)
+    try:
+        yield name
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Per-minute budgets (e.g. requests and tokens) shared by every process through the cache
+
+    Each budget refills continuously at its rate and holds at most one minute's
+    worth. The state is read and written under a short lock made with
+    cache.add, so the cache needs an atomic add(), as on Redis, Memcached and
+    the local memory cache (which keeps a budget per process).
+    """
+
+    LOCK_SECONDS = 2
+    LOCK_WAIT = 0.05
+
+    def __init__(self, name: str, rates: Dict[str, float], cache_alias: Optional[str] = None):
+        self.name = name
+        self.rates = {budget: float(rate) for budget, rate in rates.items() if rate}
+        self.cache = coordination_cache('ADMISSION_CACHE_ALIAS', cache_alias)
+        self.key = f"chatbot:bucket:{name}"
+        self.lock_key = f"{self.key}:lock"
+
+    def _update(self, change) -> float:
+        """Apply change(levels) to the refilled levels under the lock, and return its result"""
+        token = uuid.uuid4().hex
+        give_up = time.monotonic() + self.LOCK_WAIT
+        while not self.cache.add(self.lock_key, token, self.LOCK_SECONDS):
+            if time.monotonic() > give_up:
+                # Better to overdraw a little than to stall every call on a stuck lock
+                logger.warning(f"Token bucket {self.name} is locked; going ahead without it")
+                return 0.0
+            time.sleep(0.002)
+        try:
+            state = self.cache.get(self.key) or {}
+            now = time.time()
+            elapsed = max(0.0, now - state.get('at', now))
+            levels = {
+                budget: min(rate, state.get(budget, rate) + elapsed * rate / 60)
+                for budget, rate in self.rates.items()
+            }
+            result = change(levels)
+            self.cache.set(self.key, {**levels, 'at': now}, 120)
+            return result
+        finally:
+            if self.cache.get(self.lock_key) == token:
+                self.cache.delete(self.lock_key)
+
+    def reserve(self, costs: Dict[str, float]) -> float:
+        """Take the costs and return 0, or take nothing and return the seconds until they are there"""
+        if not self.rates:
+            return 0.0
+        # More than a minute's budget at once could never be granted; let it through when full
+        costs = {budget: min(costs.get(budget, 0), rate) for budget, rate in self.rates.items()}
+
+        def take(levels):
+            wait = max((costs[budget] - levels[budget]) * 60 / self.rates[budget] for budget in levels)
+            if wait > 0:
+                return wait
+            for budget in levels:
+                levels[budget] -= costs[budget]
+            return 0.0
+
+        return self._update(take)
+
+    def adjust(self, costs: Dict[str, float]):
+        """Take further costs (or give back, when negative) without waiting, e.g. once actual usage is known"""
+        if not self.rates:
+            return
+
+        def apply(levels):
+            for budget in levels:
+                levels[budget] -= costs.get(budget, 0)
+
+        self._update(apply)
+
+    def drain(self):
+        """Empty every budget, e.g. after the upstream said it is rate limiting us"""
+        if not self.rates:
+            return
+
+        def empty(levels):
+            for budget in levels:
+                levels[budget] = min(levels[budget], 0.0)
+
+        self._update(empty)
+
+
+class AdmissionController:
+    """Concurrency cap, bounded priority queue and shared token bucket in front of one upstream"""
+
+    def __init__(self, upstream: str, max_concurrency: int, queue_size: int, max_wait: float,
+                 bucket: Optional[TokenBucket] = None):
+        self.upstream = upstream
+        self.max_concurrency = max(1, max_concurrency)
+        self.queue_size = max(0, queue_size)
+        self.max_wait = max_wait
+        self.bucket = bucket
+        self._active = 0
+        self._queue = []  # Heap of (priority, sequence) tickets
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _finish_wait(self, priority: str, started: float, outcome: str):
+        WAIT_DURATION.observe(time.monotonic() - started, upstream=self.upstream, priority=priority, outcome=outcome)
+        if outcome != 'admitted':
+            metrics.note('admission', outcome)
+            raise AdmissionRejected(self.upstream, outcome)
+
+    def _wait_for_slot(self, priority: str, started: float, give_up: float):
+        ticket = (PRIORITIES.get(priority, len(PRIORITIES)), next(self._sequence))
+        with self._condition:
+            if self._active < self.max_concurrency and not self._queue:
+                self._active += 1
+                IN_FLIGHT.inc(upstream=self.upstream)
+                return
+            if len(self._queue) >= self.queue_size:
+                self._finish_wait(priority, started, 'queue_full')
+            heapq.heappush(self._queue, ticket)
+            QUEUE_DEPTH.inc(upstream=self.upstream, priority=priority)
+            try:
+                while not (self._queue[0] == ticket and self._active < self.max_concurrency):
+                    left = give_up - time.monotonic()
+                    if left <= 0:
+                        self._queue.remove(ticket)
+                        heapq.heapify(self._queue)
+                        # The next in line may be able to go now
+                        self._condition.notify_all()
+                        self._finish_wait(priority, started, 'queue_timeout')
+                    self._condition.wait(left)
+                heapq.heappop(self._queue)
+                self._active += 1
+                IN_FLIGHT.inc(upstream=self.upstream)
+                self._condition.notify_all()
+            finally:
+                QUEUE_DEPTH.dec(upstream=self.upstream, priority=priority)
+
+    def _release(self):
+        with self._condition:
+            self._active -= 1
+            IN_FLIGHT.dec(upstream=self.upstream)
+            self._condition.notify_all()
+
+    @contextmanager
+    def admit(self, tokens: int = 0, priority: Optional[str] = None):
+        """Wait for a turn to call the upstream, or raise AdmissionRejected
+
+        The wait is bounded by max_wait and by the current request deadline.
+        """
+        priority = priority or priority_of()
+        started = time.monotonic()
+        left = resilience.remaining()
+        give_up = started + (self.max_wait if left is None else max(0.0, min(self.max_wait, left)))
+
+        self._wait_for_slot(priority, started, give_up)
+        try:
+            while self.bucket is not None:
+                wait = self.bucket.reserve({'requests': 1, 'tokens': tokens})
+                if not wait:
+                    break
+                if time.monotonic() + wait > give_up:
+                    self._finish_wait(priority, started, 'rate_limited')
+                time.sleep(wait)
+            self._finish_wait(priority, started, 'admitted')
+        except BaseException:
+            self._release()
+            raise
+        try:
+            yield self
+        finally:
+            self._release()
+
+
+_controllers: Dict[str, AdmissionController] = {}
+_controllers_lock = threading.Lock()
+
+
+def get_controller(upstream: str = 'gemini') -> AdmissionController:
+    """The process-wide admission controller of an upstream, configured from the settings"""
+    with _controllers_lock:
+        controller = _controllers.get(upstream)
+        if controller is None:
+            prefix = upstream.upper()
+            bucket = TokenBucket(upstream, {
+                'requests': chatbot_setting(f'{prefix}_REQUESTS_PER_MINUTE', None),
+                'tokens': chatbot_setting(f'{prefix}_TOKENS_PER_MINUTE', None),
+            })
+            controller = _controllers[upstream] = AdmissionController(
+                upstream,
+                max_concurrency=chatbot_setting(f'{prefix}_MAX_CONCURRENCY', 8),
+                queue_size=chatbot_setting(f'{prefix}_QUEUE_SIZE', 32),
+                max_wait=chatbot_setting(f'{prefix}_QUEUE_TIMEOUT', 5),
+                bucket=bucket if bucket.rates else None,
+            )
+        return controller
@@ -0,0 +1,47 @@
+# chatbot/anonymous_sessions.py
+# Anonymous visitors are identified by a signed cookie holding the id of their
+# ChatSession, so serving them needs no Django session row. The ChatSession
+# itself is only created when they send their first message.
+from typing import Optional
+
+from django.conf import settings
+
+from .conf import chatbot_setting
+from .models import ChatSession
+
+COOKIE_NAME = 'chatbot_anonymous_chat'
+COOKIE_SALT = 'chatbotapp.anonymous_sessions'
+
+
+def cookie_age() -> int:
+    return chatbot_setting('ANONYMOUS_CHAT_COOKIE_AGE', 30 * 24 * 60 * 60)
+
+
+def get_chat_session_id(request) -> Optional[str]:
+    """The chat session id in the visitor's cookie, if its signature and age check out"""
+    return request.get_signed_cookie(COOKIE_NAME, default=None, salt=COOKIE_SALT, max_age=cookie_age())
+
+
+def get_chat_session(request) -> Optional[ChatSession]:
+    """The anonymous visitor's chat session, or None before their first message"""
+    session_id = get_chat_session_id(request)
+    if not session_id:
+        return None
+    return ChatSession.objects.filter(id=session_id, user=None).first()
+
+
+def create_chat_session() -> ChatSession:
+    return ChatSession.objects.create(session_name="Anonymous Chat")
+
+
+def remember(response, chat_session: ChatSession):
+    """Set the cookie that identifies the visitor's chat session"""
+    response.set_signed_cookie(
+        COOKIE_NAME, str(chat_session.id), salt=COOKIE_SALT, max_age=cookie_age(),
+        httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE
+    )
+
+
+def forget(response):
+    """Drop the visitor's chat session, so their next message starts a new one"""
+    response.delete_cookie(COOKIE_NAME, samesite='Lax')
@@ -4,3 +4,33 @@ from django.apps import AppConfig
 class ChatbotappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chatbotapp'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_migrate, post_save
+
+        # Importing checks registers the app's system checks
+        from . import checks, personalities
+
+        connection_created.connect(_install_query_timer)
+        post_migrate.connect(_install_message_search, sender=self)
+        # Compiled personality instructions and remembered preferences go stale on these
+        for signal in (post_save, post_delete):
+            signal.connect(personalities.personality_changed, sender='chatbotapp.BotPersonality')
+            signal.connect(personalities.preferences_changed, sender='chatbotapp.UserPreferences')
+
+
+def _install_query_timer(sender, connection, **kwargs):
+    """Add query time to the current metrics trace on every database connection"""
+    from .metrics import time_query
+
+    # First in the list, so wrappers added later with execute_wrapper() pop cleanly
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, time_query)
+
+
+def _install_message_search(sender, using, **kwargs):
+    """Create the full-text index of messages, or restore its triggers after a migration dropped them"""
+    from .message_search import install
+
+    install(using)
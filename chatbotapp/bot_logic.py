@@ -1,18 +1,37 @@
 # chatbot/bot_logic.py
+import asyncio
+import contextvars
 import logging
 import random
 import os
-from .gemini_client import GeminiClient
-from .wikimedia_client import WikimediaClient
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Optional, Tuple
+from asgiref.sync import sync_to_async
+from . import metrics, resilience
+from .conf import chatbot_setting
+from .gemini_client import GeminiClient, WikimediaClient
+from .wikipedia_index import create_wikimedia_client
+from .intent_router import Intent, IntentRouter
 
 logger = logging.getLogger(__name__)
 
+# Shared by all chatbot instances for concurrent resolution of information queries
+_resolver_pool = None
+
+
+def _get_resolver_pool() -> ThreadPoolExecutor:
+    global _resolver_pool
+    if _resolver_pool is None:
+        max_workers = chatbot_setting('CONCURRENT_RESOLUTION_WORKERS', 16)
+        _resolver_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chatbot-resolver')
+    return _resolver_pool
+
 class EnhancedChatBot:
     def __init__(self):
         # Initialize WikimediaClient
         try:
-            self.wikimedia = WikimediaClient()
-            logger.info("WikimediaClient initialized successfully")
+            self.wikimedia = create_wikimedia_client()
+            logger.info(f"{type(self.wikimedia).__name__} initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize WikimediaClient: {e}")
             self.wikimedia = None
@@ -35,32 +54,58 @@ class EnhancedChatBot:
             'find information', 'wikipedia', 'wiki', 'explain',
             'definition of', 'meaning of', 'about'
         ]
+        # Search keywords that ask for a detailed answer rather than a list of results
+        self.detail_keywords = ['what is', 'who is', 'tell me about']
+        self.greeting_keywords = ['hello', 'hi', 'hey', 'greetings']
+        self.help_keywords = ['help', 'what can you do', 'how do you work']
+        
+        # All keyword lists compiled into one matcher, highest priority first
+        self.router = IntentRouter([
+            ('detail', 100, self.detail_keywords),
+            ('search', 90, [k for k in self.search_keywords if k not in self.detail_keywords]),
+            ('greeting', 30, self.greeting_keywords),
+            ('help', 20, self.help_keywords),
+            ('random', 10, ['random']),
+            ('article', 0, ['article']),
+        ])
+        
+        self.concurrent_resolution = chatbot_setting('CONCURRENT_RESOLUTION', True)
+        self.resolution_timeout = chatbot_setting('CONCURRENT_RESOLUTION_TIMEOUT', 15)
+        # Ask Gemini (with the conversation) about information queries Wikipedia has nothing on
+        self.gemini_fallback = chatbot_setting('INFORMATION_GEMINI_FALLBACK', False)
+    
+    def route(self, message: str) -> Intent:
+        """Work out the intent of a message; compute once and pass it along"""
+        return self.router.route(message)
     
     def should_use_wikimedia(self, message: str) -> bool:
         """Determine if the message should be handled by Wikimedia"""
-        message_lower = message.lower()
-        return any(keyword in message_lower for keyword in self.search_keywords)
+        return self.route(message).uses_wikimedia
     
     def extract_search_term(self, message: str) -> str:
         """Extract the search term from the message"""
-        message_lower = message.lower()
-        for keyword in self.search_keywords:
-            if keyword in message_lower:
-                # Find the position after the keyword and extract the remaining text
-                start_pos = message_lower.find(keyword) + len(keyword)
-                search_term = message[start_pos:].strip()
-                # Remove common question words and punctuation
-                search_term = search_term.lstrip('?.,!').strip()
-                return search_term
-        return message.strip()
+        return self.route(message).search_term
     
     def get_detailed_info(self, search_term: str) -> str:
         """Get detailed information from Wikimedia"""
         if not self.wikimedia:
             return "Couldn't find detailed information (Wikimedia client unavailable)"
         
-        # Try to get page summary first
-        page_summary = self.wikimedia.get_page_summary(search_term)
+        # Try to get page summary first, then fall back to search
+        detailed_info = self.get_summary_info(search_term) or self.get_search_page_info(search_term)
+        if detailed_info:
+            return detailed_info
+        
+        return f"Couldn't find detailed information about '{search_term}'"
+    
+    def get_summary_info(self, search_term: str) -> Optional[str]:
+        """Get detailed information from the Wikipedia page titled after the search term"""
+        return self.format_summary(self.wikimedia.get_page_summary(search_term), search_term)
+    
+    async def aget_summary_info(self, search_term: str) -> Optional[str]:
+        return self.format_summary(await self.wikimedia.aget_page_summary(search_term), search_term)
+    
+    def format_summary(self, page_summary: Optional[dict], search_term: str) -> Optional[str]:
         if page_summary and page_summary.get('extract'):
             title = page_summary.get('title', search_term)
             content = page_summary.get('extract', '')
@@ -75,24 +120,42 @@ class EnhancedChatBot:
                 response += f"\n\n[Read more on Wikipedia]({url})"
             return response
         
-        # Fallback to search if direct page lookup fails
+        return None
+    
+    def get_search_page_info(self, search_term: str) -> Optional[str]:
+        """Get detailed information from the best Wikipedia search result"""
         search_results = self.wikimedia.search_pages(search_term)
         if not search_results:
-            return f"Couldn't find detailed information about '{search_term}'"
+            return None
         
         # Get content from the first search result
         first_result = search_results[0]
         page_id = first_result.get('pageid')
         if page_id:
-            content = self.wikimedia.get_page_content(page_id)
-            if content:
-                title = first_result.get('title', search_term)
-                # Limit content length
-                if len(content) > 1500:
-                    content = content[:1500] + "..."
-                return f"**{title}**\n\n{content}"
+            return self.format_page(first_result, self.wikimedia.get_page_content(page_id), search_term)
         
-        return f"Couldn't find detailed information about '{search_term}'"
+        return None
+    
+    async def aget_search_page_info(self, search_term: str) -> Optional[str]:
+        search_results = await self.wikimedia.asearch_pages(search_term)
+        if not search_results:
+            return None
+        
+        first_result = search_results[0]
+        page_id = first_result.get('pageid')
+        if page_id:
+            return self.format_page(first_result, await self.wikimedia.aget_page_content(page_id), search_term)
+        
+        return None
+    
+    def format_page(self, search_result: dict, content: Optional[str], search_term: str) -> Optional[str]:
+        if not content:
+            return None
+        title = search_result.get('title', search_term)
+        # Limit content length
+        if len(content) > 1500:
+            content = content[:1500] + "..."
+        return f"**{title}**\n\n{content}"
     
     def format_search_results(self, search_results: list) -> str:
         """Format search results for display"""
@@ -116,7 +179,7 @@ class EnhancedChatBot:
         
         return "\n".join(formatted).strip()
     
-    def generate_regular_response(self, message: str, chat_session=None) -> str:
+    def generate_regular_response(self, message: str, chat_session=None, intent: Optional[Intent] = None) -> str:
         """Generate regular chatbot responses using Gemini when available"""
         try:
             # First try Gemini if available
@@ -126,10 +189,23 @@ class EnhancedChatBot:
                     return gemini_response
             
             # Fallback to basic responses if Gemini fails
-            message_lower = message.lower()
+            return self.get_fallback_response(message, intent)
+            
+        except Exception as e:
+            logger.error(f"Error in generate_regular_response: {e}")
+            return "I'm here to help! Ask me anything."
+    
+    def get_fallback_response(self, message: str, intent: Optional[Intent] = None) -> str:
+        """Generate a canned response when Gemini is unavailable"""
+        with metrics.stage('bot.fallback'):
+            return self._get_fallback_response(message, intent)
+    
+    def _get_fallback_response(self, message: str, intent: Optional[Intent] = None) -> str:
+        try:
+            intent = intent or self.route(message)
             
             # Greeting responses
-            if any(word in message_lower for word in ['hello', 'hi', 'hey', 'greetings']):
+            if intent.has('greeting'):
                 greetings = [
                     "Hello! I can help you find information or just chat. What would you like to know?",
                     "Hi there! I'm here to help with your questions or provide information.",
@@ -138,7 +214,7 @@ class EnhancedChatBot:
                 return random.choice(greetings)
             
             # Help responses
-            if any(word in message_lower for word in ['help', 'what can you do', 'how do you work']):
+            if intent.has('help'):
                 return """I can help you with:
 • **Information search**: Ask "What is..." or "Tell me about..." anything
 • **Wikipedia articles**: I can find and summarize Wikipedia content
@@ -148,7 +224,7 @@ class EnhancedChatBot:
 Try asking me something!"""
             
             # Random article
-            if 'random' in message_lower and ('article' in message_lower or 'wikipedia' in message_lower or len(message_lower.split()) <= 2):
+            if intent.has('random') and (intent.has('article') or intent.has('search') or len(message.split()) <= 2):
                 if self.wikimedia:
                     random_page = self.wikimedia.get_random_page()
                     if random_page:
@@ -175,39 +251,288 @@ Try asking me something!"""
             return random.choice(default_responses)
             
         except Exception as e:
-            logger.error(f"Error in generate_regular_response: {e}")
+            logger.error(f"Error in get_fallback_response: {e}")
             return "I'm here to help! Ask me anything."
     
-    def get_response(self, message: str, chat_session=None) -> str:
+    def get_wikimedia_response(self, message: str, include_gemini: bool = False,
+                               intent: Optional[Intent] = None, chat_session=None) -> Optional[str]:
+        """Answer information queries from Wikimedia, or None if Wikimedia doesn't apply
+        
+        When Wikipedia has nothing and include_gemini is set, Gemini answers
+        instead, with the chat session's conversation; it is only asked once
+        every Wikipedia source has come back empty.
+        """
+        intent = intent or self.route(message)
+        if not self.wikimedia_applies(intent):
+            return None
+        
+        answer = self.resolve_information(message, intent)
+        if answer:
+            return answer
+        
+        if include_gemini and self.gemini:
+            answer = self.gemini.generate_response(message, chat_session)
+            if answer:
+                return answer
+        return self.not_found_response(intent.search_term)
+    
+    def wikimedia_applies(self, intent: Intent) -> bool:
+        """Whether a message is an information query with something to look up, and Wikimedia is there"""
+        search_term = intent.search_term
+        return bool(self.wikimedia) and intent.uses_wikimedia and bool(search_term) and len(search_term) > 1
+    
+    def not_found_response(self, search_term: str) -> str:
+        return f"I couldn't find any information about '{search_term}'. Try rephrasing your question or checking the spelling."
+    
+    def resolve_information(self, message: str, intent: Intent) -> Optional[str]:
+        """The Wikipedia answer to an information query, or None if there is none"""
+        if self.concurrent_resolution:
+            return self.resolve_concurrently(message, intent)
+        
+        # For specific "what is/who is/tell me about" queries, get detailed info
+        if intent.name == 'detail':
+            detailed_info = self.get_summary_info(intent.search_term) or self.get_search_page_info(intent.search_term)
+            if detailed_info:
+                return detailed_info
+        
+        # For other search queries, show search results
+        search_results = self.wikimedia.search_pages(intent.search_term)
+        return self.format_search_results(search_results) if search_results else None
+    
+    def get_information_candidates(self, message: str, intent: Intent) -> List[Tuple[str, Callable[[], Optional[str]]]]:
+        """List the (name, resolver) sources for an information query, highest priority first
+        
+        Each resolver returns an answer, or None when its source has nothing good.
+        """
+        search_term = intent.search_term
+        candidates = []
+        
+        # For specific "what is/who is/tell me about" queries, get detailed info
+        if intent.name == 'detail':
+            candidates.append(('summary', lambda: self.get_summary_info(search_term)))
+            candidates.append(('search_page', lambda: self.get_search_page_info(search_term)))
+        
+        # For other search queries, show search results
+        def search_results():
+            results = self.wikimedia.search_pages(search_term)
+            return self.format_search_results(results) if results else None
+        candidates.append(('search', search_results))
+        
+        return candidates
+    
+    def get_async_information_candidates(self, intent: Intent) -> List[Tuple[str, Callable[[], Awaitable[Optional[str]]]]]:
+        """get_information_candidates, with resolvers for the async Wikimedia lookups"""
+        search_term = intent.search_term
+        candidates = []
+        
+        if intent.name == 'detail':
+            candidates.append(('summary', lambda: self.aget_summary_info(search_term)))
+            candidates.append(('search_page', lambda: self.aget_search_page_info(search_term)))
+        
+        async def search_results():
+            results = await self.wikimedia.asearch_pages(search_term)
+            return self.format_search_results(results) if results else None
+        candidates.append(('search', search_results))
+        
+        return candidates
+    
+    def resolve_concurrently(self, message: str, intent: Intent) -> Optional[str]:
+        """Query all candidate sources in parallel and return the best good answer, or None
+        
+        An answer is returned as soon as every higher-priority source has come
+        back empty, and the remaining lookups are cancelled. Lookups that are
+        already running can't be interrupted; they finish in the background and
+        only warm the Wikimedia cache.
+        """
+        search_term = intent.search_term
+        candidates = self.get_information_candidates(message, intent)
+        pool = _get_resolver_pool()
+        # Each lookup runs in a copy of this context so its stage timings reach the request's trace
+        futures = [(name, pool.submit(contextvars.copy_context().run, resolver)) for name, resolver in candidates]
+        pending = {future for _, future in futures}
+        
+        try:
+            while True:
+                # Walk the sources by priority until one is still in flight
+                for name, future in futures:
+                    if not future.done():
+                        break
+                    try:
+                        answer = future.result()
+                    except Exception as e:
+                        logger.error(f"Error resolving '{search_term}' from {name}: {e}")
+                        continue
+                    if answer:
+                        logger.debug(f"Resolved '{search_term}' from {name}")
+                        return answer
+                else:
+                    break
+                
+                # Never wait past the request deadline
+                left = resilience.remaining()
+                timeout = self.resolution_timeout if left is None else max(0.0, min(self.resolution_timeout, left))
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    logger.warning(f"Timed out resolving '{search_term}'")
+                    break
+        finally:
+            for _, future in futures:
+                future.cancel()
+        
+        return None
+    
+    async def aresolve_information(self, message: str, intent: Intent) -> Optional[str]:
+        """resolve_information for async views
+        
+        With a client that has async lookups, every source is queried at once
+        as a task on the event loop and the best good answer is returned as in
+        resolve_concurrently; the lookups left over are cancelled, requests and
+        all. Otherwise the blocking resolution runs in a worker thread.
+        """
+        if not self.wikimedia.supports_async:
+            return await sync_to_async(self.resolve_information, thread_sensitive=False)(message, intent)
+        
+        search_term = intent.search_term
+        candidates = self.get_async_information_candidates(intent)
+        if not self.concurrent_resolution:
+            for name, resolver in candidates:
+                answer = await resolver()
+                if answer:
+                    return answer
+            return None
+        
+        tasks = [(name, asyncio.ensure_future(resolver())) for name, resolver in candidates]
+        try:
+            # Sources are taken by priority, so wait for each in turn; the rest keep running meanwhile
+            for name, task in tasks:
+                left = resilience.remaining()
+                timeout = self.resolution_timeout if left is None else max(0.0, min(self.resolution_timeout, left))
+                done, _ = await asyncio.wait({task}, timeout=timeout)
+                if not done:
+                    logger.warning(f"Timed out resolving '{search_term}'")
+                    break
+                try:
+                    answer = task.result()
+                except Exception as e:
+                    logger.error(f"Error resolving '{search_term}' from {name}: {e}")
+                    continue
+                if answer:
+                    logger.debug(f"Resolved '{search_term}' from {name}")
+                    return answer
+        finally:
+            for _, task in tasks:
+                task.cancel()
+        
+        return None
+    
+    def get_response(self, message: str, chat_session=None, intent: Optional[Intent] = None) -> str:
         """Main method to generate bot response"""
         try:
             if not message or not message.strip():
                 return "Please ask me something!"
             
             message = message.strip()
+            intent = intent or self.route(message)
             
-            # Check if we should use Wikimedia for information search
-            if self.should_use_wikimedia(message):
-                search_term = self.extract_search_term(message)
-                
-                if search_term and len(search_term) > 1:
-                    # For specific "what is/who is/tell me about" queries, get detailed info
-                    if any(phrase in message.lower() for phrase in ['what is', 'who is', 'tell me about']):
-                        detailed_info = self.get_detailed_info(search_term)
-                        if "couldn't find detailed information" not in detailed_info.lower():
-                            return detailed_info
-                    
-                    # For other search queries, show search results
-                    if self.wikimedia:
-                        search_results = self.wikimedia.search_pages(search_term)
-                        if search_results:
-                            return self.format_search_results(search_results)
-                        else:
-                            return f"I couldn't find any information about '{search_term}'. Try rephrasing your question or checking the spelling."
+            with metrics.stage('bot.resolve') as timing:
+                wikimedia_response = self.get_wikimedia_response(
+                    message, include_gemini=self.gemini_fallback, intent=intent, chat_session=chat_session
+                )
+                timing.outcome = 'answered' if wikimedia_response else 'skipped'
+            if wikimedia_response:
+                return wikimedia_response
             
             # For non-search queries, use Gemini or fallback responses
-            return self.generate_regular_response(message, chat_session)
+            return self.generate_regular_response(message, chat_session, intent)
             
         except Exception as e:
             logger.error(f"Error in get_response: {e}")
-            return "Sorry, I encountered an error while processing your request. Please try again."
\ No newline at end of file
+            return "Sorry, I encountered an error while processing your request. Please try again."
+    
+    def fold_context(self, chat_session, background: bool = True):
+        """Fold the turns that scrolled out of the Gemini context into the session's summary
+        
+        Call once a reply has been saved, so summarizing never holds one up;
+        with `background`, the fold runs in a thread and this returns at once.
+        """
+        if not self.gemini or chat_session is None:
+            return
+        if background:
+            self.gemini.context.fold_later(chat_session.pk)
+        else:
+            self.gemini.context.fold_due(chat_session)
+    
+    def stream_response(self, message: str, chat_session=None,
+                        intent: Optional[Intent] = None) -> Iterator[Tuple[str, str]]:
+        """Yield (event, text) pairs for the bot response as soon as each part is ready
+        
+        Wikimedia answers arrive as a single 'wikipedia' event, Gemini output as
+        a series of 'chunk' events, and canned fallbacks as a single 'fallback' event.
+        """
+        try:
+            if not message or not message.strip():
+                yield 'fallback', "Please ask me something!"
+                return
+            
+            message = message.strip()
+            intent = intent or self.route(message)
+            
+            with metrics.stage('bot.resolve') as timing:
+                information = self.wikimedia_applies(intent)
+                wikimedia_response = self.resolve_information(message, intent) if information else None
+                timing.outcome = 'answered' if wikimedia_response else 'skipped'
+            yield from self._stream_resolved(message, chat_session, intent, information, wikimedia_response)
+                
+        except Exception as e:
+            logger.error(f"Error in stream_response: {e}")
+            yield 'fallback', "Sorry, I encountered an error while processing your request. Please try again."
+    
+    async def astream_response(self, message: str, chat_session=None,
+                               intent: Optional[Intent] = None) -> AsyncIterator[Tuple[str, str]]:
+        """stream_response for async views
+        
+        Wikimedia is queried on the event loop through aresolve_information;
+        only the blocking Gemini stream is pulled from worker threads, a part at a time.
+        """
+        try:
+            if not message or not message.strip():
+                yield 'fallback', "Please ask me something!"
+                return
+            
+            message = message.strip()
+            intent = intent or self.route(message)
+            
+            with metrics.stage('bot.resolve') as timing:
+                information = self.wikimedia_applies(intent)
+                wikimedia_response = await self.aresolve_information(message, intent) if information else None
+                timing.outcome = 'answered' if wikimedia_response else 'skipped'
+            parts = self._stream_resolved(message, chat_session, intent, information, wikimedia_response)
+            next_part = sync_to_async(next, thread_sensitive=False)
+            while True:
+                part = await next_part(parts, None)
+                if part is None:
+                    break
+                yield part
+                
+        except Exception as e:
+            logger.error(f"Error in astream_response: {e}")
+            yield 'fallback', "Sorry, I encountered an error while processing your request. Please try again."
+    
+    def _stream_resolved(self, message: str, chat_session, intent: Intent, information: bool,
+                         wikimedia_response: Optional[str]) -> Iterator[Tuple[str, str]]:
+        """The rest of the response once Wikimedia has been asked"""
+        if wikimedia_response:
+            yield 'wikipedia', wikimedia_response
+            return
+        if information and not (self.gemini_fallback and self.gemini):
+            yield 'wikipedia', self.not_found_response(intent.search_term)
+            return
+        
+        streamed = False
+        if self.gemini:
+            for text in self.gemini.generate_response_stream(message, chat_session):
+                streamed = True
+                yield 'chunk', text
+        
+        if not streamed:
+            yield 'fallback', self.get_fallback_response(message, intent)
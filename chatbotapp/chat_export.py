@@ -0,0 +1,276 @@
+# chatbot/chat_export.py
+# Export and import of chat history as JSONL: a header line, then for each
+# chat session a 'session' line followed by one 'message' line per message, in
+# order. Exports are generated while they are sent or written, reading the
+# database with .iterator(), so memory stays flat however long the history.
+# Imports insert with bulk_create in batches and give every session and
+# message a new id, so a file can be loaded next to the data it came from.
+import datetime
+import gzip
+import json
+import logging
+import time
+import uuid
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .conf import chatbot_setting
+from .models import MESSAGE_PREVIEW_LENGTH, ChatSession, Message
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+SESSION_FIELDS = [
+    'id', 'session_name', 'created_at', 'updated_at', 'is_active',
+    'context_summary', 'context_summary_until', 'context_summary_last_id',
+]
+MESSAGE_FIELDS = ['id', 'message_type', 'content', 'timestamp', 'is_read', 'metadata']
+COUNTER_FIELDS = [
+    'message_count', 'user_message_count', 'bot_message_count',
+    'last_message_preview', 'last_message_at',
+]
+
+
+class _ExportEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder, keeping the microseconds it would cut timestamps down from"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _line(record: Dict) -> str:
+    return json.dumps(record, cls=_ExportEncoder, ensure_ascii=False) + '\n'
+
+
+def export_lines(sessions, username: Optional[str] = None, chunk_size: Optional[int] = None) -> Iterator[str]:
+    """The JSONL lines of a queryset of chat sessions with their messages"""
+    chunk_size = chunk_size or chatbot_setting('EXPORT_CHUNK_SIZE', 2000)
+    yield _line({'type': 'export', 'format': FORMAT_VERSION, 'exported_at': timezone.now(), 'user': username})
+    rows = sessions.order_by('created_at', 'id').values(*SESSION_FIELDS, 'user__username')
+    for row in rows.iterator(chunk_size=chunk_size):
+        session_id = row['id']
+        yield _line({'type': 'session', 'user': row.pop('user__username'), **row})
+        messages = (
+            Message.objects.filter(chat_session_id=session_id)
+            .order_by('timestamp', 'id').values(*MESSAGE_FIELDS)
+        )
+        for message in messages.iterator(chunk_size=chunk_size):
+            yield _line({'type': 'message', 'session': session_id, **message})
+
+
+def export_chunks(lines: Iterable[str], compress: bool = False, chunk_bytes: int = 64 * 1024) -> Iterator[bytes]:
+    """Encode lines into chunks of about chunk_bytes, gzipped if asked to"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    buffer = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= chunk_bytes:
+            chunk = b''.join(buffer)
+            buffer, size = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+    chunk = b''.join(buffer)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def open_export(path: str, stdin=None):
+    """A binary file object for an export file, gunzipping it if it is compressed"""
+    raw = stdin if path == '-' else open(path, 'rb')
+    if raw.peek(2)[:2] == b'\x1f\x8b':
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    return raw
+
+
+class InvalidExport(ValueError):
+    """A line of an export file that cannot be imported"""
+
+
+class ImportStats:
+    """What an import has inserted so far, and how fast"""
+
+    def __init__(self):
+        self.sessions = 0
+        self.messages = 0
+        self.unknown_users = set()
+        self.started = time.perf_counter()
+
+    @property
+    def seconds(self) -> float:
+        return time.perf_counter() - self.started
+
+    def __str__(self):
+        rows = self.sessions + self.messages
+        return (
+            f"{self.sessions} sessions and {self.messages} messages in {self.seconds:.1f}s "
+            f"({rows / self.seconds if self.seconds else 0:,.0f} rows/s)"
+        )
+
+
+class _SessionImport:
+    """The session being imported, with what its messages add up to"""
+
+    def __init__(self, session: ChatSession, old_id: str, summary_last_id: int):
+        self.session = session
+        self.old_id = old_id
+        self.updated_at = session.updated_at or timezone.now()
+        self.summary_last_id = summary_last_id
+        self.summary_message: Optional[Message] = None
+        self.counts = {'user': 0, 'bot': 0, 'system': 0}
+        self.last: Optional[Message] = None
+        self.last_with_content: Optional[Message] = None
+
+    def add(self, message: Message, old_id: Optional[int]):
+        self.counts[message.message_type] = self.counts.get(message.message_type, 0) + 1
+        # Messages come in (timestamp, id) order
+        self.last = message
+        if message.content:
+            self.last_with_content = message
+        if old_id is not None and old_id == self.summary_last_id:
+            self.summary_message = message
+
+    def finish(self):
+        """Set the counters, and the summary's last message to its new id (inserted by now)"""
+        session = self.session
+        session.message_count = sum(self.counts.values())
+        session.user_message_count = self.counts['user']
+        session.bot_message_count = self.counts['bot']
+        session.last_message_at = self.last.timestamp if self.last else None
+        session.last_message_preview = (
+            self.last_with_content.content[:MESSAGE_PREVIEW_LENGTH] if self.last_with_content else ''
+        )
+        # auto_now set updated_at on insert; bulk_update() puts the exported one back
+        session.updated_at = self.updated_at
+        if self.summary_message is not None and self.summary_message.pk:
+            session.context_summary_last_id = self.summary_message.pk
+        else:
+            # Summarized up to a message that was not imported (or whose new id the
+            # database did not return): let the context window summarize afresh
+            session.context_summary = ''
+            session.context_summary_until = None
+            session.context_summary_last_id = 0
+
+
+class HistoryImporter:
+    """Insert the sessions and messages of an export, batch_size rows per transaction
+
+    Sessions belong to `user` if given, else to the user with the exported
+    username (or to nobody, when there is no such user).
+    """
+
+    def __init__(self, user: Optional[User] = None, batch_size: Optional[int] = None, progress=None):
+        self.user = user
+        self.batch_size = batch_size or chatbot_setting('IMPORT_BATCH_SIZE', 1000)
+        self.progress = progress
+        self.stats = ImportStats()
+        self._users: Dict[str, Optional[int]] = {}
+        self._current: Optional[_SessionImport] = None
+        self._new_sessions: List[ChatSession] = []
+        self._new_messages: List[Message] = []
+        self._finished: List[_SessionImport] = []
+
+    def _user_id(self, username: Optional[str]) -> Optional[int]:
+        if self.user is not None:
+            return self.user.pk
+        if not username:
+            return None
+        if username not in self._users:
+            self._users[username] = User.objects.filter(username=username).values_list('pk', flat=True).first()
+            if self._users[username] is None:
+                self.stats.unknown_users.add(username)
+        return self._users[username]
+
+    @staticmethod
+    def _fields(model, record: Dict, names: List[str]) -> Dict:
+        values = {}
+        for name in names:
+            if name in record:
+                values[name] = model._meta.get_field(name).to_python(record[name])
+        return values
+
+    def _start_session(self, record: Dict):
+        self._finish_session()
+        values = self._fields(ChatSession, record, SESSION_FIELDS)
+        old_id = str(values.pop('id', ''))
+        summary_last_id = values.pop('context_summary_last_id', 0)
+        session = ChatSession(id=uuid.uuid4(), user_id=self._user_id(record.get('user')), **values)
+        self._current = _SessionImport(session, old_id, summary_last_id)
+        self._new_sessions.append(session)
+
+    def _add_message(self, record: Dict):
+        current = self._current
+        if current is None or str(ChatSession._meta.pk.to_python(record.get('session'))) != current.old_id:
+            raise InvalidExport("A message line does not follow its session's line")
+        values = self._fields(Message, record, MESSAGE_FIELDS)
+        old_id = values.pop('id', None)
+        message = Message(chat_session_id=current.session.pk, **values)
+        # bulk_create() skips Message.save(), which renders the HTML
+        message.render()
+        current.add(message, old_id)
+        self._new_messages.append(message)
+        if len(self._new_messages) >= self.batch_size:
+            self._flush()
+
+    def _finish_session(self):
+        if self._current is not None:
+            self._finished.append(self._current)
+            self._current = None
+            if len(self._finished) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if not (self._new_sessions or self._new_messages or self._finished):
+            return
+        with transaction.atomic():
+            ChatSession.objects.bulk_create(self._new_sessions)
+            Message.objects.bulk_create(self._new_messages)
+            for finished in self._finished:
+                finished.finish()
+            ChatSession.objects.bulk_update(
+                [finished.session for finished in self._finished],
+                COUNTER_FIELDS + ['updated_at', 'context_summary', 'context_summary_until', 'context_summary_last_id'],
+            )
+        self.stats.sessions += len(self._new_sessions)
+        self.stats.messages += len(self._new_messages)
+        self._new_sessions, self._new_messages, self._finished = [], [], []
+        if self.progress:
+            self.progress(self.stats)
+
+    def run(self, lines: Iterable) -> ImportStats:
+        """Import the lines of an export; raises InvalidExport for one it cannot"""
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                kind = record.get('type')
+                if kind == 'export':
+                    if record.get('format') != FORMAT_VERSION:
+                        raise InvalidExport(f"Unsupported export format {record.get('format')!r}")
+                elif kind == 'session':
+                    self._start_session(record)
+                elif kind == 'message':
+                    self._add_message(record)
+                else:
+                    raise InvalidExport(f"Unknown line type {kind!r}")
+            except InvalidExport as e:
+                raise InvalidExport(f"Line {number}: {e}") from None
+            except (ValueError, TypeError, AttributeError) as e:
+                raise InvalidExport(f"Line {number}: {e}") from e
+        self._finish_session()
+        self._flush()
+        return self.stats
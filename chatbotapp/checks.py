@@ -0,0 +1,29 @@
+# chatbot/checks.py
+from django.conf import settings
+from django.core import checks
+from django.core.cache import InvalidCacheBackendError
+from django.core.exceptions import ImproperlyConfigured
+
+from .conf import COORDINATION_CACHE_SETTINGS, coordination_cache, is_process_local
+
+
+@checks.register(checks.Tags.caches)
+def check_coordination_caches(app_configs, **kwargs):
+    """Rate limits, Gemini admission and Wikimedia fetch locks need atomic add() and incr()"""
+    messages = []
+    local = []
+    for setting_name in COORDINATION_CACHE_SETTINGS:
+        try:
+            cache = coordination_cache(setting_name)
+        except (ImproperlyConfigured, InvalidCacheBackendError) as e:
+            messages.append(checks.Error(str(e), id='chatbotapp.E001'))
+            continue
+        if is_process_local(cache):
+            local.append(setting_name)
+    if local and not settings.DEBUG:
+        messages.append(checks.Warning(
+            f"{', '.join(local)} name a local memory cache, so each process counts on its own",
+            hint="Set CHATBOT_REDIS_URL when running more than one worker process.",
+            id='chatbotapp.W001',
+        ))
+    return messages
@@ -0,0 +1,41 @@
+# chatbot/conf.py
+# The app's own settings, all kept in the CHATBOT_SETTINGS dict, and the
+# cache that processes coordinate through
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+# Rate limit counters, Gemini token buckets and Wikimedia fetch locks
+COORDINATION_CACHE_SETTINGS = ['RATE_LIMIT_CACHE_ALIAS', 'ADMISSION_CACHE_ALIAS', 'WIKIMEDIA_LOCK_CACHE_ALIAS']
+
+# add() and incr() read and then write, so concurrent callers overdraw or go uncounted
+NON_ATOMIC_CACHES = (FileBasedCache, DatabaseCache, DummyCache)
+
+
+def chatbot_setting(name, default=None):
+    """CHATBOT_SETTINGS[name], or default when it is not set"""
+    return getattr(settings, 'CHATBOT_SETTINGS', {}).get(name, default)
+
+
+def coordination_cache(setting_name: str, alias=None):
+    """The cache named by a *_CACHE_ALIAS setting, for counters and locks
+
+    Raises ImproperlyConfigured for a backend without atomic add() and incr().
+    """
+    alias = alias or chatbot_setting(setting_name, 'coordination')
+    cache = caches[alias]
+    if isinstance(cache, NON_ATOMIC_CACHES):
+        raise ImproperlyConfigured(
+            f"{setting_name} names the '{alias}' cache, whose {type(cache).__name__} backend has no atomic "
+            f"add() and incr(); use Redis, Memcached or the local memory cache"
+        )
+    return cache
+
+
+def is_process_local(cache) -> bool:
+    """Whether a cache is only seen by the process itself"""
+    return isinstance(cache, LocMemCache)
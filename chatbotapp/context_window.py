@@ -0,0 +1,275 @@
+# chatbot/context_window.py
+# Builds the conversation context sent to Gemini from a chat session's stored
+# messages. Turns go in verbatim, newest first, under a token budget; older
+# turns are folded, a batch at a time, into a rolling summary kept on the
+# ChatSession, so the prompt stays the same size however long the chat gets.
+# Folding happens after a reply has been saved, never while one is being generated.
+import logging
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.db import connection
+from django.db.models import Q
+
+from . import metrics
+from .conf import chatbot_setting
+from .conversation_pool import ConversationPool
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREAMBLE = "Summary of our conversation so far:"
+SUMMARY_ACKNOWLEDGEMENT = "Understood, I'll keep that in mind."
+
+_fold_pool = None
+_fold_pool_lock = threading.Lock()
+
+
+def _get_fold_pool() -> ThreadPoolExecutor:
+    global _fold_pool
+    if _fold_pool is None:
+        with _fold_pool_lock:
+            if _fold_pool is None:
+                _fold_pool = ThreadPoolExecutor(
+                    max_workers=chatbot_setting('CONTEXT_FOLD_WORKERS', 2), thread_name_prefix='chatbot-fold'
+                )
+    return _fold_pool
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count; Gemini averages about four characters per token for English"""
+    return math.ceil(len(text) / chatbot_setting('CONTEXT_CHARS_PER_TOKEN', 4)) if text else 0
+
+
+def truncate_tokens(text: str, tokens: int) -> str:
+    """Cut text down to about `tokens` tokens, at a word boundary where possible"""
+    limit = tokens * chatbot_setting('CONTEXT_CHARS_PER_TOKEN', 4)
+    if len(text) <= limit:
+        return text
+    cut = text[:limit].rsplit(' ', 1)[0]
+    return f"{cut}…"
+
+
+def to_turns(rows: List[Tuple[int, str, str]]) -> List[Dict]:
+    """Gemini contents from (id, message_type, content) rows in chronological order"""
+    turns = []
+    for _, message_type, content in rows:
+        role = 'user' if message_type == 'user' else 'model'
+        # Gemini expects alternating roles, so merge consecutive messages
+        if turns and turns[-1]['role'] == role:
+            turns[-1]['parts'][0] += f"\n\n{content}"
+        else:
+            turns.append({'role': role, 'parts': [content]})
+    return turns
+
+
+def extractive_summary(previous: str, rows: List[Tuple[int, str, str]], tokens: int) -> str:
+    """Fallback summary when Gemini can't write one: the start of each folded message"""
+    per_message = max(8, tokens // max(1, len(rows)))
+    lines = [
+        f"{'User' if message_type == 'user' else 'Assistant'}: {truncate_tokens(content, per_message)}"
+        for _, message_type, content in rows
+    ]
+    # Newer lines win when the summary is over budget
+    summary = '\n'.join(filter(None, [previous, *lines]))
+    limit = tokens * chatbot_setting('CONTEXT_CHARS_PER_TOKEN', 4)
+    if len(summary) > limit:
+        summary = summary[-limit:].partition('\n')[2]
+    return summary
+
+
+class ContextWindow:
+    """Token-budgeted Gemini context for a chat session
+
+    build() sends the summary and then every message past the summary
+    watermark, newest first until the token budget runs out, taking at most
+    `recent_turns` plus `fold_max_messages` of them from the ConversationPool,
+    which reads them off the (chat_session, timestamp, id) index. Once `fold_batch_turns` turns have scrolled out of
+    the last `recent_turns`, fold_due() folds them, oldest first and
+    `fold_max_messages` at a time, into ChatSession.context_summary by
+    `summarize`. build() never summarizes.
+    """
+
+    def __init__(self, summarize: Optional[Callable[[str], Optional[str]]] = None,
+                 token_budget: Optional[int] = None, recent_turns: Optional[int] = None,
+                 summary_tokens: Optional[int] = None, fold_batch_turns: Optional[int] = None,
+                 fold_max_messages: Optional[int] = None, pool: Optional[ConversationPool] = None):
+        self.summarize = summarize
+        self.pool = pool or ConversationPool()
+        self.token_budget = token_budget or chatbot_setting('CONTEXT_TOKEN_BUDGET', 3000)
+        self.recent_turns = recent_turns or chatbot_setting('CONTEXT_RECENT_TURNS', 6)
+        self.summary_tokens = summary_tokens or chatbot_setting('CONTEXT_SUMMARY_TOKENS', 400)
+        self.fold_batch_turns = fold_batch_turns or chatbot_setting('CONTEXT_FOLD_BATCH_TURNS', 4)
+        self.fold_max_messages = fold_max_messages or chatbot_setting('CONTEXT_FOLD_MAX_MESSAGES', 40)
+        self._folding = set()
+        self._folding_lock = threading.Lock()
+
+    def _unsummarized(self, chat_session, limit: int, oldest_first: bool = False,
+                      before: Optional[Tuple[object, int]] = None) -> List[Tuple[int, str, str, object]]:
+        """Up to `limit` messages after the summary watermark, newest first unless `oldest_first`
+
+        With `before`, a (timestamp, id) position, only the messages before it.
+        """
+        messages = (
+            chat_session.messages
+            .filter(message_type__in=['user', 'bot'])
+            .exclude(content='')
+        )
+        if chat_session.context_summary_until is not None:
+            until = chat_session.context_summary_until
+            messages = messages.filter(
+                Q(timestamp__gt=until) | Q(timestamp=until, id__gt=chat_session.context_summary_last_id)
+            )
+        if before is not None:
+            timestamp, message_id = before
+            messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+        order = ('timestamp', 'id') if oldest_first else ('-timestamp', '-id')
+        return list(
+            messages.order_by(*order)
+            .values_list('id', 'message_type', 'content', 'timestamp')[:limit]
+        )
+
+    def build(self, chat_session, prompt: str) -> List[Dict]:
+        """Gemini contents for sending `prompt` in a chat session: summary, recent turns, prompt"""
+        with metrics.stage('context.build'):
+            rows = self.pool.recent_messages(chat_session, self.recent_turns * 2 + self.fold_max_messages)
+            # The stored message being answered right now is the prompt itself
+            while rows and rows[0][1] == 'user':
+                rows.pop(0)
+
+            prompt_turn = {'role': 'user', 'parts': [prompt]}
+            budget = self.token_budget - estimate_tokens(prompt)
+            contents = []
+            if chat_session.context_summary:
+                # The summary never takes more than half the budget from the recent turns
+                summary = truncate_tokens(chat_session.context_summary,
+                                          min(self.summary_tokens, self.token_budget // 2))
+                budget -= estimate_tokens(summary) + estimate_tokens(SUMMARY_ACKNOWLEDGEMENT)
+                contents = [
+                    {'role': 'user', 'parts': [f"{SUMMARY_PREAMBLE}\n{summary}"]},
+                    {'role': 'model', 'parts': [SUMMARY_ACKNOWLEDGEMENT]},
+                ]
+
+            # Everything the summary doesn't cover yet, newest first, until the budget runs out
+            kept = []
+            for row in rows:
+                cost = estimate_tokens(row[2])
+                if cost > budget:
+                    break
+                budget -= cost
+                kept.append(row[:3])
+            turns = to_turns(list(reversed(kept)))
+            # History has to start with the user and end with the model
+            while turns and turns[0]['role'] != 'user':
+                turns.pop(0)
+            while turns and turns[-1]['role'] != 'model':
+                turns.pop()
+            return contents + turns + [prompt_turn]
+
+    def fold_due(self, chat_session):
+        """Fold the turns that have scrolled out of the last `recent_turns`, once there are enough
+
+        They are folded oldest first, `fold_max_messages` at a time, so a long
+        backlog (e.g. from before summaries existed) is summarized in order and
+        the watermark never passes a message that wasn't folded.
+        """
+        recent = self._unsummarized(chat_session, self.recent_turns * 2)
+        if len(recent) < self.recent_turns * 2:
+            return
+        oldest_recent = recent[-1]
+        before = (oldest_recent[3], oldest_recent[0])
+
+        minimum = self.fold_batch_turns * 2
+        batch_size = max(self.fold_max_messages, minimum)
+        while True:
+            rows = self._unsummarized(chat_session, batch_size, oldest_first=True, before=before)
+            if len(rows) < minimum:
+                return
+            if not self.fold(chat_session, rows):
+                return
+            # Once a batch is due, so is the rest of the backlog
+            minimum = 1
+
+    def fold_later(self, chat_session_id):
+        """fold_due() in a background thread, for after a reply has been sent"""
+        with self._folding_lock:
+            # One fold per session at a time; the next reply catches up on the rest
+            if chat_session_id in self._folding:
+                return
+            self._folding.add(chat_session_id)
+        try:
+            _get_fold_pool().submit(self._fold_in_background, chat_session_id)
+        except RuntimeError:
+            # The pool is shut down with the interpreter
+            with self._folding_lock:
+                self._folding.discard(chat_session_id)
+
+    def _fold_in_background(self, chat_session_id):
+        from .models import ChatSession
+
+        try:
+            chat_session = ChatSession.objects.filter(pk=chat_session_id).first()
+            if chat_session is not None:
+                self.fold_due(chat_session)
+        except Exception as e:
+            logger.error(f"Error folding the context of chat session {chat_session_id}: {e}")
+        finally:
+            with self._folding_lock:
+                self._folding.discard(chat_session_id)
+            connection.close()
+
+    def fold(self, chat_session, rows: List[Tuple[int, str, str, object]]) -> bool:
+        """Fold older messages (chronological) into the session's rolling summary
+
+        Returns False when another fold of the session got there first.
+        """
+        from .models import ChatSession
+
+        with metrics.stage('context.fold') as timing:
+            messages = [row[:3] for row in rows]
+            summary = None
+            if self.summarize:
+                summary = self.summarize(self.summary_prompt(chat_session.context_summary, messages))
+            if summary:
+                summary = truncate_tokens(summary.strip(), self.summary_tokens)
+            else:
+                timing.outcome = 'extractive'
+                summary = extractive_summary(chat_session.context_summary, messages, self.summary_tokens)
+
+            last_id, _, _, last_timestamp = rows[-1]
+            # Another turn of the same session may have folded these already
+            updated = ChatSession.objects.filter(
+                pk=chat_session.pk, context_summary_last_id=chat_session.context_summary_last_id
+            ).update(
+                context_summary=summary,
+                context_summary_until=last_timestamp,
+                context_summary_last_id=last_id,
+            )
+            if not updated:
+                timing.outcome = 'conflict'
+                chat_session.refresh_from_db(
+                    fields=['context_summary', 'context_summary_until', 'context_summary_last_id']
+                )
+                return False
+            chat_session.context_summary = summary
+            chat_session.context_summary_until = last_timestamp
+            chat_session.context_summary_last_id = last_id
+            logger.info(f"Folded {len(rows)} messages into the summary of chat session {chat_session.pk}")
+            return True
+
+    def summary_prompt(self, previous: str, rows: List[Tuple[int, str, str]]) -> str:
+        words = int(self.summary_tokens * 0.75)
+        transcript = '\n'.join(
+            f"{'User' if message_type == 'user' else 'Assistant'}: {truncate_tokens(content, self.summary_tokens)}"
+            for _, message_type, content in rows
+        )
+        return f"""Update the running summary of a conversation between a user and an assistant.
+
+Current summary:
+{previous or '(none yet)'}
+
+New messages:
+{transcript}
+
+Write the updated summary in at most {words} words. Keep names, facts, preferences and open questions the assistant will need later. Reply with the summary only."""
@@ -0,0 +1,160 @@
+# chatbot/conversation_pool.py
+# Per-process pool of chat sessions' recent history, for building Gemini
+# contexts. A hit reads only the messages newer than what the entry already
+# holds instead of the whole window; entries are evicted by LRU order and idle
+# time, and each holds a bounded number of messages.
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.db.models import Q
+
+from . import metrics
+from .conf import chatbot_setting
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_POOL_EVENTS = metrics.registry.counter(
+    'chatbot_conversation_pool_events_total', "Lookups in the pool of chat session histories", ['result']
+)
+
+# (id, message_type, content, timestamp)
+Row = Tuple[int, str, str, object]
+
+
+def _position(row: Row) -> tuple:
+    return row[3], row[0]
+
+
+def _watermark(chat_session) -> Optional[tuple]:
+    if chat_session.context_summary_until is None:
+        return None
+    return chat_session.context_summary_until, chat_session.context_summary_last_id
+
+
+class _Conversation:
+    __slots__ = ('watermark', 'limit', 'rows', 'last_used')
+
+    def __init__(self, watermark, limit: int, rows: List[Row]):
+        self.watermark = watermark
+        self.limit = limit
+        self.rows = rows  # Newest first, empty (pending) messages included
+        self.last_used = time.monotonic()
+
+    def synced_from(self) -> Optional[Row]:
+        """The oldest row that has to be read again: the oldest pending one, or else the newest"""
+        pending = [row for row in self.rows if not row[2]]
+        if pending:
+            return pending[-1]
+        return self.rows[0] if self.rows else None
+
+
+class ConversationPool:
+    """The messages past the summary watermark of recently active chat sessions, keyed by ChatSession id
+
+    An entry is good for one summary watermark; when a fold moves the
+    watermark forward, the folded messages are dropped from it, and any other
+    change rebuilds it. Pending bot messages, whose content is filled in
+    later, are read again until they have some. Entries are evicted by LRU
+    order and idle time; at most `max_sessions` are kept, each holding the
+    `limit` newest messages at most.
+    """
+
+    def __init__(self, max_sessions: Optional[int] = None, idle_seconds: Optional[int] = None):
+        self.max_sessions = max_sessions or chatbot_setting('CONVERSATION_POOL_MAX_SESSIONS', 500)
+        self.idle_seconds = idle_seconds or chatbot_setting('CONVERSATION_POOL_IDLE_SECONDS', 30 * 60)
+        self._conversations: 'OrderedDict[str, _Conversation]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _messages(chat_session):
+        messages = chat_session.messages.filter(message_type__in=['user', 'bot'])
+        watermark = _watermark(chat_session)
+        if watermark is not None:
+            until, last_id = watermark
+            messages = messages.filter(Q(timestamp__gt=until) | Q(timestamp=until, id__gt=last_id))
+        return messages.values_list('id', 'message_type', 'content', 'timestamp')
+
+    def _load(self, chat_session, limit: int) -> List[Row]:
+        return list(self._messages(chat_session).order_by('-timestamp', '-id')[:limit])
+
+    def _load_since(self, conversation: _Conversation, chat_session) -> Optional[List[Row]]:
+        """The entry's rows brought up to date, or None if they can't be
+
+        Messages are saved up to a request deadline after their timestamp, so
+        that much before the point synced from is read again too.
+        """
+        synced = conversation.synced_from()
+        if synced is None:
+            return None
+        since = synced[3] - timedelta(seconds=chatbot_setting('REQUEST_DEADLINE_SECONDS', 30))
+        newer = list(
+            self._messages(chat_session)
+            .filter(timestamp__gte=since)
+            .order_by('timestamp', 'id')[:conversation.limit + 1]
+        )
+        # The message synced from is gone (the chat was cleared), or too much is new to patch in
+        if len(newer) > conversation.limit or synced[0] not in {row[0] for row in newer}:
+            return None
+        older = [row for row in conversation.rows if row[3] < since]
+        return (list(reversed(newer)) + older)[:conversation.limit]
+
+    def _usable(self, conversation: _Conversation, chat_session, limit: int, now: float) -> bool:
+        """Whether an entry can serve this request, after dropping any messages folded since"""
+        if now - conversation.last_used >= self.idle_seconds or limit != conversation.limit:
+            return False
+        watermark = _watermark(chat_session)
+        if watermark == conversation.watermark:
+            return True
+        if watermark is None or (conversation.watermark is not None and watermark < conversation.watermark):
+            return False
+        conversation.rows = [row for row in conversation.rows if _position(row) > watermark]
+        conversation.watermark = watermark
+        return True
+
+    def recent_messages(self, chat_session, limit: int) -> List[Row]:
+        """Up to `limit` messages with content after the session's summary watermark, newest first"""
+        key = str(chat_session.pk)
+        now = time.monotonic()
+        with self._lock:
+            conversation = self._conversations.get(key)
+            if conversation is not None and not self._usable(conversation, chat_session, limit, now):
+                conversation = None
+
+        # Read outside the pool lock so a slow query doesn't hold up other sessions
+        rows = self._load_since(conversation, chat_session) if conversation is not None else None
+        CONVERSATION_POOL_EVENTS.inc(result='miss' if rows is None else 'hit')
+        if rows is None:
+            rows = self._load(chat_session, limit)
+
+        with self._lock:
+            self._conversations[key] = _Conversation(_watermark(chat_session), limit, rows)
+            self._conversations.move_to_end(key)
+            self._evict(now)
+        return [row for row in rows if row[2]][:limit]
+
+    def _evict(self, now: float):
+        """Drop idle entries from the LRU end, then the least recently used over the cap"""
+        while self._conversations:
+            conversation = next(iter(self._conversations.values()))
+            if now - conversation.last_used < self.idle_seconds and len(self._conversations) <= self.max_sessions:
+                break
+            self._conversations.popitem(last=False)
+            CONVERSATION_POOL_EVENTS.inc(result='evicted')
+
+    def discard(self, session_id):
+        """Forget a chat session's entry"""
+        with self._lock:
+            self._conversations.pop(str(session_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._conversations.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'size': len(self._conversations), 'max_sessions': self.max_sessions,
+                    'idle_seconds': self.idle_seconds}
@@ -0,0 +1,168 @@
+# chatbot/fake_clients.py
+# Local stand-ins for the Gemini and Wikimedia APIs with configurable latency
+# and error rates, used by the benchmark and load-test commands
+import hashlib
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+
+from . import resilience
+from .gemini_client import GeminiClient, WikimediaClient
+
+
+class FakeUpstream:
+    """Simulated network behaviour of an upstream API"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def call(self, error=RuntimeError, timeout: Optional[float] = None, timeout_error=TimeoutError):
+        """Wait for one simulated round trip, and raise `error` for simulated failures
+        
+        A round trip slower than `timeout` raises `timeout_error` once the timeout has passed.
+        """
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            with self._lock:
+                self.timeouts += 1
+            raise timeout_error("Simulated upstream timeout")
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise error("Simulated upstream failure")
+
+    def stats(self) -> Dict:
+        return {'calls': self.calls, 'errors': self.errors, 'timeouts': self.timeouts}
+
+
+class _FakeGeminiResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """Stands in for genai.GenerativeModel"""
+
+    def __init__(self, upstream: FakeUpstream, chunks: int = 4, system_instruction: Optional[str] = None):
+        self.upstream = upstream
+        self.chunks = chunks
+        self.system_instruction = system_instruction
+
+    def _reply(self, contents) -> str:
+        prompt = contents if isinstance(contents, str) else contents[-1]['parts'][0]
+        digest = hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:8]
+        return f"This is a simulated response ({digest}) to a message of {len(prompt)} characters."
+
+    def generate_content(self, contents, stream: bool = False, request_options: Optional[Dict] = None):
+        self.upstream.call(timeout=(request_options or {}).get('timeout'))
+        text = self._reply(contents)
+        if not stream:
+            return _FakeGeminiResponse(text)
+        size = max(1, len(text) // self.chunks)
+        return [_FakeGeminiResponse(text[i:i + size]) for i in range(0, len(text), size)]
+
+
+class FakeGeminiClient(GeminiClient):
+    """GeminiClient talking to a FakeGenerativeModel instead of the API"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        self.upstream = FakeUpstream(latency, jitter, error_rate, seed)
+        # A breaker of its own, so simulated outages don't trip the real client's
+        self._setup('fake', resilience.CircuitBreaker('gemini'))
+
+    def _new_model(self, system_instruction: Optional[str] = None):
+        return FakeGenerativeModel(self.upstream, system_instruction=system_instruction)
+
+
+class _FakeHttpResponse:
+    def __init__(self, data: Dict):
+        self._data = data
+        self.status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class FakeWikimediaSession:
+    """Answers the MediaWiki API queries WikimediaClient makes with generated pages"""
+
+    def __init__(self, upstream: FakeUpstream):
+        self.upstream = upstream
+
+    @staticmethod
+    def _page_id(title: str) -> int:
+        return int(hashlib.sha1(title.lower().encode('utf-8')).hexdigest()[:7], 16)
+
+    @staticmethod
+    def _extract(title: str) -> str:
+        return f"{title} is the subject of this simulated Wikipedia article. " * 5
+
+    def get(self, url, params=None, timeout=None, **kwargs):
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+        self.upstream.call(error=requests.ConnectionError, timeout=read_timeout, timeout_error=requests.ReadTimeout)
+        params = params or {}
+
+        if params.get('list') == 'search':
+            query = str(params.get('srsearch', ''))
+            titles = [query.title()] + [f"{query.title()} ({kind})" for kind in ('history', 'culture', 'science')]
+            return _FakeHttpResponse({'query': {'search': [
+                {'title': title, 'pageid': self._page_id(title), 'snippet': self._extract(title)[:80]}
+                for title in titles[:int(params.get('srlimit', 5))]
+            ]}})
+
+        if params.get('generator') == 'random':
+            title = f"Random Article {self.upstream.random.randint(1, 10 ** 6)}"
+            page_id = self._page_id(title)
+            return _FakeHttpResponse({'query': {'pages': {
+                str(page_id): {'pageid': page_id, 'title': title, 'extract': self._extract(title)}
+            }}})
+
+        if 'pageids' in params:
+            page_id = params['pageids']
+            return _FakeHttpResponse({'query': {'pages': {
+                str(page_id): {'pageid': page_id, 'title': f"Page {page_id}", 'extract': self._extract(f"Page {page_id}")}
+            }}})
+
+        title = str(params.get('titles', '')).title()
+        page_id = self._page_id(title)
+        return _FakeHttpResponse({'query': {'pages': {
+            str(page_id): {
+                'pageid': page_id,
+                'title': title,
+                'extract': self._extract(title),
+                'fullurl': f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"
+            }
+        }}})
+
+
+class FakeWikimediaClient(WikimediaClient):
+    """WikimediaClient whose HTTP session is a FakeWikimediaSession"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 seed: Optional[int] = None):
+        super().__init__()
+        self.upstream = FakeUpstream(latency, jitter, error_rate, seed)
+        self.session = FakeWikimediaSession(self.upstream)
+        # Breakers of their own, so simulated outages don't trip the real clients'
+        self.breaker = resilience.CircuitBreaker('wikimedia')
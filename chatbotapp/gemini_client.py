@@ -1,111 +1,273 @@
 # chatbot/gemini_client.py
-import google.generativeai as genai
-from typing import Optional
+import requests
 import logging
+from typing import Optional, Dict, List
+from . import metrics, resilience
+from .conf import chatbot_setting
+from .http_transport import AsyncWikimediaTransport, async_transport_available, get_async_transport, get_transport
+from .wikimedia_cache import WikimediaCache
 
 logger = logging.getLogger(__name__)
 
-class GeminiClient:
-    """Client for interacting with Google's Gemini API"""
-    
-    def __init__(self, api_key: str):
-        try:
-            genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-pro')
-            self.chat = None  # For multi-turn conversations
-            logger.info("Gemini client initialized successfully")
-        except Exception as e:
-            logger.error(f"Failed to initialize Gemini client: {e}")
-            raise
-    
-    def generate_response(self, prompt: str, chat_session=None) -> Optional[str]:
-        """Generate a response from Gemini"""
-        try:
-            # If we have a chat session, use it for context
-            if chat_session and hasattr(chat_session, 'id'):
-                if self.chat is None:
-                    self.chat = self.model.start_chat(history=[])
-                
-                response = self.chat.send_message(prompt)
-                return response.text
-            else:
-                # For one-off responses
-                response = self.model.generate_content(prompt)
-                return response.text
-        except Exception as e:
-            logger.error(f"Error in Gemini generate_response: {e}")
-            return None
-    
-    def reset_chat(self):
-        """Reset the conversation history"""
-        self.chat = None
-
 
+def _is_wikimedia_failure(error: Exception) -> bool:
+    """Whether an error says Wikimedia is in trouble (rather than the request being bad)"""
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else 500
+        return status >= 500 or status == 429
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
 
 
-
- # chatbot/wikimedia_client.py
-import requests
-import logging
-from typing import Optional, Dict, List
-
-logger = logging.getLogger(__name__)
-
 class WikimediaClient:
-    """Client for interacting with Wikimedia/Wikipedia APIs"""
+    """Client for interacting with Wikimedia/Wikipedia APIs
+    
+    Requests go through the process-wide pooled transport. The a-prefixed
+    methods are async variants for ASGI views, going through the event loop's
+    async transport; they share the cache, deadline, hedging and circuit breaker.
+    """
     
     def __init__(self):
-        self.base_url = "https://en.wikipedia.org/w/api.php"
-        self.session = requests.Session()
+        self.base_url = chatbot_setting('WIKIMEDIA_API_URL', "https://en.wikipedia.org/w/api.php")
+        self.transport = get_transport()
+        self.session = self.transport.session
+        self.cache = WikimediaCache()
+        self.connect_timeout, self.read_timeout = chatbot_setting('WIKIMEDIA_TIMEOUT', (3.05, 10))
+        self.hedge_delay = chatbot_setting('WIKIMEDIA_HEDGE_DELAY', None)
+        self.hedge_attempts = chatbot_setting('WIKIMEDIA_HEDGE_ATTEMPTS', 2)
+        self.breaker = resilience.get_breaker('wikimedia')
         logger.info("WikimediaClient initialized")
     
+    def _request(self, endpoint: str, params: Dict, hedge: bool = True) -> Dict:
+        """Make one API request, timed as the 'wikimedia.<endpoint>.http' stage
+        
+        The request is bounded by the current deadline and goes through the
+        Wikimedia circuit breaker. Reads are hedged when WIKIMEDIA_HEDGE_DELAY is set.
+        """
+        def attempt():
+            with metrics.stage(f'wikimedia.{endpoint}.http'):
+                return self.breaker.call(lambda: self._get(params), is_failure=_is_wikimedia_failure)
+        
+        return resilience.hedged(
+            attempt, self.hedge_delay if hedge else None, self.hedge_attempts, upstream='wikimedia'
+        )
+    
+    def _timeout(self):
+        return (
+            resilience.timeout_for(self.connect_timeout, 'wikimedia'),
+            resilience.timeout_for(self.read_timeout, 'wikimedia')
+        )
+    
+    def _get(self, params: Dict) -> Dict:
+        response = self.session.get(self.base_url, params=params, timeout=self._timeout())
+        response.raise_for_status()
+        return response.json()
+    
+    @property
+    def supports_async(self) -> bool:
+        """Whether the a-prefixed lookups can be used, which takes httpx"""
+        return async_transport_available()
+    
+    @property
+    def async_transport(self) -> AsyncWikimediaTransport:
+        return get_async_transport()
+    
+    async def _arequest(self, endpoint: str, params: Dict) -> Dict:
+        """Async _request, hedged the same way"""
+        async def attempt():
+            with metrics.stage(f'wikimedia.{endpoint}.http'):
+                return await self.breaker.acall(
+                    lambda: self.async_transport.get_json(self.base_url, params, self._timeout()),
+                    is_failure=_is_wikimedia_failure
+                )
+        
+        return await resilience.ahedged(
+            attempt, self.hedge_delay, self.hedge_attempts, upstream='wikimedia'
+        )
+    
     def search_pages(self, query: str, limit: int = 5) -> List[Dict]:
         """Search Wikipedia pages"""
-        try:
-            params = {
-                'action': 'query',
-                'list': 'search',
-                'srsearch': query,
-                'format': 'json',
-                'srlimit': limit
-            }
-            
-            response = self.session.get(self.base_url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            
-            return data.get('query', {}).get('search', [])
-        except Exception as e:
-            logger.error(f"Error in search_pages: {e}")
-            return []
+        with metrics.stage('wikimedia.search') as timing:
+            try:
+                results = self.cache.get_or_fetch(
+                    'search', (query, limit), lambda: self._fetch_search_pages(query, limit)
+                )
+                if not results:
+                    timing.outcome = 'empty'
+                return results or []
+            except Exception as e:
+                logger.error(f"Error in search_pages: {e}")
+                timing.outcome = 'error'
+                return []
+    
+    async def asearch_pages(self, query: str, limit: int = 5) -> List[Dict]:
+        """Search Wikipedia pages, asynchronously"""
+        with metrics.stage('wikimedia.search') as timing:
+            try:
+                results = await self.cache.aget_or_fetch(
+                    'search', (query, limit), lambda: self._afetch_search_pages(query, limit)
+                )
+                if not results:
+                    timing.outcome = 'empty'
+                return results or []
+            except Exception as e:
+                logger.error(f"Error in asearch_pages: {e}")
+                timing.outcome = 'error'
+                return []
+    
+    def _fetch_search_pages(self, query: str, limit: int) -> List[Dict]:
+        return self._parse_search(self._request('search', self._search_params(query, limit)))
+    
+    async def _afetch_search_pages(self, query: str, limit: int) -> List[Dict]:
+        return self._parse_search(await self._arequest('search', self._search_params(query, limit)))
+    
+    @staticmethod
+    def _search_params(query: str, limit: int) -> Dict:
+        return {
+            'action': 'query',
+            'list': 'search',
+            'srsearch': query,
+            'format': 'json',
+            'srlimit': limit
+        }
+    
+    @staticmethod
+    def _parse_search(data: Dict) -> List[Dict]:
+        return data.get('query', {}).get('search', [])
     
     def get_page_content(self, page_id: int) -> Optional[str]:
         """Get content of a Wikipedia page"""
-        try:
-            params = {
-                'action': 'query',
-                'prop': 'extracts',
-                'pageids': page_id,
-                'format': 'json',
-                'explaintext': True,
-                'exintro': True
+        with metrics.stage('wikimedia.page') as timing:
+            try:
+                content = self.cache.get_or_fetch(
+                    'page', (page_id,), lambda: self._fetch_page_content(page_id),
+                    is_empty=lambda content: content is None
+                )
+                if content is None:
+                    timing.outcome = 'empty'
+                return content
+            except Exception as e:
+                logger.error(f"Error in get_page_content: {e}")
+                timing.outcome = 'error'
+                return None
+    
+    async def aget_page_content(self, page_id: int) -> Optional[str]:
+        """Get content of a Wikipedia page, asynchronously"""
+        with metrics.stage('wikimedia.page') as timing:
+            try:
+                content = await self.cache.aget_or_fetch(
+                    'page', (page_id,), lambda: self._afetch_page_content(page_id),
+                    is_empty=lambda content: content is None
+                )
+                if content is None:
+                    timing.outcome = 'empty'
+                return content
+            except Exception as e:
+                logger.error(f"Error in aget_page_content: {e}")
+                timing.outcome = 'error'
+                return None
+    
+    def _fetch_page_content(self, page_id: int) -> Optional[str]:
+        return self._parse_page_content(self._request('page', self._page_content_params(page_id)), page_id)
+    
+    async def _afetch_page_content(self, page_id: int) -> Optional[str]:
+        return self._parse_page_content(await self._arequest('page', self._page_content_params(page_id)), page_id)
+    
+    @staticmethod
+    def _page_content_params(page_id: int) -> Dict:
+        return {
+            'action': 'query',
+            'prop': 'extracts',
+            'pageids': page_id,
+            'format': 'json',
+            'explaintext': True,
+            'exintro': True
+        }
+    
+    @staticmethod
+    def _parse_page_content(data: Dict, page_id: int) -> Optional[str]:
+        pages = data.get('query', {}).get('pages', {})
+        page = pages.get(str(page_id))
+        # Missing pages come back keyed by their id with a 'missing' flag
+        if page is not None and 'missing' not in page:
+            return page.get('extract', 'No content available')
+        
+        return None
+    
+    def get_page_summary(self, title: str) -> Optional[Dict]:
+        """Get the introduction of the Wikipedia page with the given title"""
+        with metrics.stage('wikimedia.summary') as timing:
+            try:
+                summary = self.cache.get_or_fetch(
+                    'summary', (title,), lambda: self._fetch_page_summary(title),
+                    is_empty=lambda summary: summary is None
+                )
+                if summary is None:
+                    timing.outcome = 'empty'
+                return summary
+            except Exception as e:
+                logger.error(f"Error in get_page_summary: {e}")
+                timing.outcome = 'error'
+                return None
+    
+    async def aget_page_summary(self, title: str) -> Optional[Dict]:
+        """Get the introduction of the Wikipedia page with the given title, asynchronously"""
+        with metrics.stage('wikimedia.summary') as timing:
+            try:
+                summary = await self.cache.aget_or_fetch(
+                    'summary', (title,), lambda: self._afetch_page_summary(title),
+                    is_empty=lambda summary: summary is None
+                )
+                if summary is None:
+                    timing.outcome = 'empty'
+                return summary
+            except Exception as e:
+                logger.error(f"Error in aget_page_summary: {e}")
+                timing.outcome = 'error'
+                return None
+    
+    def _fetch_page_summary(self, title: str) -> Optional[Dict]:
+        return self._parse_page_summary(self._request('summary', self._page_summary_params(title)), title)
+    
+    async def _afetch_page_summary(self, title: str) -> Optional[Dict]:
+        return self._parse_page_summary(await self._arequest('summary', self._page_summary_params(title)), title)
+    
+    @staticmethod
+    def _page_summary_params(title: str) -> Dict:
+        return {
+            'action': 'query',
+            'prop': 'extracts|info',
+            'titles': title,
+            'redirects': 1,
+            'inprop': 'url',
+            'format': 'json',
+            'explaintext': True,
+            'exintro': True
+        }
+    
+    @staticmethod
+    def _parse_page_summary(data: Dict, title: str) -> Optional[Dict]:
+        pages = data.get('query', {}).get('pages', {})
+        for page_id, page in pages.items():
+            if 'missing' in page or 'invalid' in page:
+                continue
+            return {
+                'title': page.get('title', title),
+                'extract': page.get('extract', ''),
+                'url': page.get('fullurl', ''),
+                'pageid': page_id
             }
-            
-            response = self.session.get(self.base_url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            
-            pages = data.get('query', {}).get('pages', {})
-            if str(page_id) in pages:
-                return pages[str(page_id)].get('extract', 'No content available')
-            
-            return None
-        except Exception as e:
-            logger.error(f"Error in get_page_content: {e}")
-            return None
+        
+        return None
     
     def get_random_page(self) -> Optional[Dict]:
         """Get a random Wikipedia page"""
+        with metrics.stage('wikimedia.random') as timing:
+            page = self._get_random_page()
+            if page is None:
+                timing.outcome = 'empty'
+            return page
+    
+    def _get_random_page(self) -> Optional[Dict]:
         try:
             params = {
                 'action': 'query',
@@ -118,10 +280,8 @@ class WikimediaClient:
                 'grnlimit': 1
             }
             
-            response = self.session.get(self.base_url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            
+            # Every call is meant to give a different page, so there is nothing to hedge
+            data = self._request('random', params, hedge=False)
             pages = data.get('query', {}).get('pages', {})
             if pages:
                 page_id = list(pages.keys())[0]
@@ -141,8 +301,15 @@ class WikimediaClient:
 
 # chatbot/gemini_client.py
 import google.generativeai as genai
-from typing import Optional
+from google.api_core import exceptions as google_exceptions
+from typing import Iterator, Optional
 import logging
+import threading
+import time
+from . import admission, metrics, personalities, resilience
+from .conf import chatbot_setting
+from .context_window import ContextWindow, estimate_tokens
+from .response_cache import ResponseCache
 
 logger = logging.getLogger(__name__)
 
@@ -152,46 +319,194 @@ class GeminiClient:
     def __init__(self, api_key: str):
         try:
             genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-pro')
-            self.chat = None  # For multi-turn conversations
+            self._setup(chatbot_setting('GEMINI_MODEL', 'gemini-1.5-flash'), resilience.get_breaker('gemini'))
             logger.info("Gemini client initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize Gemini client: {e}")
             raise
     
-    def generate_response(self, prompt: str, chat_session=None) -> Optional[str]:
-        """Generate a response from Gemini"""
+    def _setup(self, model_name: str, breaker: resilience.CircuitBreaker):
+        """Everything but the API configuration, shared with stand-in clients"""
+        self.model_name = model_name
+        self.model = self._new_model()  # Without a persona, for summaries
+        self._personality_models = {}  # personality id -> (instruction digest, model)
+        self._models_lock = threading.Lock()
+        self.context = ContextWindow(summarize=self.summarize)  # Multi-turn context from stored messages
+        # For prompts asked without earlier turns
+        self.response_cache = ResponseCache() if chatbot_setting('RESPONSE_CACHE_ENABLED', True) else None
+        self.timeout = chatbot_setting('GEMINI_TIMEOUT', 30)
+        self.breaker = breaker
+        self.admission = admission.get_controller('gemini')
+        self.expected_output_tokens = chatbot_setting('GEMINI_EXPECTED_OUTPUT_TOKENS', 512)
+    
+    def _new_model(self, system_instruction: Optional[str] = None):
+        return genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
+    
+    def model_for(self, template: personalities.PromptTemplate):
+        """The model answering in a personality's voice, created once per instruction and reused"""
+        with self._models_lock:
+            entry = self._personality_models.get(template.personality_id)
+            if entry is None or entry[0] != template.digest:
+                entry = (template.digest, self._new_model(template.system_instruction))
+                self._personality_models[template.personality_id] = entry
+            return entry[1]
+    
+    def _contents(self, prompt: str, chat_session=None):
+        """The prompt, preceded by the chat session's context window if there is one"""
+        if chat_session and hasattr(chat_session, 'id'):
+            return self.context.build(chat_session, prompt)
+        # For one-off responses
+        return prompt
+    
+    def summarize(self, prompt: str) -> Optional[str]:
+        """Ask Gemini for a conversation summary, or None so the context window falls back"""
+        with metrics.stage('gemini.summarize') as timing:
+            if self.breaker.is_open():
+                timing.outcome = 'circuit_open'
+                return None
+            try:
+                return self._generate(prompt).text
+            except admission.AdmissionRejected as e:
+                timing.outcome = e.reason
+                return None
+            except Exception as e:
+                logger.error(f"Error in Gemini summarize: {e}")
+                timing.outcome = 'error'
+                return None
+    
+    def _estimate_tokens(self, contents) -> int:
+        """Tokens a call is expected to use, for the tokens-per-minute budget"""
+        if isinstance(contents, str):
+            text = contents
+        else:
+            text = ''.join(part for turn in contents for part in turn['parts'] if isinstance(part, str))
+        return estimate_tokens(text) + self.expected_output_tokens
+    
+    def _generate(self, contents, chat_session=None, model=None):
+        """Call generate_content once admitted, through the circuit breaker"""
+        model = model or self.model
+        estimate = self._estimate_tokens(contents)
+        with self.admission.admit(estimate, admission.priority_of(chat_session)):
+            response = self.breaker.call(
+                lambda: self._rate_limited(
+                    lambda: model.generate_content(contents, request_options=self._request_options())
+                ),
+                is_failure=self._is_failure
+            )
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None and self.admission.bucket is not None:
+            # Settle the estimate against what the call actually used
+            self.admission.bucket.adjust({'tokens': usage.total_token_count - estimate})
+        return response
+    
+    def _rate_limited(self, call):
+        """Make the call; when Gemini says we are over its rate limit, hold back every worker"""
         try:
-            # Create a more conversational prompt
-            enhanced_prompt = f"""You are a helpful and knowledgeable assistant. Please provide a helpful, informative, and conversational response to the following message:
-
-{prompt}
-
-Please be concise but informative, and maintain a friendly tone."""
-
-            # If we have a chat session, use it for context
-            if chat_session and hasattr(chat_session, 'id'):
-                if self.chat is None:
-                    self.chat = self.model.start_chat(history=[])
-                
-                response = self.chat.send_message(enhanced_prompt)
-                return response.text
-            else:
-                # For one-off responses
-                response = self.model.generate_content(enhanced_prompt)
-                return response.text
-                
-        except Exception as e:
-            logger.error(f"Error in Gemini generate_response: {e}")
-            return None
+            return call()
+        except google_exceptions.TooManyRequests:
+            if self.admission.bucket is not None:
+                self.admission.bucket.drain()
+            raise
+    
+    def _request_options(self) -> dict:
+        return {'timeout': resilience.timeout_for(self.timeout, 'gemini')}
+    
+    @staticmethod
+    def _is_failure(error: Exception) -> bool:
+        # Blocked or empty responses raise ValueError; Gemini itself is fine
+        return not isinstance(error, ValueError)
+    
+    def generate_response(self, prompt: str, chat_session=None, personality_id: Optional[int] = None) -> Optional[str]:
+        """Generate a response from Gemini, or None so the caller can fall back
+        
+        The call is bounded by the current deadline, and skipped entirely while
+        the Gemini circuit breaker is open. Prompts asked without earlier turns
+        (one-off, or opening a chat session) are answered from the response
+        cache when the same prompt was answered for the same personality
+        before. Replies are in the voice of `personality_id`, or else of the
+        personality the session's user prefers.
+        """
+        with metrics.stage('gemini.generate') as timing:
+            template = personalities.template_for(chat_session, personality_id)
+            try:
+                # Summaries made for the context window queue like the reply itself
+                with admission.priority(admission.priority_of(chat_session)):
+                    contents = self._contents(prompt, chat_session)
+                # With no history, the answer depends on the prompt and the personality alone
+                cacheable = self.response_cache is not None and self._without_history(contents)
+                if cacheable:
+                    cached = self.response_cache.get(prompt, scope=template.scope)
+                    if cached:
+                        timing.outcome = 'cache_hit'
+                        metrics.note('response_cache', {name: value for name, value in cached.items() if name != 'response'})
+                        return cached['response']
+                if self.breaker.is_open():
+                    timing.outcome = 'circuit_open'
+                    return None
+                started = time.perf_counter()
+                response = self._generate(contents, chat_session, self.model_for(template))
+                text = response.text
+                if cacheable and text:
+                    self.response_cache.set(prompt, text, scope=template.scope,
+                                            generation_seconds=time.perf_counter() - started)
+                return text
+                    
+            except admission.AdmissionRejected as e:
+                timing.outcome = e.reason
+                return None
+            except Exception as e:
+                logger.error(f"Error in Gemini generate_response: {e}")
+                timing.outcome = 'error'
+                return None
     
-    def reset_chat(self):
-        """Reset the conversation history"""
-        self.chat = None
-        logger.info("Gemini chat session reset")
+    @staticmethod
+    def _without_history(contents) -> bool:
+        # One-off prompts are plain strings; a session's contents end with the prompt turn
+        return isinstance(contents, str) or len(contents) == 1
+    
+    def generate_response_stream(self, prompt: str, chat_session=None) -> Iterator[str]:
+        """Yield the response text from Gemini chunk by chunk as it is generated"""
+        with metrics.stage('gemini.stream') as timing:
+            if self.breaker.is_open():
+                timing.outcome = 'circuit_open'
+                return
+            try:
+                model = self.model_for(personalities.template_for(chat_session))
+                with admission.priority(admission.priority_of(chat_session)):
+                    contents = self._contents(prompt, chat_session)
+                with self.admission.admit(self._estimate_tokens(contents), admission.priority_of(chat_session)):
+                    yield from self._stream(lambda: self._rate_limited(lambda: model.generate_content(
+                        contents, stream=True, request_options=self._request_options()
+                    )))
+            except admission.AdmissionRejected as e:
+                timing.outcome = e.reason
+            except Exception as e:
+                logger.error(f"Error in Gemini generate_response_stream: {e}")
+                timing.outcome = 'error'
+    
+    def _stream(self, start) -> Iterator[str]:
+        """Yield the text of a streamed call, reporting how it went to the circuit breaker"""
+        if not self.breaker.allow():
+            raise resilience.CircuitOpenError("Circuit breaker for gemini is open")
+        failed = False
+        try:
+            yield from self._iter_text(start())
+        except Exception as e:
+            failed = self._is_failure(e)
+            raise
+        finally:
+            # A stream abandoned by the client still counts as a success
+            if failed:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
     
-    def get_chat_history(self):
-        """Get current chat history if available"""
-        if self.chat and hasattr(self.chat, 'history'):
-            return self.chat.history
-        return []        
\ No newline at end of file
+    def _iter_text(self, response) -> Iterator[str]:
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. safety stops) carry nothing to show
+                continue
+            if text:
+                yield text
@@ -0,0 +1,185 @@
+# chatbot/http_transport.py
+# Pooled keep-alive HTTP transports for the Wikimedia API, shared by every
+# WikimediaClient in the process. The sync transport wraps a requests.Session;
+# the async one, for ASGI deployments, wraps an httpx.AsyncClient.
+import asyncio
+import importlib.util
+import logging
+import threading
+import weakref
+from typing import Dict, Optional
+
+import requests
+from django.core.exceptions import ImproperlyConfigured
+from requests.adapters import HTTPAdapter
+
+from .conf import chatbot_setting
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_USER_AGENT = "DatingwebappChatbot/1.0 (Django chatbot; python-requests)"
+
+
+def default_pool_size() -> int:
+    """Enough connections for every thread that can call Wikimedia at once"""
+    configured = chatbot_setting('WIKIMEDIA_POOL_SIZE', None)
+    if configured:
+        return configured
+    return chatbot_setting('CONCURRENT_RESOLUTION_WORKERS', 16) + chatbot_setting('HEDGE_WORKERS', 16)
+
+
+def default_headers() -> Dict[str, str]:
+    return {
+        # Wikimedia asks API clients to identify themselves
+        'User-Agent': chatbot_setting('WIKIMEDIA_USER_AGENT', DEFAULT_USER_AGENT),
+        'Accept': 'application/json',
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    }
+
+
+class WikimediaTransport:
+    """A requests.Session with a connection pool sized for the worker threads
+
+    Connections are kept alive between requests and responses are
+    gzip-encoded. Nothing is retried here: WikimediaClient hedges its reads,
+    which also retries failed ones, and retrying underneath would multiply
+    the attempts.
+    """
+
+    def __init__(self, pool_size: Optional[int] = None):
+        self.pool_size = pool_size or default_pool_size()
+        self.adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=self.pool_size,
+            # Never wait for a free connection; overflow connections are simply not kept
+            pool_block=False,
+        )
+        self.session = requests.Session()
+        self.session.headers.update(default_headers())
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+    def get_json(self, url: str, params: Dict, timeout) -> Dict:
+        response = self.session.get(url, params=params, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def stats(self) -> Dict[str, int]:
+        """Requests made and connections opened, across every host pool"""
+        pools = self.adapter.poolmanager.pools
+        requests_made = connections = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                requests_made += pool.num_requests
+                connections += pool.num_connections
+        return {
+            'pool_size': self.pool_size,
+            'requests': requests_made,
+            'connections_opened': connections,
+            'connections_reused': max(0, requests_made - connections),
+        }
+
+    def close(self):
+        self.session.close()
+
+
+def async_transport_available() -> bool:
+    """Whether httpx, which AsyncWikimediaTransport needs, is installed"""
+    return importlib.util.find_spec('httpx') is not None
+
+
+class AsyncWikimediaTransport:
+    """An httpx.AsyncClient with the same pooling policy, for use from async views
+
+    httpx is only needed when this transport is used. Create one per event
+    loop; the client's connections belong to the loop that opened them.
+    Like the sync transport, nothing is retried here.
+    """
+
+    def __init__(self, pool_size: Optional[int] = None):
+        try:
+            import httpx
+        except ImportError:
+            raise ImproperlyConfigured("AsyncWikimediaTransport requires httpx (pip install httpx)")
+
+        self.pool_size = pool_size or default_pool_size()
+        self._requests = 0
+        # Each connection's network stream is seen once; weak so ids are never confused
+        self._streams = weakref.WeakSet()
+        self._connections = 0
+        limits = httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+            keepalive_expiry=chatbot_setting('WIKIMEDIA_KEEPALIVE_SECONDS', 60),
+        )
+        self.client = httpx.AsyncClient(
+            headers=default_headers(),
+            # The limits go on the transport; a client ignores its own once given one
+            transport=httpx.AsyncHTTPTransport(limits=limits, retries=0),
+            event_hooks={'response': [self._count]},
+        )
+
+    async def _count(self, response):
+        self._requests += 1
+        stream = response.extensions.get('network_stream')
+        if stream is not None and stream not in self._streams:
+            self._streams.add(stream)
+            self._connections += 1
+
+    async def get_json(self, url: str, params: Dict, timeout) -> Dict:
+        """Like WikimediaTransport.get_json, raising the same requests exceptions"""
+        import httpx
+
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        try:
+            response = await self.client.get(url, params=params, timeout=timeout)
+            response.raise_for_status()
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(str(e)) from e
+        except httpx.HTTPStatusError as e:
+            raise requests.HTTPError(str(e), response=e.response) from e
+        return response.json()
+
+    def stats(self) -> Dict[str, int]:
+        """Requests made and connections opened"""
+        return {
+            'pool_size': self.pool_size,
+            'requests': self._requests,
+            'connections_opened': self._connections,
+            'connections_reused': max(0, self._requests - self._connections),
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> WikimediaTransport:
+    """The process-wide sync transport"""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = WikimediaTransport()
+    return _transport
+
+
+# One async transport per event loop, since their connections belong to it
+_async_transports = weakref.WeakKeyDictionary()
+
+
+def get_async_transport() -> AsyncWikimediaTransport:
+    """The async transport of the running event loop"""
+    loop = asyncio.get_running_loop()
+    transport = _async_transports.get(loop)
+    if transport is None:
+        transport = _async_transports[loop] = AsyncWikimediaTransport()
+    return transport
@@ -0,0 +1,105 @@
+# chatbot/intent_router.py
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Intents that are answered from Wikimedia
+WIKIMEDIA_INTENTS = {'detail', 'search'}
+
+
+class Intent:
+    """The routing decision for a single message"""
+
+    __slots__ = ('name', 'keyword', 'span', 'search_term', 'matches')
+
+    def __init__(self, name: str, keyword: Optional[str], span: Optional[Tuple[int, int]],
+                 search_term: str, matches: Dict[str, Tuple[str, Tuple[int, int]]]):
+        self.name = name
+        self.keyword = keyword
+        self.span = span
+        self.search_term = search_term
+        self.matches = matches
+
+    @property
+    def uses_wikimedia(self) -> bool:
+        return self.name in WIKIMEDIA_INTENTS
+
+    def has(self, name: str) -> bool:
+        """Whether the message matched the given intent anywhere"""
+        return name in self.matches
+
+    def __repr__(self):
+        return f"Intent({self.name!r}, keyword={self.keyword!r}, search_term={self.search_term!r})"
+
+
+class IntentRouter:
+    """Routes a message to an intent with one pass of a single compiled regex
+
+    Every intent is a named group of keyword alternatives, matched
+    case-insensitively on word boundaries, longest keyword first. The intent
+    with the highest priority among those found wins, and its first match
+    gives the search term. Messages that match nothing get the 'chat' intent.
+    """
+
+    DEFAULT_INTENT = 'chat'
+
+    def __init__(self, intents: Iterable[Tuple[str, int, List[str]]] = ()):
+        """Build the router from (name, priority, keywords) tuples"""
+        self._intents = {}
+        self._lock = threading.Lock()
+        for name, priority, keywords in intents:
+            self._intents[name] = (priority, list(keywords))
+        self._compile()
+
+    def register(self, name: str, keywords: Iterable[str], priority: int = 0):
+        """Add an intent, or replace the keywords and priority of an existing one"""
+        if not re.fullmatch(r'[A-Za-z_]\w*', name):
+            raise ValueError(f"Invalid intent name: {name!r}")
+        with self._lock:
+            self._intents[name] = (priority, list(keywords))
+            self._compile()
+
+    def keywords(self, name: str) -> List[str]:
+        return list(self._intents.get(name, (0, []))[1])
+
+    def _compile(self):
+        groups = []
+        first_chars = set()
+        for name, (priority, keywords) in self._intents.items():
+            if not keywords:
+                continue
+            first_chars.update(keyword[0].lower() for keyword in keywords if keyword)
+            alternatives = sorted(
+                (r'\s+'.join(re.escape(word) for word in keyword.split()) for keyword in keywords),
+                key=len, reverse=True
+            )
+            groups.append(f"(?P<{name}>{'|'.join(alternatives)})")
+        # The lookahead on the first characters lets the scan skip most positions
+        # without trying every alternative; an empty router matches nothing
+        if groups:
+            first = ''.join(re.escape(char) for char in sorted(first_chars))
+            source = rf"(?<!\w)(?=[{first}])(?:{'|'.join(groups)})(?!\w)"
+        else:
+            source = r"(?!)"
+        pattern = re.compile(source, re.IGNORECASE)
+        priorities = {name: priority for name, (priority, _) in self._intents.items()}
+        # Swapped in one assignment so route() never sees a half-built router
+        self._compiled = (pattern, priorities)
+
+    def route(self, message: str) -> Intent:
+        pattern, priorities = self._compiled
+
+        matches = {}
+        for match in pattern.finditer(message):
+            name = match.lastgroup
+            if name not in matches:
+                matches[name] = (match.group(name).lower(), match.span())
+
+        if not matches:
+            return Intent(self.DEFAULT_INTENT, None, None, message.strip(), matches)
+
+        name = max(matches, key=lambda intent: priorities[intent])
+        keyword, span = matches[name]
+        # Remove common question words and punctuation
+        search_term = message[span[1]:].strip().lstrip('?.,!').strip()
+        return Intent(name, keyword, span, search_term, matches)
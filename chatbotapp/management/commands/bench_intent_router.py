@@ -0,0 +1,71 @@
+# chatbot/management/commands/bench_intent_router.py
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbotapp.bot_logic import EnhancedChatBot
+
+SAMPLE_MESSAGES = [
+    "What is quantum computing?",
+    "who is Ada Lovelace",
+    "Tell me about the Roman Empire and its fall",
+    "hello there!",
+    "Can you help me plan a trip to Japan next spring?",
+    "random article please",
+    "explain photosynthesis like I'm five",
+    "I had a long day at work and just want to chat for a while about nothing in particular",
+    "search for django streaming responses",
+    "what can you do",
+    "the meaning of life, the universe and everything",
+    "thanks, that was useful",
+]
+
+
+class Command(BaseCommand):
+    help = "Microbenchmark the compiled intent router against the previous keyword scans"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        bot = EnhancedChatBot()
+        router = bot.router
+        search_keywords = bot.search_keywords
+        detail_keywords = bot.detail_keywords
+        greeting_keywords = bot.greeting_keywords
+        help_keywords = bot.help_keywords
+
+        def keyword_scans(message):
+            # What a message used to go through: should_use_wikimedia,
+            # extract_search_term, the detail check in get_response, the
+            # fallback keyword checks and should_use_wikimedia again for metadata
+            message_lower = message.lower()
+            uses_wikimedia = any(keyword in message_lower for keyword in search_keywords)
+            search_term = message.strip()
+            for keyword in search_keywords:
+                if keyword in message_lower:
+                    start_pos = message_lower.find(keyword) + len(keyword)
+                    search_term = message[start_pos:].strip().lstrip('?.,!').strip()
+                    break
+            any(phrase in message.lower() for phrase in detail_keywords)
+            message_lower = message.lower()
+            any(word in message_lower for word in greeting_keywords)
+            any(word in message_lower for word in help_keywords)
+            'random' in message_lower and 'article' in message_lower
+            any(keyword in message.lower() for keyword in search_keywords)
+            return uses_wikimedia, search_term
+
+        rng = random.Random(options['seed'])
+        messages = [rng.choice(SAMPLE_MESSAGES) for _ in range(options['iterations'])]
+
+        for label, func in [('keyword scans', keyword_scans), ('intent router', router.route)]:
+            start = time.perf_counter()
+            for message in messages:
+                func(message)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{label:>14}: {elapsed * 1e6 / len(messages):8.2f} us/message "
+                f"({len(messages) / elapsed:,.0f} messages/s)"
+            )
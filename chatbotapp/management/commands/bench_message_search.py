@@ -0,0 +1,122 @@
+# chatbot/management/commands/bench_message_search.py
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from chatbotapp.message_search import get_backend, search_messages
+from chatbotapp.models import ChatSession, Message
+
+WORDS = (
+    "python django gemini wikipedia history science music travel recipe garden weather "
+    "football planet ocean mountain language poetry chemistry physics biology economics "
+    "painting novel movie camera coffee bicycle rocket volcano river desert forest"
+).split()
+FILLER = "the a of and to in is it that for on with as this was are be at by".split()
+QUERIES = ['python', 'volcano rocket', 'recipe coffee', 'histor', 'ocean planet river']
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark full-text message search against LIKE scans on a generated "
+        "test database, scoped to one user's chat sessions and unscoped (admin)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['messages'] < 1 or options['users'] < 1:
+            raise CommandError("--messages and --users must be at least 1")
+
+        setup_test_environment()
+        tmpdir = tempfile.mkdtemp(prefix='bench-message-search-')
+        if connection.vendor == 'sqlite':
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            user = self.populate(options)
+            self.run_benchmark(user, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def populate(self, options):
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        users = User.objects.bulk_create([User(username=f'bench-{i}') for i in range(options['users'])])
+        sessions = ChatSession.objects.bulk_create([
+            ChatSession(user=users[i % len(users)], session_name=f"Chat {i}")
+            for i in range(options['users'] * 4)
+        ])
+
+        def sentence():
+            words = [rng.choice(FILLER if rng.random() < 0.6 else WORDS) for _ in range(rng.randint(8, 40))]
+            return ' '.join(words).capitalize() + '.'
+
+        batch = []
+        for i in range(options['messages']):
+            batch.append(Message(
+                chat_session=sessions[rng.randrange(len(sessions))],
+                message_type='user' if i % 2 == 0 else 'bot',
+                content=' '.join(sentence() for _ in range(rng.randint(1, 3))),
+            ))
+            if len(batch) == 5000:
+                with transaction.atomic():
+                    Message.objects.bulk_create(batch)
+                batch = []
+        with transaction.atomic():
+            Message.objects.bulk_create(batch)
+        self.stdout.write(
+            f"Generated {options['messages']} messages in {len(sessions)} sessions of {len(users)} users "
+            f"in {time.perf_counter() - started:.1f}s (index kept in sync by triggers)"
+        )
+        return users[0]
+
+    def time_it(self, fn, repeat):
+        durations = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            durations.append(time.perf_counter() - started)
+        return statistics.median(durations) * 1000, result
+
+    def run_benchmark(self, user, options):
+        fts = get_backend()
+        if fts.vendor is None:
+            self.stdout.write(f"{connection.vendor} has no full-text index; only LIKE is available")
+        sessions = ChatSession.objects.filter(user=user)
+        repeat = options['repeat']
+
+        self.stdout.write(f"\n{'query':<22}{'scope':<10}{'full-text':>12}{'LIKE':>12}{'speedup':>9}{'hits':>8}")
+        for query in QUERIES:
+            fts_ms, (fts_results, _) = self.time_it(lambda: search_messages(query, sessions), repeat)
+            like_ms, _ = self.time_it(lambda: search_messages(query, sessions, like=True), repeat)
+            self.row(query, 'user', fts_ms, like_ms, len(fts_results))
+
+            sql, params = fts.matching_ids(query)
+            like_sql, like_params = get_backend(like=True).matching_ids(query)
+            fts_ms, hits = self.time_it(lambda: self.count(sql, params), repeat)
+            like_ms, _ = self.time_it(lambda: self.count(like_sql, like_params), repeat)
+            self.row(query, 'all', fts_ms, like_ms, hits)
+
+    def count(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM ({sql}) matches", params)
+            return cursor.fetchone()[0]
+
+    def row(self, query, scope, fts_ms, like_ms, hits):
+        self.stdout.write(
+            f"{query:<22}{scope:<10}{fts_ms:>10.2f}ms{like_ms:>10.2f}ms{like_ms / fts_ms:>8.1f}x{hits:>8}"
+        )
@@ -0,0 +1,234 @@
+# chatbot/management/commands/bench_send_message.py
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import path
+from django.utils import timezone
+
+from chatbotapp import views
+from chatbotapp.fake_clients import FakeGeminiClient, FakeWikimediaClient
+from chatbotapp.management.commands.bench_intent_router import SAMPLE_MESSAGES
+
+# The benchmark serves the view through this module, with the full middleware stack
+urlpatterns = [
+    path('send-message/', views.send_message, name='send_message'),
+]
+
+
+def _percentile(values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(q * len(values)) - 1))]
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the send_message view with simulated Gemini and Wikimedia "
+        "backends and report throughput, latency percentiles and database "
+        "queries per request. Runs against a throwaway test database on the "
+        "configured backend (set CHATBOT_DB_ENGINE=postgresql to use PostgreSQL)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10,
+                            help="Concurrent users, each with their own chat session")
+        parser.add_argument('--requests', type=int, default=20,
+                            help="Messages sent by each user")
+        parser.add_argument('--warmup', type=int, default=1,
+                            help="Messages per user to send before measuring")
+        parser.add_argument('--gemini-latency', type=float, default=0.2)
+        parser.add_argument('--gemini-jitter', type=float, default=0.05)
+        parser.add_argument('--gemini-error-rate', type=float, default=0.0)
+        parser.add_argument('--wikimedia-latency', type=float, default=0.05)
+        parser.add_argument('--wikimedia-jitter', type=float, default=0.01)
+        parser.add_argument('--wikimedia-error-rate', type=float, default=0.0)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['requests'] < 1:
+            raise CommandError("--users and --requests must be at least 1")
+
+        setup_test_environment()
+        tmpdir = tempfile.mkdtemp(prefix='bench-send-message-')
+        if connection.vendor == 'sqlite':
+            # The default in-memory test database cannot take concurrent writers
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+        gemini, wikimedia = views.chatbot.gemini, views.chatbot.wikimedia
+        try:
+            # Measures the view itself, so no rate limits
+            chatbot_settings = {**getattr(settings, 'CHATBOT_SETTINGS', {}), 'RATE_LIMITS': {}}
+            with override_settings(ROOT_URLCONF=__name__, CHATBOT_SETTINGS=chatbot_settings, CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                            'LOCATION': 'bench-send-message'},
+                'coordination': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                 'LOCATION': 'bench-send-message-coordination'},
+            }):
+                # Start cold, whatever an earlier run in this process left behind
+                cache.clear()
+                views.chatbot.gemini = FakeGeminiClient(
+                    options['gemini_latency'], options['gemini_jitter'],
+                    options['gemini_error_rate'], options['seed']
+                )
+                views.chatbot.wikimedia = FakeWikimediaClient(
+                    options['wikimedia_latency'], options['wikimedia_jitter'],
+                    options['wikimedia_error_rate'], options['seed']
+                )
+                results = self.run_benchmark(options)
+        finally:
+            views.chatbot.gemini, views.chatbot.wikimedia = gemini, wikimedia
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options['compare']:
+            self.compare(results, options['compare'])
+
+    def run_benchmark(self, options):
+        users = options['users']
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            per_user = list(executor.map(lambda index: self.run_user(index, options), range(users)))
+        duration = time.perf_counter() - started
+
+        samples = [sample for user_samples in per_user for sample in user_samples]
+        latencies = sorted(elapsed for elapsed, _, _ in samples)
+        queries = sorted(count for _, count, _ in samples)
+        errors = sum(1 for _, _, ok in samples if not ok)
+
+        return {
+            'benchmark': 'send_message',
+            'created_at': timezone.now().isoformat(),
+            'revision': _git_revision(),
+            'environment': {
+                'backend': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+            },
+            'config': {
+                key: options[key] for key in (
+                    'users', 'requests', 'warmup', 'seed',
+                    'gemini_latency', 'gemini_jitter', 'gemini_error_rate',
+                    'wikimedia_latency', 'wikimedia_jitter', 'wikimedia_error_rate',
+                )
+            },
+            'requests': len(samples),
+            'errors': errors,
+            'duration': duration,
+            'throughput': len(samples) / duration if duration else 0.0,
+            'latency_ms': {
+                'mean': 1000 * sum(latencies) / len(latencies),
+                'p50': 1000 * _percentile(latencies, 0.50),
+                'p95': 1000 * _percentile(latencies, 0.95),
+                'p99': 1000 * _percentile(latencies, 0.99),
+                'max': 1000 * latencies[-1],
+            },
+            'queries_per_request': {
+                'mean': sum(queries) / len(queries),
+                'p50': _percentile(queries, 0.50),
+                'max': queries[-1],
+            },
+            'upstream': {
+                'gemini': views.chatbot.gemini.upstream.stats(),
+                'wikimedia': views.chatbot.wikimedia.upstream.stats(),
+            },
+        }
+
+    def run_user(self, index, options):
+        """Send one user's messages in sequence and return (seconds, queries, ok) per message"""
+        rng = random.Random(options['seed'] * 7919 + index)
+        client = Client()
+        # The first message starts the user's anonymous chat session
+        session_id = None
+        samples = []
+        query_count = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal query_count
+            query_count += 1
+            return execute(sql, params, many, context)
+
+        try:
+            for i in range(options['warmup'] + options['requests']):
+                body = json.dumps({'message': rng.choice(SAMPLE_MESSAGES), 'session_id': session_id})
+                query_count = 0
+                with connection.execute_wrapper(count_query):
+                    started = time.perf_counter()
+                    response = client.post('/send-message/', data=body, content_type='application/json')
+                    elapsed = time.perf_counter() - started
+                session_id = response.json().get('session_id', session_id)
+                if i >= options['warmup']:
+                    ok = response.status_code == 200 and response.json().get('success', False)
+                    samples.append((elapsed, query_count, ok))
+        finally:
+            connection.close()
+        return samples
+
+    def report(self, results):
+        latency = results['latency_ms']
+        queries = results['queries_per_request']
+        config = results['config']
+        self.stdout.write(
+            f"send_message on {results['environment']['backend']}: "
+            f"{config['users']} users x {config['requests']} requests"
+        )
+        self.stdout.write(f"  throughput: {results['throughput']:.1f} requests/s over {results['duration']:.2f}s")
+        self.stdout.write(
+            f"  latency:    p50 {latency['p50']:.1f} ms, p95 {latency['p95']:.1f} ms, "
+            f"p99 {latency['p99']:.1f} ms, max {latency['max']:.1f} ms"
+        )
+        self.stdout.write(f"  queries:    {queries['mean']:.1f} per request (max {queries['max']})")
+        self.stdout.write(f"  errors:     {results['errors']} of {results['requests']}")
+        for name, stats in results['upstream'].items():
+            self.stdout.write(f"  {name}: {stats['calls']} calls, {stats['errors']} simulated failures")
+
+    def compare(self, results, path):
+        with open(path) as f:
+            baseline = json.load(f)
+
+        def change(new, old):
+            return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+        self.stdout.write(f"Compared with {path} ({baseline.get('revision') or 'unknown revision'}):")
+        self.stdout.write(f"  throughput: {change(results['throughput'], baseline['throughput'])}")
+        for key in ('p50', 'p95', 'p99'):
+            self.stdout.write(
+                f"  {key}: {change(results['latency_ms'][key], baseline['latency_ms'][key])}"
+            )
+        self.stdout.write(
+            f"  queries per request: "
+            f"{change(results['queries_per_request']['mean'], baseline['queries_per_request']['mean'])}"
+        )
@@ -0,0 +1,128 @@
+# chatbot/management/commands/bench_sqlite_writes.py
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from chatbotapp.models import ChatSession, Message
+
+MODES = {
+    # Django's defaults and the three autocommit writes send_message used to make
+    'legacy': {'init_command': 'PRAGMA journal_mode=DELETE'},
+    # The DATABASES settings and ChatSession.save_messages()
+    'tuned': None,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Concurrency test of the send_message write path on SQLite: the old "
+        "autocommit writes on a default connection against one transaction on "
+        "a WAL connection with a busy timeout"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--turns', type=int, default=40, help="Chat turns per thread")
+        parser.add_argument('--upstream-latency', type=float, default=0.01,
+                            help="Simulated Gemini time between the user and the bot message")
+        parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("This benchmark is about SQLite locking; the default database is "
+                               f"{connection.vendor}")
+
+        setup_test_environment()
+        tmpdir = tempfile.mkdtemp(prefix='bench-sqlite-writes-')
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+        tuned_options = dict(settings.DATABASES['default'].get('OPTIONS', {}))
+        original_options = connection.settings_dict.get('OPTIONS', {})
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for mode in options['modes']:
+                # New connections, in every thread, pick up the mode's options
+                connections.close_all()
+                connection.settings_dict['OPTIONS'] = MODES[mode] if MODES[mode] is not None else tuned_options
+                self.report(mode, self.run_mode(mode, options))
+        finally:
+            connections.close_all()
+            connection.settings_dict['OPTIONS'] = original_options
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def run_mode(self, mode, options):
+        sessions = [ChatSession.objects.create() for _ in range(options['threads'])]
+        write_times = []
+        errors = []
+        lock = threading.Lock()
+
+        def chat(chat_session):
+            try:
+                for turn in range(options['turns']):
+                    try:
+                        elapsed = self.turn(mode, chat_session, turn, options['upstream_latency'])
+                    except OperationalError as e:
+                        with lock:
+                            errors.append(str(e))
+                        continue
+                    with lock:
+                        write_times.append(elapsed)
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            list(executor.map(chat, sessions))
+        return {
+            'elapsed': time.perf_counter() - started,
+            'turns': options['threads'] * options['turns'],
+            'write_times': write_times,
+            'errors': errors,
+        }
+
+    def turn(self, mode, chat_session, turn, upstream_latency):
+        """One chat turn; returns the time spent writing"""
+        # What every request reads: its session and the latest messages
+        chat_session = ChatSession.objects.get(pk=chat_session.pk)
+        list(chat_session.messages.order_by('-timestamp', '-id')[:12])
+        content = f"Message {turn} of a benchmark chat"
+
+        if mode == 'legacy':
+            started = time.perf_counter()
+            Message.objects.create(chat_session=chat_session, message_type='user', content=content)
+            writing = time.perf_counter() - started
+            time.sleep(upstream_latency)
+            started = time.perf_counter()
+            Message.objects.create(chat_session=chat_session, message_type='bot', content=f"Reply to {content}")
+            chat_session.save()
+            return writing + time.perf_counter() - started
+
+        user_message = Message(chat_session=chat_session, message_type='user', content=content,
+                               timestamp=timezone.now())
+        time.sleep(upstream_latency)
+        bot_message = Message(chat_session=chat_session, message_type='bot', content=f"Reply to {content}")
+        started = time.perf_counter()
+        chat_session.save_messages(user_message, bot_message)
+        return time.perf_counter() - started
+
+    def report(self, mode, results):
+        write_times = sorted(results['write_times']) or [0.0]
+        p95 = write_times[min(len(write_times) - 1, int(len(write_times) * 0.95))]
+        self.stdout.write(
+            f"{mode:>7}: {results['turns'] / results['elapsed']:7.1f} turns/s, "
+            f"writes p50 {statistics.median(write_times) * 1000:7.2f} ms, p95 {p95 * 1000:7.2f} ms, "
+            f"max {write_times[-1] * 1000:8.2f} ms, {len(results['errors'])} of {results['turns']} turns failed"
+        )
+        for error in sorted(set(results['errors'])):
+            self.stdout.write(f"{'':>9}{results['errors'].count(error)} x {error}")
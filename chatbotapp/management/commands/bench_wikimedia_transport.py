@@ -0,0 +1,96 @@
+# chatbot/management/commands/bench_wikimedia_transport.py
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand
+
+from chatbotapp.gemini_client import WikimediaClient
+from chatbotapp.http_transport import AsyncWikimediaTransport, WikimediaTransport
+from chatbotapp.mediawiki_stub import MediaWikiStub
+
+
+def _queries(count):
+    """The parameters of `count` requests, cycling through the client's endpoints"""
+    templates = [
+        WikimediaClient._search_params('python', 5),
+        WikimediaClient._page_summary_params('Python (programming language)'),
+        WikimediaClient._page_content_params(23862),
+    ]
+    return [templates[i % len(templates)] for i in range(count)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the pooled Wikimedia transport with a bare requests.Session "
+        "against a local MediaWiki stub, reporting throughput and connection reuse. "
+        "Requests arrive in bursts of --concurrency, so idle connections have to "
+        "survive between bursts to be reused."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=600)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--latency', type=float, default=0.005,
+                            help="Simulated server time per response")
+        parser.add_argument('--pool-size', type=int, default=None,
+                            help="Connection pool size (default: matched to the worker threads)")
+
+    def handle(self, *args, **options):
+        stub = MediaWikiStub(latency=options['latency']).start()
+        try:
+            queries = _queries(options['requests'])
+
+            bare = requests.Session()
+            self.run_sync(stub, "bare requests.Session", bare.get, queries, options)
+            bare.close()
+
+            transport = WikimediaTransport(pool_size=options['pool_size'])
+            self.run_sync(stub, "pooled transport", transport.session.get, queries, options,
+                          transport_stats=transport.stats)
+            transport.close()
+
+            asyncio.run(self.run_async(stub, queries, options))
+        finally:
+            stub.stop()
+
+    def report(self, label, stub, elapsed, count, transport_stats=None):
+        server = stub.stats()
+        self.stdout.write(
+            f"{label:>24}: {count / elapsed:8.0f} requests/s, "
+            f"{server['connections']} connections for {server['requests']} requests, "
+            f"{server['gzipped']} gzipped"
+        )
+        if transport_stats:
+            self.stdout.write(f"{'':>24}  client: {transport_stats}")
+
+    def run_sync(self, stub, label, get, queries, options, transport_stats=None):
+        stub.reset_stats()
+
+        def fetch(params):
+            response = get(stub.url, params=params, timeout=(3.05, 10))
+            response.raise_for_status()
+            return response.json()
+
+        burst = options['concurrency']
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=burst) as executor:
+            for i in range(0, len(queries), burst):
+                list(executor.map(fetch, queries[i:i + burst]))
+        self.report(label, stub, time.perf_counter() - started, len(queries),
+                    transport_stats() if transport_stats else None)
+
+    async def run_async(self, stub, queries, options):
+        stub.reset_stats()
+        transport = AsyncWikimediaTransport(pool_size=options['pool_size'])
+        burst = options['concurrency']
+
+        started = time.perf_counter()
+        for i in range(0, len(queries), burst):
+            await asyncio.gather(*(
+                transport.get_json(stub.url, params, (3.05, 10)) for params in queries[i:i + burst]
+            ))
+        elapsed = time.perf_counter() - started
+        await transport.aclose()
+        self.report("async transport", stub, elapsed, len(queries), transport.stats())
@@ -0,0 +1,106 @@
+# chatbot/management/commands/bench_wikipedia_index.py
+import itertools
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbotapp.gemini_client import WikimediaClient
+from chatbotapp.mediawiki_stub import MediaWikiStub
+from chatbotapp.wikipedia_index import OfflineWikimediaClient, _NoCache, build_index, get_index
+
+
+def synthetic_pages(count, seed=0):
+    """Pages over a Zipf-distributed vocabulary, roughly the shape of real abstracts"""
+    rng = random.Random(seed)
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'ze', 'pa', 'do', 'gu']
+    vocabulary = sorted({''.join(rng.choices(syllables, k=rng.randint(2, 4))) for _ in range(40000)})
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+    for page_id in range(1, count + 1):
+        title = ' '.join(rng.choices(vocabulary[:5000], k=rng.randint(1, 3))).title()
+        words = rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(20, 120))
+        yield {'pageid': page_id, 'title': f"{title} {page_id}", 'extract': ' '.join(words).capitalize() + '.'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the offline Wikipedia index with the HTTP client (against the local "
+        "MediaWiki stub, caches off) for searches, summaries and page content"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index', help="An existing index; default: build one from synthetic pages")
+        parser.add_argument('--pages', type=int, default=200000, help="Synthetic pages to index")
+        parser.add_argument('--lookups', type=int, default=2000)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help="Simulated MediaWiki server time per response")
+
+    def handle(self, *args, **options):
+        tmpdir = None
+        path = options['index']
+        if not path:
+            tmpdir = tempfile.mkdtemp(prefix='bench-wikipedia-index-')
+            path = os.path.join(tmpdir, 'wikipedia.idx')
+            started = time.perf_counter()
+            meta = build_index(synthetic_pages(options['pages']), path)
+            self.stdout.write(
+                f"Built an index of {meta['docs']} synthetic pages "
+                f"({os.path.getsize(path) / 1024 / 1024:.1f} MB) in {time.perf_counter() - started:.1f}s"
+            )
+        try:
+            self.run(path, options)
+        finally:
+            if tmpdir:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def run(self, path, options):
+        started = time.perf_counter()
+        index = get_index(path)
+        self.stdout.write(f"Opened the index in {(time.perf_counter() - started) * 1000:.2f} ms")
+
+        rng = random.Random(1)
+        documents = [index.document(rng.randrange(len(index.docs))) for _ in range(options['lookups'])]
+        queries = {
+            'search': [' '.join(doc['title'].split()[:2]) for doc in documents],
+            'summary': [doc['title'] for doc in documents],
+            'page': [doc['pageid'] for doc in documents],
+        }
+
+        offline = OfflineWikimediaClient(path)
+        self.report('offline index', offline, queries)
+
+        stub = MediaWikiStub(latency=options['latency']).start()
+        try:
+            http = WikimediaClient()
+            http.base_url = stub.url
+            http.cache = _NoCache()
+            http.hedge_delay = None
+            self.report('HTTP (local stub)', http, queries)
+        finally:
+            stub.stop()
+
+    def report(self, label, client, queries):
+        calls = {
+            'search': client.search_pages,
+            'summary': client.get_page_summary,
+            'page': client.get_page_content,
+        }
+        for name, call in calls.items():
+            timings = []
+            found = 0
+            for argument in queries[name]:
+                started = time.perf_counter()
+                result = call(argument)
+                timings.append(time.perf_counter() - started)
+                found += bool(result)
+            timings.sort()
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            self.stdout.write(
+                f"{label:>18} {name:>7}: p50 {statistics.median(timings) * 1000:7.3f} ms, "
+                f"p99 {p99 * 1000:7.3f} ms, {len(timings) / sum(timings):9,.0f}/s, "
+                f"{found} of {len(timings)} found"
+            )
@@ -0,0 +1,43 @@
+# chatbot/management/commands/cleanup_empty_sessions.py
+# Anonymous chat sessions used to be created on every first page view, so most
+# of them never got a message. Sessions are now created with the first message,
+# but the empty ones already in the database stay until this removes them.
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from chatbotapp.models import ChatSession, Message
+
+
+class Command(BaseCommand):
+    help = "Delete anonymous chat sessions that never got a message"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-hours', type=float, default=24,
+                            help="Leave sessions created more recently than this alone")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Only count the sessions")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['older_than_hours'])
+        empty = (
+            ChatSession.objects
+            .filter(user=None, created_at__lt=cutoff)
+            .filter(~Exists(Message.objects.filter(chat_session=OuterRef('pk'))))
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f"Would delete {empty.count()} empty anonymous chat sessions")
+            return
+
+        # Batches keep each delete, and the lock it holds, short
+        deleted = 0
+        while True:
+            ids = list(empty.values_list('pk', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            deleted += ChatSession.objects.filter(pk__in=ids).delete()[1].get(ChatSession._meta.label, 0)
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} empty anonymous chat sessions"))
@@ -0,0 +1,53 @@
+# chatbot/management/commands/enforce_retention.py
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chatbotapp.retention import Retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive chat sessions older than AUTO_DELETE_OLD_SESSIONS_DAYS, and each user's "
+        "sessions beyond MAX_SESSIONS_PER_USER, to gzipped JSONL, then delete them in "
+        "batches. Safe to run from cron: an interrupted run is resumed by the next one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Overrides AUTO_DELETE_OLD_SESSIONS_DAYS")
+        parser.add_argument('--max-sessions', type=int, help="Overrides MAX_SESSIONS_PER_USER")
+        parser.add_argument('--batch-size', type=int, help="Sessions per archive file and delete transaction")
+        parser.add_argument('--archive-dir', help="Overrides RETENTION_ARCHIVE_DIR")
+        parser.add_argument('--max-batches', type=int,
+                            help="Stop after this many batches; the next run carries on")
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help="Seconds to sleep between batches, to leave the database to the site")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only count what would be archived and deleted")
+
+    def handle(self, *args, **options):
+        retention = Retention(
+            max_age_days=options['days'],
+            max_sessions_per_user=options['max_sessions'],
+            batch_size=options['batch_size'],
+            directory=options['archive_dir'],
+        )
+
+        if options['dry_run']:
+            cutoff = timezone.now() - timedelta(days=retention.max_age_days)
+            for phase, counts in retention.count(cutoff).items():
+                self.stdout.write(
+                    f"{phase:>5}: would archive {counts['sessions']} sessions "
+                    f"with {counts['messages']} messages"
+                )
+            return
+
+        def progress(state, stats):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{state['phase']} phase, {state['sequence']} archive files: {stats} so far")
+
+        stats = retention.run(max_batches=options['max_batches'], pause=options['pause'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Archived and deleted {stats}"))
+        if retention.load_state() is not None:
+            self.stdout.write("Stopped at --max-batches; the next run resumes from here")
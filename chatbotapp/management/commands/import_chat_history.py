@@ -0,0 +1,51 @@
+# chatbot/management/commands/import_chat_history.py
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbotapp.chat_export import HistoryImporter, InvalidExport, open_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Import chat history written by export_chat_history (or the export "
+        "endpoint), plain or gzipped. Sessions and messages get new ids and are "
+        "inserted with bulk_create, --batch-size rows per transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="File to read, or - for standard input")
+        parser.add_argument('--user', help="Give every session to this user; default: the exported usernames")
+        parser.add_argument('--batch-size', type=int, help="Default: IMPORT_BATCH_SIZE")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"No such user: {options['user']}")
+
+        def progress(stats):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{stats} so far")
+
+        importer = HistoryImporter(user=user, batch_size=options['batch_size'], progress=progress)
+        try:
+            source = open_export(options['input'], stdin=sys.stdin.buffer)
+        except OSError as e:
+            raise CommandError(str(e))
+        try:
+            with source:
+                stats = importer.run(source)
+        except InvalidExport as e:
+            raise CommandError(
+                f"{e}. Imported before it: {importer.stats.sessions} sessions, {importer.stats.messages} messages"
+            )
+
+        if stats.unknown_users:
+            self.stdout.write(self.style.WARNING(
+                f"No such users, their sessions were imported without one: {', '.join(sorted(stats.unknown_users))}"
+            ))
+        self.stdout.write(self.style.SUCCESS(f"Imported {stats}"))
@@ -0,0 +1,40 @@
+# chatbot/management/commands/import_wikipedia_abstracts.py
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbotapp.conf import chatbot_setting
+from chatbotapp.wikipedia_index import build_index, read_abstracts
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the offline Wikipedia index from an abstracts dump: the XML abstract "
+        "dump (enwiki-latest-abstract.xml) or JSONL with title and extract, optionally "
+        "gzipped or bzipped. Set WIKIMEDIA_BACKEND to 'offline' to use it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dump')
+        parser.add_argument('--format', choices=['xml', 'jsonl'], help="Default: from the file name")
+        parser.add_argument('--output', help="Default: WIKIMEDIA_OFFLINE_INDEX")
+        parser.add_argument('--limit', type=int, help="Only import the first pages")
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options['dump']):
+            raise CommandError(f"No such file: {options['dump']}")
+        output = str(options['output'] or chatbot_setting('WIKIMEDIA_OFFLINE_INDEX', 'wikipedia.idx'))
+
+        pages = read_abstracts(options['dump'], options['format'])
+        if options['limit']:
+            pages = (page for i, page in zip(range(options['limit']), pages))
+
+        started = time.perf_counter()
+        meta = build_index(pages, output, progress=lambda count: self.stdout.write(f"{count} pages read"))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {meta['docs']} pages and {meta['terms']} terms into {output} "
+            f"({os.path.getsize(output) / 1024 / 1024:.1f} MB) in {elapsed:.1f}s "
+            f"({meta['docs'] / elapsed if elapsed else 0:,.0f} pages/s)"
+        ))
@@ -0,0 +1,190 @@
+# chatbot/management/commands/loadtest_rate_limits.py
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import path
+
+from chatbotapp import views
+from chatbotapp.admission import AdmissionController
+from chatbotapp.fake_clients import FakeGeminiClient, FakeWikimediaClient
+from chatbotapp.management.commands.bench_send_message import _percentile
+from chatbotapp.models import ChatSession, Message
+
+# Served with the full middleware stack, rate limits included
+urlpatterns = [
+    path('send-message/', views.send_message, name='send_message'),
+]
+
+CHAT_MESSAGES = [
+    "hello there!",
+    "Can you help me plan a trip to Japan next spring?",
+    "I had a long day at work and just want to chat for a while about nothing in particular",
+    "thanks, that was useful",
+    "what should I cook tonight?",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test send_message with well-behaved users and abusive clients, once "
+        "without rate limits and once with them, and report what each side got: "
+        "requests served, replies shed to the local fallback by Gemini admission "
+        "control, latency, 429s and chat sessions created. Uses a simulated Gemini "
+        "with a small concurrency cap, so abuse has something to starve."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5, help="Well-behaved users, each from their own IP")
+        parser.add_argument('--user-rate', type=float, default=1.0, help="Messages per second per user")
+        parser.add_argument('--abusers', type=int, default=1, help="Abusive clients, each from their own IP")
+        parser.add_argument('--abuser-threads', type=int, default=16,
+                            help="Requests each abuser keeps in flight, ignoring Retry-After")
+        parser.add_argument('--abuser-cookies', action='store_true',
+                            help="Abusers keep their session cookie instead of starting a session per request")
+        parser.add_argument('--duration', type=float, default=20.0, help="Seconds per phase")
+        parser.add_argument('--window', type=float, default=5.0, help="Rate limit window in seconds")
+        parser.add_argument('--session-limit', type=int, default=10, help="Requests per window per session or user")
+        parser.add_argument('--ip-limit', type=int, default=10, help="Requests per window per IP")
+        parser.add_argument('--gemini-latency', type=float, default=0.5)
+        parser.add_argument('--gemini-concurrency', type=int, default=4)
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['duration'] <= 0:
+            raise CommandError("--users must be at least 1 and --duration positive")
+
+        setup_test_environment()
+        tmpdir = tempfile.mkdtemp(prefix='loadtest-rate-limits-')
+        if connection.vendor == 'sqlite':
+            # The default in-memory test database cannot take concurrent writers
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(tmpdir, 'loadtest.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+        window = options['window']
+        limits = {'send_message': {
+            'user': (options['session_limit'], window),
+            'session': (options['session_limit'], window),
+            'ip': (options['ip_limit'], window),
+        }}
+        gemini, wikimedia = views.chatbot.gemini, views.chatbot.wikimedia
+        try:
+            views.chatbot.gemini = FakeGeminiClient(options['gemini_latency'])
+            views.chatbot.gemini.admission = AdmissionController(
+                'gemini', max_concurrency=options['gemini_concurrency'], queue_size=options['gemini_concurrency'] * 4,
+                max_wait=5,
+            )
+            views.chatbot.wikimedia = FakeWikimediaClient(0.05)
+            for label, phase_limits in [('without rate limits', {}), ('with rate limits', limits)]:
+                chatbot_settings = {**getattr(settings, 'CHATBOT_SETTINGS', {}),
+                                    'RATE_LIMITS': phase_limits, 'BACKGROUND_RESPONSES': False}
+                with override_settings(ROOT_URLCONF=__name__, CHATBOT_SETTINGS=chatbot_settings, CACHES={
+                    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                'LOCATION': 'loadtest-rate-limits'},
+                    'coordination': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                     'LOCATION': 'loadtest-rate-limits-coordination'},
+                }):
+                    cache.clear()
+                    caches['coordination'].clear()
+                    self.report(label, self.run_phase(options))
+        finally:
+            views.chatbot.gemini, views.chatbot.wikimedia = gemini, wikimedia
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def run_phase(self, options):
+        sessions_before = ChatSession.objects.count()
+        stop_at = time.monotonic() + options['duration']
+        samples = {'users': [], 'abusers': []}
+        lock = threading.Lock()
+
+        def record(side, sample):
+            with lock:
+                samples[side].append(sample)
+
+        def post(client, ip, message, session_id=None):
+            started = time.perf_counter()
+            response = client.post('/send-message/', data={'message': message, 'session_id': session_id},
+                                   content_type='application/json', REMOTE_ADDR=ip)
+            data = response.json()
+            bot_message = data.get('bot_message') or {}
+            return response, data, (time.perf_counter() - started, response.status_code, bot_message.get('id'))
+
+        def user(index):
+            client = Client()
+            ip = f"10.0.0.{index + 1}"
+            session_id = None
+            interval = 1 / options['user_rate']
+            sent = 0
+            try:
+                while time.monotonic() < stop_at:
+                    started = time.monotonic()
+                    response, data, sample = post(client, ip, CHAT_MESSAGES[sent % len(CHAT_MESSAGES)], session_id)
+                    sent += 1
+                    record('users', sample)
+                    session_id = data.get('session_id', session_id)
+                    pause = interval - (time.monotonic() - started)
+                    if response.status_code == 429:
+                        pause = max(pause, int(response['Retry-After']))
+                    time.sleep(max(0.0, min(pause, stop_at - time.monotonic())))
+            finally:
+                connection.close()
+
+        def abuser(index):
+            client = Client()
+            ip = f"192.0.2.{index // options['abuser_threads'] + 1}"
+            try:
+                while time.monotonic() < stop_at:
+                    if not options['abuser_cookies']:
+                        client.cookies.clear()
+                    _, _, sample = post(client, ip, CHAT_MESSAGES[index % len(CHAT_MESSAGES)])
+                    record('abusers', sample)
+            finally:
+                connection.close()
+
+        abuser_count = options['abusers'] * options['abuser_threads']
+        with ThreadPoolExecutor(max_workers=options['users'] + abuser_count) as executor:
+            futures = [executor.submit(user, index) for index in range(options['users'])]
+            futures += [executor.submit(abuser, index) for index in range(abuser_count)]
+            for future in futures:
+                future.result()
+
+        results = {side: self.summarize(side_samples, options['duration']) for side, side_samples in samples.items()}
+        results['sessions_created'] = ChatSession.objects.count() - sessions_before
+        return results
+
+    def summarize(self, samples, duration):
+        served = [(elapsed, message_id) for elapsed, status, message_id in samples if status == 200]
+        message_ids = [message_id for _, message_id in served if message_id]
+        # Calls turned away by Gemini admission control leave a note in the reply's metadata
+        shed = Message.objects.filter(id__in=message_ids, metadata__has_key='admission').count() if message_ids else 0
+        latencies = sorted(elapsed for elapsed, _ in served)
+        return {
+            'requests': len(samples),
+            'served': len(served),
+            'shed': shed,
+            'refused': sum(1 for _, status, _ in samples if status == 429),
+            'throughput': len(served) / duration,
+            'p50_ms': 1000 * _percentile(latencies, 0.50),
+            'p95_ms': 1000 * _percentile(latencies, 0.95),
+        }
+
+    def report(self, label, results):
+        self.stdout.write(f"{label}:")
+        for side in ('users', 'abusers'):
+            stats = results[side]
+            self.stdout.write(
+                f"  {side:>7}: {stats['requests']:6d} requests, {stats['served']:6d} served "
+                f"({stats['throughput']:6.1f}/s), {stats['shed']:6d} shed to the fallback, "
+                f"{stats['refused']:6d} refused with 429; p50 {stats['p50_ms']:7.1f} ms, p95 {stats['p95_ms']:7.1f} ms"
+            )
+        self.stdout.write(f"  chat sessions created: {results['sessions_created']}")
@@ -0,0 +1,30 @@
+# chatbot/management/commands/rebuild_message_search.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from chatbotapp.message_search import get_backend
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the full-text index of message content if it is missing, and "
+        "rebuild it from the messages table (FTS5 on SQLite, GIN on PostgreSQL)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        backend = get_backend(options['database'])
+        if backend.vendor is None:
+            self.stdout.write(f"{backend.connection.vendor} has no full-text index; search uses LIKE")
+            return
+
+        started = time.perf_counter()
+        # install() already rebuilds an index it had to create or repair
+        if not backend.install():
+            backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt the {backend.vendor} message search index in {time.perf_counter() - started:.2f}s"
+        ))
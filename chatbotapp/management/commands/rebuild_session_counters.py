@@ -0,0 +1,63 @@
+# chatbot/management/commands/rebuild_session_counters.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Substr
+
+from chatbotapp.models import MESSAGE_PREVIEW_LENGTH, ChatSession, Message
+
+COUNTER_FIELDS = [
+    'message_count', 'user_message_count', 'bot_message_count',
+    'last_message_preview', 'last_message_at',
+]
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized message counters and last-message fields of chat sessions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        latest = Message.objects.filter(chat_session=OuterRef('pk')).order_by('-timestamp', '-id')
+        latest_with_content = latest.exclude(content='')
+
+        sessions = (
+            ChatSession.objects
+            .annotate(
+                total=Count('messages'),
+                users=Count('messages', filter=Q(messages__message_type='user')),
+                bots=Count('messages', filter=Q(messages__message_type='bot')),
+                last_at=Subquery(latest.values('timestamp')[:1]),
+                last_preview=Subquery(
+                    latest_with_content.annotate(
+                        preview=Substr('content', 1, MESSAGE_PREVIEW_LENGTH)
+                    ).values('preview')[:1]
+                ),
+            )
+            .order_by()
+        )
+
+        updated = 0
+        batch = []
+        for session in sessions.iterator(chunk_size=batch_size):
+            session.message_count = session.total
+            session.user_message_count = session.users
+            session.bot_message_count = session.bots
+            session.last_message_at = session.last_at
+            session.last_message_preview = session.last_preview or ''
+            batch.append(session)
+            if len(batch) >= batch_size:
+                updated += self._flush(batch)
+                batch = []
+        updated += self._flush(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt counters for {updated} chat sessions"))
+
+    def _flush(self, batch):
+        if not batch:
+            return 0
+        with transaction.atomic():
+            ChatSession.objects.bulk_update(batch, COUNTER_FIELDS)
+        return len(batch)
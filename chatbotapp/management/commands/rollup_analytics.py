@@ -0,0 +1,153 @@
+# chatbot/management/commands/rollup_analytics.py
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from chatbotapp.conf import chatbot_setting
+from chatbotapp.models import ChatbotAnalytics, Message, ResponseJob, RollupWatermark
+from chatbotapp.sketches import HyperLogLog, QuantileSketch
+
+WATERMARK_NAME = 'chatbot_analytics'
+
+
+class _DayRollup:
+    """The contribution of newly processed messages to one day's analytics"""
+
+    def __init__(self):
+        self.messages = 0
+        self.sessions = HyperLogLog()
+        self.users = HyperLogLog()
+        self.response_times = QuantileSketch()
+
+
+class Command(BaseCommand):
+    help = (
+        "Roll new messages up into the daily ChatbotAnalytics rows. Only messages "
+        "after the last watermark are read, so the command is cheap to run from "
+        "cron as often as needed, and rerunning it never counts a message twice."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Messages to fold in per transaction")
+        parser.add_argument('--lag-seconds', type=int, default=60,
+                            help="Only read up to the highest message id seen at least this "
+                                 "long ago, so that transactions still in flight are not skipped")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        watermark, _ = RollupWatermark.objects.get_or_create(name=WATERMARK_NAME)
+        upper = self._upper_bound(watermark, options['lag_seconds'])
+        if upper <= watermark.last_message_id:
+            self.stdout.write("Analytics are up to date")
+            return
+
+        rows = (
+            Message.objects
+            .filter(id__gt=watermark.last_message_id, id__lte=upper)
+            .order_by('id')
+            .values_list('id', 'timestamp', 'message_type', 'chat_session_id',
+                         'chat_session__user_id', 'metadata')
+        )
+
+        processed = 0
+        days = defaultdict(_DayRollup)
+        flushed_id = last_id = watermark.last_message_id
+        for message_id, timestamp, message_type, session_id, user_id, metadata in rows.iterator(
+                chunk_size=options['batch_size']):
+            day = days[timezone.localdate(timestamp)]
+            day.messages += 1
+            day.sessions.add(session_id)
+            # Anonymous visitors are counted in sessions only
+            if user_id is not None:
+                day.users.add(user_id)
+            response_time = (metadata or {}).get('response_time') if message_type == 'bot' else None
+            if isinstance(response_time, (int, float)):
+                day.response_times.add(response_time)
+            last_id = message_id
+            processed += 1
+
+            if processed % options['batch_size'] == 0:
+                self._flush(days, flushed_id, last_id)
+                flushed_id = last_id
+                days = defaultdict(_DayRollup)
+        self._flush(days, flushed_id, last_id)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {processed} messages up to id {last_id} "
+            f"in {elapsed:.2f}s ({processed / elapsed if elapsed else 0:,.0f} messages/s)"
+        ))
+
+    def _upper_bound(self, watermark, lag_seconds):
+        """The highest message id that is safe to roll up
+
+        Ids are handed out when a message is inserted but become visible when its
+        transaction commits, so a lower id can show up after a higher one. Every
+        id up to the highest one visible at some moment was handed out by then,
+        so once `lag_seconds` have passed since, all of them have committed. Each
+        run reads up to the highest id seen by an earlier run at least that long
+        ago, and records what is visible now for a later one.
+        """
+        now = timezone.now()
+        visible = Message.objects.aggregate(upper=Max('id'))['upper'] or 0
+        upper = watermark.last_message_id
+        if lag_seconds <= 0:
+            upper = max(upper, visible)
+        elif watermark.observed_at is None or watermark.observed_at <= now - timedelta(seconds=lag_seconds):
+            upper = max(upper, watermark.observed_message_id)
+            RollupWatermark.objects.filter(pk=watermark.pk).update(observed_message_id=visible, observed_at=now)
+
+        # Bot messages still waiting on a background worker have no response time
+        # yet. Jobs older than the response timeout are given up on, so a stuck
+        # one can't hold the watermark back for good
+        abandoned = now - timedelta(minutes=chatbot_setting('RESPONSE_TIMEOUT_MINUTES', 30))
+        first_unfinished = (
+            ResponseJob.objects
+            .filter(status__in=['pending', 'running'], created_at__gt=abandoned)
+            .aggregate(first=Min('bot_message_id'))['first']
+        )
+        if first_unfinished is not None:
+            upper = min(upper, first_unfinished - 1)
+        return upper
+
+    def _flush(self, days, from_id, last_id):
+        """Merge the new contributions into the stored rows and move the watermark, atomically"""
+        if last_id == from_id:
+            return
+        with transaction.atomic():
+            watermark = RollupWatermark.objects.select_for_update().get(name=WATERMARK_NAME)
+            if watermark.last_message_id != from_id:
+                raise CommandError("The watermark moved underneath this run; is another rollup running?")
+
+            for date, day in days.items():
+                ChatbotAnalytics.objects.get_or_create(date=date)
+                analytics = ChatbotAnalytics.objects.select_for_update().get(date=date)
+
+                sessions = HyperLogLog.from_string(analytics.sessions_sketch)
+                sessions.merge(day.sessions)
+                users = HyperLogLog.from_string(analytics.users_sketch)
+                users.merge(day.users)
+                response_times = QuantileSketch.from_dict(analytics.response_time_sketch)
+                response_times.merge(day.response_times)
+
+                analytics.total_messages += day.messages
+                analytics.total_sessions = sessions.cardinality()
+                analytics.unique_users = users.cardinality()
+                analytics.avg_response_time = response_times.mean
+                analytics.response_time_count = response_times.count
+                analytics.response_time_p50 = response_times.quantile(0.50)
+                analytics.response_time_p95 = response_times.quantile(0.95)
+                analytics.response_time_p99 = response_times.quantile(0.99)
+                analytics.sessions_sketch = sessions.to_string()
+                analytics.users_sketch = users.to_string()
+                analytics.response_time_sketch = response_times.to_dict()
+                analytics.save()
+
+            watermark.last_message_id = last_id
+            watermark.save(update_fields=['last_message_id', 'updated_at'])
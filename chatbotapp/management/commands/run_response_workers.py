@@ -0,0 +1,98 @@
+# chatbot/management/commands/run_response_workers.py
+import logging
+import multiprocessing
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+logger = logging.getLogger(__name__)
+
+
+def _run_worker(poll_interval: float, once: bool):
+    """Claim and process jobs until told to stop"""
+    from chatbotapp import metrics
+    from chatbotapp.bot_logic import EnhancedChatBot
+    from chatbotapp.response_queue import claim_job, process_job, requeue_stale_jobs, worker_id
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    chatbot = EnhancedChatBot()
+    worker = worker_id()
+    last_reap = 0.0
+    logger.info(f"Response worker {worker} started")
+
+    while not stopping:
+        close_old_connections()
+        try:
+            if time.monotonic() - last_reap > 60:
+                requeue_stale_jobs()
+                last_reap = time.monotonic()
+
+            job = claim_job(worker)
+            if job is None:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            process_job(job, chatbot)
+            metrics.registry.flush()
+        except Exception as e:
+            logger.error(f"Response worker {worker} error: {e}")
+            time.sleep(poll_interval)
+
+    metrics.registry.flush(force=True)
+    logger.info(f"Response worker {worker} stopped")
+
+
+class Command(BaseCommand):
+    help = "Run a pool of worker processes that generate queued bot responses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                            help="Number of worker processes")
+        parser.add_argument('--poll-interval', type=float, default=0.5,
+                            help="Seconds to wait between polls of an empty queue")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        processes = max(1, options['processes'])
+        if processes == 1:
+            _run_worker(options['poll_interval'], options['once'])
+            return
+
+        # Children must open their own database connections
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(
+                target=_run_worker,
+                args=(options['poll_interval'], options['once']),
+                name=f"response-worker-{i}"
+            )
+            for i in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Started {processes} response workers")
+
+        def forward(signum, frame):
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+
+        signal.signal(signal.SIGTERM, forward)
+        signal.signal(signal.SIGINT, forward)
+
+        for worker in workers:
+            worker.join()
+        self.stdout.write("All response workers stopped")
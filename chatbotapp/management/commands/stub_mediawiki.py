@@ -0,0 +1,31 @@
+# chatbot/management/commands/stub_mediawiki.py
+from django.core.management.base import BaseCommand
+
+from chatbotapp.mediawiki_stub import MediaWikiStub
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve canned MediaWiki API responses locally. Point "
+        "CHATBOT_SETTINGS['WIKIMEDIA_API_URL'] at the printed URL to run the "
+        "chatbot without Wikipedia."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help="Seconds to wait before each response")
+        parser.add_argument('--responses-dir',
+                            help="Directory of search/summary/page/random.json files to replay")
+
+    def handle(self, *args, **options):
+        stub = MediaWikiStub(options['host'], options['port'], options['latency'], options['responses_dir'])
+        self.stdout.write(f"Serving canned MediaWiki responses at {stub.url}")
+        try:
+            stub.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stub.server.server_close()
+            self.stdout.write(f"Stopped after {stub.stats()}")
@@ -0,0 +1,120 @@
+# chatbot/mediawiki_stub.py
+# A local HTTP server that replays canned MediaWiki API responses, for testing
+# and benchmarking the Wikimedia transport without going to Wikipedia
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_RESPONSES_DIR = Path(__file__).resolve().parent / 'stubs' / 'mediawiki'
+
+
+def route(params: Dict[str, list]) -> str:
+    """Name of the canned response for a query, after the endpoints WikimediaClient uses"""
+    if params.get('list') == ['search']:
+        return 'search'
+    if params.get('generator') == ['random']:
+        return 'random'
+    if 'pageids' in params:
+        return 'page'
+    if 'titles' in params:
+        return 'summary'
+    return 'error'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes; with Nagle on, the body waits for
+    # the client's delayed ACK (~40 ms) on every response of a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+
+    def do_GET(self):
+        self.server.count('requests')
+        name = route(parse_qs(urlparse(self.path).query))
+        body = self.server.responses.get(name)
+        status = 200
+        if body is None:
+            status = 400
+            body = json.dumps({'error': {'code': 'badvalue', 'info': 'Unsupported query'}}).encode()
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            self.server.count('gzipped')
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        headers['Content-Length'] = str(len(body))
+
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, responses: Dict[str, bytes], latency: float):
+        super().__init__(address, _Handler)
+        self.responses = responses
+        self.latency = latency
+        self.counters = {'connections': 0, 'requests': 0, 'gzipped': 0}
+        self._lock = threading.Lock()
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+
+class MediaWikiStub:
+    """Serves the JSON files in `responses_dir` (search, summary, page, random) at /w/api.php"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 responses_dir: Optional[Path] = None):
+        responses = {
+            path.stem: path.read_bytes()
+            for path in Path(responses_dir or DEFAULT_RESPONSES_DIR).glob('*.json')
+        }
+        self.server = _StubHTTPServer((host, port), responses, latency)
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/w/api.php"
+
+    def start(self) -> 'MediaWikiStub':
+        self._thread = threading.Thread(target=self.server.serve_forever, name='mediawiki-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self) -> Dict[str, int]:
+        with self.server._lock:
+            return dict(self.server.counters)
+
+    def reset_stats(self):
+        with self.server._lock:
+            for name in self.server.counters:
+                self.server.counters[name] = 0
@@ -0,0 +1,101 @@
+# chatbot/message_rendering.py
+# HTML for message content, rendered once when a Message is saved (see
+# Message.content_html). Bot replies get the Markdown subset that Gemini and the
+# Wikipedia formatters produce: paragraphs, lists, headings, fenced code, bold,
+# italics, inline code and links. Every piece of text is escaped and only the
+# tags below are ever emitted, so the output is safe to insert as is.
+import re
+
+from django.utils.html import escape
+
+_FENCE = re.compile(r"^```[^\n]*\n(.*?)(?:^```[ \t]*$|\Z)", re.MULTILINE | re.DOTALL)
+_BULLET = re.compile(r"^\s*[-*•]\s+(.*)$")
+_NUMBERED = re.compile(r"^\s*\d+[.)]\s+(.*)$")
+_HEADING = re.compile(r"^#{1,6}\s+(.*?)\s*#*$")
+_INLINE = re.compile(
+    r"`(?P<code>[^`\n]+)`"
+    r"|\[(?P<label>[^\]\n]+)\]\((?P<href>https?://(?:[^\s()]|\([^\s()]*\))+)\)"
+    r"|(?P<url>https?://[^\s<>\"]+)"
+    r"|\*\*(?P<strong>[^\n]+?)\*\*"
+    r"|(?<![\w*])\*(?P<em>[^\s*](?:[^\n*]*[^\s*])?)\*(?![\w*])"
+)
+# Punctuation that ends a sentence rather than a bare URL
+_URL_TRAILING = '.,;:!?\'"'
+
+
+def _link(href: str, label: str) -> str:
+    return f'<a href="{escape(href)}" target="_blank" rel="nofollow noopener noreferrer">{label}</a>'
+
+
+def render_inline(text: str) -> str:
+    """Escaped text with inline Markdown turned into tags"""
+    html = []
+    position = 0
+    for match in _INLINE.finditer(text):
+        html.append(escape(text[position:match.start()]))
+        position = match.end()
+        if match['code'] is not None:
+            html.append(f"<code>{escape(match['code'])}</code>")
+        elif match['href'] is not None:
+            html.append(_link(match['href'], render_inline(match['label'])))
+        elif match['url'] is not None:
+            url = match['url']
+            # Wikipedia titles have parentheses; only an unbalanced one is punctuation
+            while url[-1] in _URL_TRAILING or (url[-1] == ')' and url.count(')') > url.count('(')):
+                url = url[:-1]
+            position = match.start() + len(url)
+            html.append(_link(url, escape(url)))
+        elif match['strong'] is not None:
+            html.append(f"<strong>{render_inline(match['strong'])}</strong>")
+        else:
+            html.append(f"<em>{render_inline(match['em'])}</em>")
+    html.append(escape(text[position:]))
+    return ''.join(html)
+
+
+def _render_block(block: str) -> str:
+    lines = [line for line in block.split('\n') if line.strip()]
+    if not lines:
+        return ''
+    if all(_BULLET.match(line) for line in lines):
+        items = ''.join(f"<li>{render_inline(_BULLET.match(line)[1])}</li>" for line in lines)
+        return f"<ul>{items}</ul>"
+    if all(_NUMBERED.match(line) for line in lines):
+        items = ''.join(f"<li>{render_inline(_NUMBERED.match(line)[1])}</li>" for line in lines)
+        return f"<ol>{items}</ol>"
+
+    html = []
+    paragraph = []
+    for line in lines:
+        heading = _HEADING.match(line)
+        if heading:
+            if paragraph:
+                html.append(f"<p>{'<br>'.join(paragraph)}</p>")
+                paragraph = []
+            html.append(f"<h4>{render_inline(heading[1])}</h4>")
+        else:
+            paragraph.append(render_inline(line.strip()))
+    if paragraph:
+        html.append(f"<p>{'<br>'.join(paragraph)}</p>")
+    return ''.join(html)
+
+
+def render_markdown(text: str) -> str:
+    """Sanitized HTML for Markdown-like bot output"""
+    text = text.replace('\r\n', '\n')
+    html = []
+    position = 0
+    for match in _FENCE.finditer(text):
+        html.extend(_render_block(block) for block in re.split(r"\n\s*\n", text[position:match.start()]))
+        html.append(f"<pre><code>{escape(match[1].rstrip())}</code></pre>")
+        position = match.end()
+    html.extend(_render_block(block) for block in re.split(r"\n\s*\n", text[position:]))
+    return ''.join(html)
+
+
+def render_message(content: str, message_type: str) -> str:
+    """The HTML a message is displayed with"""
+    if message_type == 'bot':
+        return render_markdown(content)
+    # Users' and system messages are shown as typed
+    return escape(content)
@@ -0,0 +1,261 @@
+# chatbot/message_search.py
+# Ranked full-text search over Message.content. On SQLite the index is an FTS5
+# table kept in sync with chatbotapp_message by triggers; on PostgreSQL it is a
+# GIN index over to_tsvector(content). Other databases fall back to LIKE.
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from django.db import connections
+from django.utils.html import escape
+
+from .conf import chatbot_setting
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_TABLE = 'chatbotapp_message'
+FTS_TABLE = 'chatbotapp_message_fts'
+
+# Private-use characters mark the matches in snippets until they are escaped
+_MARK_START, _MARK_END = '\ue000', '\ue001'
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def highlight(snippet: str) -> str:
+    """HTML for a snippet, with the matched terms in <mark>"""
+    return escape(snippet).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+class LikeSearchBackend:
+    """Unranked substring search, for databases without a full-text index"""
+
+    vendor = None
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self) -> bool:
+        """Create the index if it is missing; True when it had to be built"""
+        return False
+
+    def rebuild(self):
+        pass
+
+    def matching_ids(self, query: str) -> Tuple[str, list]:
+        """SQL selecting the ids of every message that matches, for use as a subquery"""
+        terms = _TERM.findall(query)
+        if not terms:
+            return f"SELECT id FROM {MESSAGE_TABLE} WHERE 1 = 0", []
+        where = ' AND '.join(['content LIKE %s'] * len(terms))
+        return f"SELECT id FROM {MESSAGE_TABLE} WHERE {where}", [f"%{term}%" for term in terms]
+
+    def search(self, query: str, scope: Tuple[str, list], limit: int, offset: int) -> List[Tuple[int, float, str]]:
+        """(message id, rank, snippet) of the matches within the `scope` chat session ids, best first"""
+        ids_sql, ids_params = self.matching_ids(query)
+        scope_sql, scope_params = scope
+        sql = (
+            f"SELECT id, 0, content FROM {MESSAGE_TABLE} "
+            f"WHERE id IN ({ids_sql}) AND chat_session_id IN ({scope_sql}) "
+            f"ORDER BY timestamp DESC, id DESC LIMIT %s OFFSET %s"
+        )
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, [*ids_params, *scope_params, limit, offset])
+            rows = cursor.fetchall()
+        return [(message_id, rank, self._snippet(content, query)) for message_id, rank, content in rows]
+
+    @staticmethod
+    def _snippet(content: str, query: str, width: int = 80) -> str:
+        lowered = content.lower()
+        positions = [lowered.find(term.lower()) for term in _TERM.findall(query)]
+        start = max(0, min((p for p in positions if p >= 0), default=0) - width // 2)
+        snippet = content[start:start + width]
+        for term in _TERM.findall(query):
+            snippet = re.sub(f"({re.escape(term)})", f"{_MARK_START}\\1{_MARK_END}", snippet, flags=re.IGNORECASE)
+        return f"{'…' if start else ''}{snippet}{'…' if start + width < len(content) else ''}"
+
+
+class SQLiteSearchBackend(LikeSearchBackend):
+    """FTS5 external-content table over chatbotapp_message, ranked by BM25"""
+
+    vendor = 'sqlite'
+
+    TRIGGERS = {
+        f'{FTS_TABLE}_ai': f"""
+            CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {MESSAGE_TABLE} BEGIN
+                INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+            END""",
+        f'{FTS_TABLE}_ad': f"""
+            CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {MESSAGE_TABLE} BEGIN
+                INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+            END""",
+        f'{FTS_TABLE}_au': f"""
+            CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF content ON {MESSAGE_TABLE} BEGIN
+                INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+                INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+            END""",
+    }
+
+    def install(self) -> bool:
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE name = %s OR (type = 'trigger' AND tbl_name = %s)",
+                [FTS_TABLE, MESSAGE_TABLE]
+            )
+            existing = {name for name, in cursor.fetchall()}
+            missing = ({FTS_TABLE} | set(self.TRIGGERS)) - existing
+            if not missing:
+                return False
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"content, content='{MESSAGE_TABLE}', content_rowid='id', "
+                f"tokenize='porter unicode61 remove_diacritics 2')"
+            )
+            for sql in self.TRIGGERS.values():
+                cursor.execute(sql)
+        # Rebuilding the table (e.g. by a migration) drops its triggers, and
+        # whatever changed since then is missing from the index
+        self.rebuild()
+        return True
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+    @staticmethod
+    def fts_query(query: str) -> Optional[str]:
+        """An FTS5 query matching every word, the last one as a prefix
+
+        User input is reduced to words and quoted, so it can't be FTS5 syntax.
+        """
+        terms = _TERM.findall(query)
+        if not terms:
+            return None
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += '*'
+        return ' '.join(quoted)
+
+    def matching_ids(self, query: str) -> Tuple[str, list]:
+        match = self.fts_query(query)
+        if match is None:
+            return f"SELECT rowid FROM {FTS_TABLE} WHERE 1 = 0", []
+        return f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]
+
+    def search(self, query: str, scope: Tuple[str, list], limit: int, offset: int) -> List[Tuple[int, float, str]]:
+        match = self.fts_query(query)
+        if match is None:
+            return []
+        scope_sql, scope_params = scope
+        sql = (
+            f"SELECT m.id, bm25({FTS_TABLE}) AS rank, "
+            f"snippet({FTS_TABLE}, 0, %s, %s, '…', %s) "
+            f"FROM {FTS_TABLE} JOIN {MESSAGE_TABLE} m ON m.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s AND m.chat_session_id IN ({scope_sql}) "
+            f"ORDER BY rank LIMIT %s OFFSET %s"
+        )
+        params = [_MARK_START, _MARK_END, chatbot_setting('SEARCH_SNIPPET_WORDS', 16), match,
+                  *scope_params, limit, offset]
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            # bm25() is lower for better matches
+            return [(message_id, -rank, snippet) for message_id, rank, snippet in cursor.fetchall()]
+
+
+class PostgresSearchBackend(LikeSearchBackend):
+    """GIN expression index over to_tsvector(content), ranked by ts_rank_cd"""
+
+    vendor = 'postgresql'
+    INDEX = 'chatbotapp_message_content_tsv'
+
+    @property
+    def config(self) -> str:
+        return chatbot_setting('SEARCH_CONFIG', 'english')
+
+    def _vector(self, column: str = 'content') -> str:
+        # Has to match the indexed expression exactly for the index to be used
+        return f"to_tsvector('{self.config}'::regconfig, {column})"
+
+    def install(self) -> bool:
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", [self.INDEX])
+            if cursor.fetchone():
+                return False
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.INDEX} ON {MESSAGE_TABLE} USING GIN ({self._vector()})"
+            )
+        return True
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"REINDEX INDEX {self.INDEX}")
+
+    def _tsquery(self) -> str:
+        return f"websearch_to_tsquery('{self.config}'::regconfig, %s)"
+
+    def matching_ids(self, query: str) -> Tuple[str, list]:
+        return f"SELECT id FROM {MESSAGE_TABLE} WHERE {self._vector()} @@ {self._tsquery()}", [query]
+
+    def search(self, query: str, scope: Tuple[str, list], limit: int, offset: int) -> List[Tuple[int, float, str]]:
+        scope_sql, scope_params = scope
+        options = (f"StartSel={_MARK_START}, StopSel={_MARK_END}, "
+                   f"MaxWords={chatbot_setting('SEARCH_SNIPPET_WORDS', 16)}, MinWords=5")
+        sql = (
+            f"SELECT m.id, ts_rank_cd({self._vector('m.content')}, q.query) AS rank, "
+            f"ts_headline('{self.config}'::regconfig, m.content, q.query, %s) "
+            f"FROM {MESSAGE_TABLE} m, (SELECT {self._tsquery()} AS query) q "
+            f"WHERE {self._vector('m.content')} @@ q.query AND m.chat_session_id IN ({scope_sql}) "
+            f"ORDER BY rank DESC, m.id DESC LIMIT %s OFFSET %s"
+        )
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, [options, query, *scope_params, limit, offset])
+            return cursor.fetchall()
+
+
+BACKENDS = {backend.vendor: backend for backend in (SQLiteSearchBackend, PostgresSearchBackend)}
+
+
+def get_backend(using: str = 'default', like: bool = False) -> LikeSearchBackend:
+    """The full-text backend for a database, or the LIKE one when `like` is set or there is none"""
+    connection = connections[using]
+    if like:
+        return LikeSearchBackend(connection)
+    return BACKENDS.get(connection.vendor, LikeSearchBackend)(connection)
+
+
+def search_messages(query: str, chat_sessions, page: int = 1, page_size: Optional[int] = None,
+                    using: str = 'default', like: bool = False):
+    """Search the messages of the `chat_sessions` queryset, best matches first
+
+    Returns the messages of the page, each with `.rank` and `.snippet` (HTML
+    with the matched terms in <mark>), and whether there are more pages.
+    """
+    from .models import Message
+
+    page_size = page_size or chatbot_setting('SEARCH_PAGE_SIZE', 20)
+    backend = get_backend(using, like)
+    scope = chat_sessions.values('id').query.sql_with_params()
+    rows = backend.search(query, scope, page_size + 1, (page - 1) * page_size)
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    messages = Message.objects.using(using).select_related('chat_session').in_bulk([row[0] for row in rows])
+    results = []
+    for message_id, rank, snippet in rows:
+        message = messages.get(message_id)
+        if message is not None:
+            message.rank = rank
+            message.snippet = highlight(snippet)
+            results.append(message)
+    return results, has_more
+
+
+def install(using: str = 'default') -> bool:
+    """Make sure the full-text index of a database exists and is being kept in sync"""
+    try:
+        created = get_backend(using).install()
+    except Exception as e:
+        logger.error(f"Failed to install the message search index on {using}: {e}")
+        return False
+    if created:
+        logger.info(f"Built the message search index on {using}")
+    return created
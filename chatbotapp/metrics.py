@@ -0,0 +1,430 @@
+# chatbot/metrics.py
+# Request and per-stage latency metrics. Durations go into in-process
+# histograms and into the trace of the current request, which views store in
+# Message.metadata. Each process periodically writes its histograms to
+# CHATBOT_SETTINGS['METRICS_DIR'] so the metrics endpoint can add up the
+# figures of every worker process.
+import atexit
+import bisect
+import contextvars
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .conf import chatbot_setting
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, one series per label combination"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str],
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            series = [[list(key), list(counts), total] for key, (counts, total) in self._series.items()]
+        return {'type': self.kind, 'help': self.documentation, 'labels': list(self.labelnames),
+                'buckets': list(self.buckets), 'series': series}
+
+
+class Counter:
+    """Monotonic counter, one series per label combination"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            series = [[list(key), value] for key, value in self._series.items()]
+        return {'type': self.kind, 'help': self.documentation, 'labels': list(self.labelnames),
+                'series': series}
+
+
+class Gauge(Counter):
+    """Value that goes up and down, one series per label combination; processes' values add up"""
+
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._series[key] = value
+
+
+class Registry:
+    """The metrics of this process, and the files other processes share theirs through"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        # Unique per process lifetime, so a recycled pid never overwrites a dead process's file
+        self._process_key = self._new_process_key()
+
+    @staticmethod
+    def _new_process_key() -> str:
+        return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def _after_fork(self):
+        # Forked children start with the parent's figures, which the parent reports itself
+        self._process_key = self._new_process_key()
+        self._last_flush = 0.0
+        self.reset()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def _directory(self) -> Optional[str]:
+        directory = chatbot_setting('METRICS_DIR', None)
+        return str(directory) if directory else None
+
+    def flush(self, force: bool = False):
+        """Write this process's metrics to the shared directory, at most every METRICS_FLUSH_SECONDS"""
+        directory = self._directory()
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < chatbot_setting('METRICS_FLUSH_SECONDS', 5):
+            return
+        self._last_flush = now
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, os.path.join(directory, f"{self._process_key}.json"))
+        except OSError as e:
+            logger.error(f"Error writing metrics to {directory}: {e}")
+
+    def reset(self):
+        with self._lock:
+            for metric in self._metrics.values():
+                with metric._lock:
+                    metric._series.clear()
+
+    def collect(self) -> Dict[str, Dict]:
+        """The metrics of every process sharing the metrics directory, added up
+
+        Files of processes that have exited are deleted on the way, so their
+        gauges stop counting; their counters and histograms drop out too, which
+        Prometheus handles like a process restart.
+        """
+        directory = self._directory()
+        if not directory:
+            return self.snapshot()
+
+        self.flush(force=True)
+        try:
+            filenames = os.listdir(directory)
+        except OSError as e:
+            logger.error(f"Error reading metrics from {directory}: {e}")
+            return self.snapshot()
+        snapshots = []
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if filename.startswith('.'):
+                # Temporary files left behind by a process that died mid-flush
+                if filename.startswith('.tmp-') and self._expired(path):
+                    self._remove(path)
+                continue
+            if not filename.endswith('.json'):
+                continue
+            if not self._is_live(filename[:-len('.json')], path):
+                self._remove(path)
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.error(f"Error reading metrics file {filename}: {e}")
+        return merge_snapshots(snapshots)
+
+    def _is_live(self, process_key: str, path: str) -> bool:
+        """Whether the process that wrote a metrics file is still running
+
+        Processes on this host are looked up by pid; for other hosts, whose
+        processes we can't see, a file counts as live until it goes
+        METRICS_STALE_SECONDS without being rewritten.
+        """
+        if process_key == self._process_key:
+            return True
+        try:
+            host, pid, _ = process_key.rsplit('-', 2)
+            pid = int(pid)
+        except ValueError:
+            return not self._expired(path)
+        if host != socket.gethostname():
+            return not self._expired(path)
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass  # Alive, but another user's
+        return True
+
+    @staticmethod
+    def _expired(path: str) -> bool:
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            return False
+        return age > chatbot_setting('METRICS_STALE_SECONDS', 600)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error removing stale metrics file {path}: {e}")
+
+
+def merge_snapshots(snapshots: List[Dict[str, Dict]]) -> Dict[str, Dict]:
+    """Add up the snapshots of several processes"""
+    merged: Dict[str, Dict] = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.get(name)
+            if target is None:
+                merged[name] = target = {**metric, 'series': {}}
+            elif target['type'] != metric['type'] or target.get('buckets') != metric.get('buckets'):
+                logger.error(f"Skipping incompatible series of metric {name}")
+                continue
+            for entry in metric['series']:
+                key = tuple(entry[0])
+                if metric['type'] == 'histogram':
+                    counts, total = target['series'].get(key, ([0] * len(entry[1]), 0.0))
+                    target['series'][key] = ([a + b for a, b in zip(counts, entry[1])], total + entry[2])
+                else:
+                    target['series'][key] = target['series'].get(key, 0) + entry[1]
+    for metric in merged.values():
+        if metric['type'] == 'histogram':
+            metric['series'] = [[list(key), counts, total] for key, (counts, total) in metric['series'].items()]
+        else:
+            metric['series'] = [[list(key), value] for key, value in metric['series'].items()]
+    return merged
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(metrics: Dict[str, Dict]) -> str:
+    """Render metrics in the Prometheus text exposition format"""
+    lines = []
+    for name in sorted(metrics):
+        metric = metrics[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labels = metric['labels']
+        for entry in sorted(metric['series'], key=lambda entry: entry[0]):
+            if metric['type'] == 'histogram':
+                values, counts, total = entry
+                cumulative = 0
+                for bound, count in zip(list(metric['buckets']) + ['+Inf'], counts):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _format_value(float(bound))
+                    lines.append(f"{name}_bucket{_format_labels(labels, values, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels, values)} {_format_value(float(total))}")
+                lines.append(f"{name}_count{_format_labels(labels, values)} {cumulative}")
+            else:
+                values, value = entry
+                lines.append(f"{name}{_format_labels(labels, values)} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+atexit.register(registry.flush, True)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry._after_fork)
+
+REQUEST_DURATION = registry.histogram(
+    'chatbot_request_duration_seconds', "Time spent handling a request", ['view', 'method', 'status']
+)
+STAGE_DURATION = registry.histogram(
+    'chatbot_stage_duration_seconds', "Time spent in one stage of handling a message", ['stage', 'outcome']
+)
+DB_QUERIES = registry.counter(
+    'chatbot_db_queries_total', "Database queries made while handling requests", ['view']
+)
+
+
+class Trace:
+    """The stage timings of one request or background job, and notes about how it was handled"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Dict] = {}
+        self.notes: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float, outcome: str = 'ok'):
+        # Stages can run in several threads at once during concurrent resolution
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                self.stages[name] = {'seconds': seconds, 'calls': 1, 'outcome': outcome}
+            else:
+                stage['seconds'] += seconds
+                stage['calls'] += 1
+                stage['outcome'] = outcome
+
+    def note(self, name: str, value):
+        with self._lock:
+            self.notes[name] = value
+
+    def outcome(self, name: str) -> Optional[str]:
+        """The outcome of the last run of a stage, or None if it did not run"""
+        with self._lock:
+            stage = self.stages.get(name)
+            return stage['outcome'] if stage else None
+
+    def notes_metadata(self) -> Dict[str, object]:
+        with self._lock:
+            return dict(self.notes)
+
+    def as_metadata(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                name: {**stage, 'seconds': round(stage['seconds'], 6)}
+                for name, stage in self.stages.items()
+            }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('chatbot_trace', default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def note(name: str, value):
+    """Record something about the current request in its trace, for Message.metadata"""
+    active = _current_trace.get()
+    if active is not None:
+        active.note(name, value)
+
+
+@contextmanager
+def trace(existing: Optional[Trace] = None):
+    """Make a trace current for the duration of the block"""
+    active = existing or Trace()
+    token = _current_trace.set(active)
+    try:
+        yield active
+    finally:
+        _current_trace.reset(token)
+
+
+class _Stage:
+    __slots__ = ('outcome',)
+
+    def __init__(self):
+        self.outcome = 'ok'
+
+
+@contextmanager
+def stage(name: str):
+    """Time a stage; set `.outcome` on the yielded object to record something other than 'ok'"""
+    timing = _Stage()
+    started = time.perf_counter()
+    try:
+        yield timing
+    except BaseException:
+        timing.outcome = 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.observe(elapsed, stage=name, outcome=timing.outcome)
+        active = _current_trace.get()
+        if active is not None:
+            active.add(name, elapsed, timing.outcome)
+
+
+def time_query(execute, sql, params, many, context):
+    """Database execute wrapper adding query time to the current trace"""
+    active = _current_trace.get()
+    if active is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        return execute(sql, params, many, context)
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        active.add('db', time.perf_counter() - started, outcome)
@@ -0,0 +1,84 @@
+# chatbot/middleware.py
+import math
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import JsonResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from . import metrics
+from .rate_limits import RateLimits, request_identities
+
+
+class MetricsMiddleware:
+    """Time every request and collect the stage timings made while handling it
+
+    The request runs inside a metrics trace, which views copy into
+    Message.metadata. Streaming responses are timed until the response
+    starts; their streams keep a trace of their own.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with metrics.trace() as trace:
+            response = self.get_response(request)
+        self.record(request, response, trace)
+        return response
+
+    async def __acall__(self, request):
+        with metrics.trace() as trace:
+            response = await self.get_response(request)
+        self.record(request, response, trace)
+        return response
+
+    def record(self, request, response, trace):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name or match._func_path) if match else 'unmatched'
+        metrics.REQUEST_DURATION.observe(
+            time.perf_counter() - trace.started,
+            view=view, method=request.method, status=response.status_code
+        )
+        db = trace.stages.get('db')
+        if db:
+            metrics.STAGE_DURATION.observe(db['seconds'], stage='db', outcome=db['outcome'])
+            metrics.DB_QUERIES.inc(db['calls'], view=view)
+        metrics.registry.flush()
+
+
+class RateLimitMiddleware(MiddlewareMixin):
+    """Refuse requests over the RATE_LIMITS of their view with 429 and Retry-After
+
+    Requests are counted per client IP and per signed-in user or anonymous
+    chat session, so it has to come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.rate_limits = RateLimits()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if match is None or request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return None
+        refused = self.rate_limits.check(match.url_name, request_identities(request))
+        if refused is None:
+            return None
+        scope, wait = refused
+        retry_after = max(1, math.ceil(wait))
+        metrics.note('rate_limited', scope)
+        response = JsonResponse({
+            'success': False,
+            'error': f'Too many requests. Please wait {retry_after} seconds and try again.',
+            'retry_after': retry_after,
+        }, status=429)
+        response['Retry-After'] = str(retry_after)
+        return response
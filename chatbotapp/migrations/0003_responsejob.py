@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:43
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbotapp', '0002_botpersonality_chatbotanalytics_chatsession_message_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResponseJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('bot_message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='response_job', to='chatbotapp.message')),
+                ('user_message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chatbotapp.message')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='chatbotapp__status_90c98e_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbotapp', '0003_responsejob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat_session', 'timestamp', 'id'], name='chatbotapp__chat_se_fcc652_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbotapp', '0004_message_session_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='bot_message_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='last_message_preview',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='message_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='user_message_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
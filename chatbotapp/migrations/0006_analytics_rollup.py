@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbotapp', '0005_chatsession_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('last_message_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chatbotanalytics',
+            name='response_time_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatbotanalytics',
+            name='response_time_p50',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='chatbotanalytics',
+            name='response_time_p95',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='chatbotanalytics',
+            name='response_time_p99',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='chatbotanalytics',
+            name='response_time_sketch',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='chatbotanalytics',
+            name='sessions_sketch',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='chatbotanalytics',
+            name='users_sketch',
+            field=models.TextField(blank=True),
+        ),
+    ]
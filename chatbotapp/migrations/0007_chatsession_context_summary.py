@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbotapp', '0006_analytics_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='context_summary',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='context_summary_last_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='context_summary_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
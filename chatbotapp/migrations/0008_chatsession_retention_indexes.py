@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbotapp', '0007_chatsession_context_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['updated_at'], name='chatbotapp__updated_76ed64_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['user', 'updated_at'], name='chatbotapp__user_id_e70c4f_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbotapp', '0008_chatsession_retention_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+    ]
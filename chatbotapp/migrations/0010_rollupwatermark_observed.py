@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbotapp', '0009_message_content_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupwatermark',
+            name='observed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='rollupwatermark',
+            name='observed_message_id',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -1,9 +1,16 @@
 # chatbot/models.py
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.utils.safestring import mark_safe
 import uuid
 
+from .message_rendering import render_message
+
+MESSAGE_PREVIEW_LENGTH = 100
+
 class ChatSession(models.Model):
     """Model to store chat sessions"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -13,15 +20,75 @@ class ChatSession(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
     
+    # Denormalized from the session's messages; see record_messages()
+    message_count = models.IntegerField(default=0)
+    user_message_count = models.IntegerField(default=0)
+    bot_message_count = models.IntegerField(default=0)
+    last_message_preview = models.CharField(max_length=200, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    
+    # Rolling summary of the messages that scrolled out of the Gemini context
+    # window, up to and including the message at (until, last_id); see context_window.py
+    context_summary = models.TextField(blank=True)
+    context_summary_until = models.DateTimeField(null=True, blank=True)
+    context_summary_last_id = models.BigIntegerField(default=0)
+    
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # Retention: sessions past their age, and each user's oldest
+            models.Index(fields=['updated_at']),
+            models.Index(fields=['user', 'updated_at']),
+        ]
     
     def __str__(self):
         return f"Chat {self.session_name} - {self.created_at.strftime('%Y-%m-%d %H:%M')}"
     
-    @property
-    def message_count(self):
-        return self.messages.count()
+    def _counter_updates(self, messages):
+        updates = {
+            'message_count': F('message_count') + len(messages),
+            'user_message_count': F('user_message_count') + sum(m.message_type == 'user' for m in messages),
+            'bot_message_count': F('bot_message_count') + sum(m.message_type == 'bot' for m in messages),
+            'updated_at': timezone.now(),
+        }
+        updates['last_message_at'] = max(m.timestamp for m in messages)
+        # Pending bot messages have no content yet; the preview is set once they do
+        with_content = [m for m in messages if m.content]
+        if with_content:
+            last_message = max(with_content, key=lambda m: (m.timestamp, m.id or 0))
+            updates['last_message_preview'] = last_message.content[:MESSAGE_PREVIEW_LENGTH]
+        return updates
+    
+    def record_messages(self, *messages):
+        """Atomically bump the counters and last-message fields for newly saved messages"""
+        ChatSession.objects.filter(pk=self.pk).update(**self._counter_updates(messages))
+    
+    def save_messages(self, *messages):
+        """Insert new messages of this session and record them, in one short transaction"""
+        # bulk_create() skips Message.save(), which renders the HTML
+        for message in messages:
+            message.render()
+        with transaction.atomic():
+            Message.objects.bulk_create(messages)
+            self.record_messages(*messages)
+    
+    async def asave_messages(self, *messages):
+        """Async version of save_messages()"""
+        await sync_to_async(self.save_messages)(*messages)
+    
+    def reset_counters(self):
+        """Reset the counters, last-message fields and context summary after the messages were cleared"""
+        ChatSession.objects.filter(pk=self.pk).update(
+            message_count=0,
+            user_message_count=0,
+            bot_message_count=0,
+            last_message_preview='',
+            last_message_at=None,
+            context_summary='',
+            context_summary_until=None,
+            context_summary_last_id=0,
+            updated_at=timezone.now()
+        )
 
 class Message(models.Model):
     """Model to store individual messages"""
@@ -34,6 +101,8 @@ class Message(models.Model):
     chat_session = models.ForeignKey(ChatSession, related_name='messages', on_delete=models.CASCADE)
     message_type = models.CharField(max_length=10, choices=MESSAGE_TYPES)
     content = models.TextField()
+    # Rendered from content on save; see message_rendering.py
+    content_html = models.TextField(blank=True, editable=False)
     timestamp = models.DateTimeField(default=timezone.now)
     is_read = models.BooleanField(default=False)
     
@@ -42,9 +111,32 @@ class Message(models.Model):
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Keyset pagination of a session's history by (timestamp, id)
+            models.Index(fields=['chat_session', 'timestamp', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.message_type}: {self.content[:50]}..."
+    
+    def render(self):
+        """Render content_html from the content"""
+        self.content_html = render_message(self.content, self.message_type)
+    
+    def save(self, *args, **kwargs):
+        self.render()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'content_html'}
+        super().save(*args, **kwargs)
+    
+    @property
+    def html(self):
+        """The sanitized HTML to display the message with"""
+        # Messages saved before content_html existed are rendered on the fly
+        if not self.content_html and self.content:
+            self.render()
+        return mark_safe(self.content_html)
 
 class BotPersonality(models.Model):
     """Model to store different bot personalities/configurations"""
@@ -81,9 +173,61 @@ class ChatbotAnalytics(models.Model):
     unique_users = models.IntegerField(default=0)
     avg_response_time = models.FloatField(default=0.0)
     
+    # Response time distribution, maintained by `manage.py rollup_analytics`
+    response_time_count = models.IntegerField(default=0)
+    response_time_p50 = models.FloatField(default=0.0)
+    response_time_p95 = models.FloatField(default=0.0)
+    response_time_p99 = models.FloatField(default=0.0)
+    
+    # Mergeable sketches the figures above are derived from
+    response_time_sketch = models.JSONField(default=dict, blank=True)
+    sessions_sketch = models.TextField(blank=True)
+    users_sketch = models.TextField(blank=True)
+    
     class Meta:
         unique_together = ['date']
         ordering = ['-date']
     
     def __str__(self):
-        return f"Analytics for {self.date}"
\ No newline at end of file
+        return f"Analytics for {self.date}"
+
+
+class RollupWatermark(models.Model):
+    """Model to store how far an incremental rollup has processed"""
+    name = models.CharField(max_length=100, unique=True)
+    last_message_id = models.BigIntegerField(default=0)
+    # The highest message id seen at `observed_at`; once every transaction
+    # that was in flight then has committed, messages up to it are safe to read
+    observed_message_id = models.BigIntegerField(default=0)
+    observed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} up to message {self.last_message_id}"
+
+class ResponseJob(models.Model):
+    """Model to queue bot responses for generation by background workers"""
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    user_message = models.ForeignKey(Message, related_name='+', on_delete=models.CASCADE)
+    bot_message = models.OneToOneField(Message, related_name='response_job', on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"Response job {self.id} ({self.status})"
@@ -0,0 +1,186 @@
+# chatbot/personalities.py
+# What Gemini is told to be: the system instruction of the user's preferred
+# BotPersonality, or of the default assistant. Instructions are compiled once
+# per process and kept until a BotPersonality is saved or deleted, and users'
+# preferred personalities are remembered until their UserPreferences change,
+# so answering a message takes no queries for either. Changes saved by other
+# processes arrive through a generation number in the cache, checked at most
+# every PERSONALITY_CACHE_CHECK_SECONDS. (QuerySet.update() sends no signals;
+# bump_generation() after one.)
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from string import Template
+from typing import Dict, Optional
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .conf import chatbot_setting
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERSONA = "You are a helpful and knowledgeable assistant."
+RESPONSE_GUIDELINES = (
+    "Please provide a helpful, informative, and conversational response to each message. "
+    "Please be concise but informative, and maintain a friendly tone."
+)
+GENERATION_KEY = 'chatbot:personalities:generation'
+
+
+class PromptTemplate:
+    """The compiled system instruction of a personality, or of the default assistant (id None)"""
+
+    __slots__ = ('personality_id', 'name', 'system_instruction', 'digest')
+
+    def __init__(self, personality_id: Optional[int], name: str, persona: str):
+        self.personality_id = personality_id
+        self.name = name
+        self.system_instruction = f"{persona.strip()}\n\n{RESPONSE_GUIDELINES}"
+        self.digest = hashlib.sha1(self.system_instruction.encode('utf-8')).hexdigest()[:12]
+
+    @property
+    def scope(self):
+        """Response cache scope: answers never outlive a change to the instruction"""
+        return None if self.personality_id is None else (self.personality_id, self.digest)
+
+    @classmethod
+    def compile(cls, personality_id: int, name: str, description: str, system_prompt: str) -> 'PromptTemplate':
+        # System prompts may refer to $name and $description
+        persona = Template(system_prompt).safe_substitute(name=name, description=description)
+        return cls(personality_id, name, persona or DEFAULT_PERSONA)
+
+
+DEFAULT_TEMPLATE = PromptTemplate(None, 'default', DEFAULT_PERSONA)
+
+
+class _PersonalityCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._templates: Dict[int, PromptTemplate] = {}
+        # user id -> preferred personality id, least recently used first
+        self._preferences: 'OrderedDict[int, Optional[int]]' = OrderedDict()
+        self._generation = None
+        self._checked = 0.0
+        # Bumped by every invalidation, so a lookup racing one does not store what it read
+        self._version = 0
+
+    def _check_generation(self):
+        now = time.monotonic()
+        if now - self._checked < chatbot_setting('PERSONALITY_CACHE_CHECK_SECONDS', 5):
+            return
+        self._checked = now
+        generation = cache.get(GENERATION_KEY)
+        if generation != self._generation:
+            with self._lock:
+                self._templates.clear()
+                self._preferences.clear()
+                self._generation = generation
+                self._version += 1
+
+    def template(self, personality_id: Optional[int]) -> PromptTemplate:
+        if personality_id is None:
+            return DEFAULT_TEMPLATE
+        self._check_generation()
+        template = self._templates.get(personality_id)
+        if template is None:
+            from .models import BotPersonality
+
+            version = self._version
+            row = (
+                BotPersonality.objects.filter(pk=personality_id, is_active=True)
+                .values_list('name', 'description', 'system_prompt').first()
+            )
+            # Inactive and deleted personalities answer as the default assistant
+            template = PromptTemplate.compile(personality_id, *row) if row else DEFAULT_TEMPLATE
+            with self._lock:
+                if version == self._version:
+                    self._templates[personality_id] = template
+        return template
+
+    def preferred_personality_id(self, user_id: Optional[int]) -> Optional[int]:
+        if not user_id:
+            return None
+        self._check_generation()
+        with self._lock:
+            if user_id in self._preferences:
+                self._preferences.move_to_end(user_id)
+                return self._preferences[user_id]
+            version = self._version
+        from .models import UserPreferences
+
+        personality_id = (
+            UserPreferences.objects.filter(user_id=user_id)
+            .values_list('preferred_bot_personality_id', flat=True).first()
+        )
+        with self._lock:
+            if version == self._version:
+                self._preferences[user_id] = personality_id
+            while len(self._preferences) > chatbot_setting('PERSONALITY_CACHE_USERS', 10000):
+                self._preferences.popitem(last=False)
+        return personality_id
+
+    def forget(self, personality_id: Optional[int] = None, user_id: Optional[int] = None):
+        with self._lock:
+            self._version += 1
+            if personality_id is not None:
+                self._templates.pop(personality_id, None)
+            if user_id is not None:
+                self._preferences.pop(user_id, None)
+
+    def bump_generation(self):
+        generation = uuid.uuid4().hex
+        try:
+            cache.set(GENERATION_KEY, generation, None)
+        except Exception as e:
+            logger.error(f"Error announcing a personality change to other processes: {e}")
+            return
+        with self._lock:
+            self._generation = generation
+
+
+_cache = _PersonalityCache()
+
+
+def get_template(personality_id: Optional[int]) -> PromptTemplate:
+    """The compiled instruction of a personality; the default one for None or an inactive personality"""
+    return _cache.template(personality_id)
+
+
+def preferred_personality_id(user_id: Optional[int]) -> Optional[int]:
+    """The BotPersonality a user prefers, if any"""
+    return _cache.preferred_personality_id(user_id)
+
+
+def template_for(chat_session=None, personality_id: Optional[int] = None) -> PromptTemplate:
+    """The instruction to answer in: the given personality, else the one the session's user prefers"""
+    if personality_id is None and chat_session is not None:
+        personality_id = preferred_personality_id(getattr(chat_session, 'user_id', None))
+    return get_template(personality_id)
+
+
+def bump_generation():
+    """Make every process drop its compiled instructions and remembered preferences"""
+    _cache.bump_generation()
+
+
+def _changed(using, **forget):
+    # Once committed, or a lookup in between could cache the old row again
+    def invalidate():
+        _cache.forget(**forget)
+        _cache.bump_generation()
+
+    transaction.on_commit(invalidate, using=using)
+
+
+def personality_changed(sender, instance, **kwargs):
+    """post_save/post_delete receiver for BotPersonality"""
+    _changed(kwargs.get('using'), personality_id=instance.pk)
+
+
+def preferences_changed(sender, instance, **kwargs):
+    """post_save/post_delete receiver for UserPreferences"""
+    _changed(kwargs.get('using'), user_id=instance.user_id)
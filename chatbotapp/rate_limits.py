@@ -0,0 +1,142 @@
+# chatbot/rate_limits.py
+# Request rate limits for the chat endpoints, per signed-in user, per anonymous
+# chat session and per client IP. Counts live in the cache, so every worker
+# process (and host, with a shared cache) enforces the same limits. Each limit
+# is a sliding window approximated from the counts of the current and previous
+# fixed windows, which takes two cache reads and one increment per check.
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+from . import anonymous_sessions, metrics
+from .conf import chatbot_setting, coordination_cache
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITED = metrics.registry.counter(
+    'chatbot_rate_limited_total', "Requests refused by a rate limit", ['view', 'scope']
+)
+
+DEFAULT_LIMITS = {
+    'send_message': {'user': (30, 60), 'session': (20, 60), 'ip': (60, 60)},
+    'send_message_stream': {'user': (30, 60), 'session': (20, 60), 'ip': (60, 60)},
+    'new_chat': {'user': (10, 60), 'session': (10, 60), 'ip': (20, 60)},
+    'clear_chat': {'user': (10, 60), 'session': (10, 60), 'ip': (20, 60)},
+}
+
+
+def client_ip(request) -> str:
+    """The client's address, taken from X-Forwarded-For behind RATE_LIMIT_PROXY_COUNT proxies"""
+    proxies = chatbot_setting('RATE_LIMIT_PROXY_COUNT', 0)
+    if proxies:
+        forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+        # Entries before the ones our own proxies added can be forged by the client
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def request_identities(request) -> Dict[str, str]:
+    """The scopes a request is counted in, with whom it is counted for in each"""
+    identities = {'ip': client_ip(request)}
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        identities['user'] = str(user.pk)
+    else:
+        session_id = anonymous_sessions.get_chat_session_id(request)
+        if session_id:
+            identities['session'] = str(session_id)
+    return identities
+
+
+class SlidingWindowLimiter:
+    """Counts requests per key in the cache, allowing at most `limit` in any `window` seconds
+
+    The count over the last window is estimated as the current fixed window's
+    count plus the previous one's, weighted by how much of it still overlaps.
+    The cache needs an atomic incr(), as on Redis, Memcached and the local
+    memory cache (which counts per process).
+    """
+
+    def __init__(self, cache_alias: Optional[str] = None):
+        self.cache = coordination_cache('RATE_LIMIT_CACHE_ALIAS', cache_alias)
+
+    def _keys(self, key: str, window: float, now: float) -> Tuple[str, str, float]:
+        index = int(now // window)
+        elapsed = (now - index * window) / window
+        return f"ratelimit:{key}:{index}", f"ratelimit:{key}:{index - 1}", elapsed
+
+    def _increment(self, cache_key: str, window: float) -> int:
+        # add() only sets the key if it is missing, so concurrent first requests are all counted
+        if self.cache.add(cache_key, 1, math.ceil(window * 2)):
+            return 1
+        try:
+            return self.cache.incr(cache_key)
+        except ValueError:
+            # Expired between add() and incr()
+            self.cache.set(cache_key, 1, math.ceil(window * 2))
+            return 1
+
+    def hit(self, key: str, limit: int, window: float) -> float:
+        """Count a request; 0 if it is within the limit, else the seconds until it would be"""
+        now = time.time()
+        current_key, previous_key, elapsed = self._keys(key, window, now)
+        previous = self.cache.get(previous_key, 0)
+        current = self._increment(current_key, window)
+        if previous * (1 - elapsed) + current <= limit:
+            return 0.0
+        # Refused requests are not counted, so clients retrying too fast still get their share
+        self.undo(key, window, now)
+        return self._retry_after(previous, current, limit, window, elapsed)
+
+    def undo(self, key: str, window: float, now: Optional[float] = None):
+        """Take back a request counted by hit()"""
+        current_key, _, _ = self._keys(key, window, now or time.time())
+        try:
+            self.cache.decr(current_key)
+        except ValueError:
+            pass
+
+    @staticmethod
+    def _retry_after(previous: int, current: int, limit: int, window: float, elapsed: float) -> float:
+        # Until enough of the previous window has slid out to make room
+        if previous and current <= limit:
+            wait = window * ((previous * (1 - elapsed) + current - limit) / previous)
+            if wait <= window * (1 - elapsed):
+                return wait
+        # Otherwise into the next window, where this window's count (less the
+        # refused request) slides out in turn
+        counted = current - 1
+        if not counted:
+            return window * (1 - elapsed)
+        return window * (1 - elapsed) + window * max(0, current - limit) / counted
+
+
+class RateLimits:
+    """The rate limits configured for each view in RATE_LIMITS"""
+
+    def __init__(self, limits: Optional[Dict] = None, limiter: Optional[SlidingWindowLimiter] = None):
+        self.limits = limits if limits is not None else chatbot_setting('RATE_LIMITS', DEFAULT_LIMITS)
+        self.limiter = limiter or SlidingWindowLimiter()
+
+    def check(self, view: str, identities: Dict[str, str]) -> Optional[Tuple[str, float]]:
+        """Count a request to a view; None if it may go ahead, else (scope, seconds to wait)"""
+        limits = self.limits.get(view)
+        if not limits:
+            return None
+        counted: List[Tuple[str, float]] = []
+        for scope, (limit, window) in limits.items():
+            identity = identities.get(scope)
+            if not identity:
+                continue
+            key = f"{view}:{scope}:{identity}"
+            wait = self.limiter.hit(key, limit, window)
+            if wait:
+                # A request refused by one limit does not use up the others
+                for counted_key, counted_window in counted:
+                    self.limiter.undo(counted_key, counted_window)
+                RATE_LIMITED.inc(view=view, scope=scope)
+                return scope, wait
+            counted.append((key, window))
+        return None
@@ -0,0 +1,274 @@
+# chatbot/resilience.py
+# Request deadlines, circuit breakers and hedged calls for the upstream APIs
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from . import metrics
+from .conf import chatbot_setting
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+DEFAULT_BREAKER = {'failure_threshold': 5, 'recovery_seconds': 30}
+
+UPSTREAM_EVENTS = metrics.registry.counter(
+    'chatbot_upstream_events_total',
+    "Deadline, circuit breaker and hedging events of the upstream APIs", ['upstream', 'event']
+)
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time before an upstream call could be made"""
+
+
+class CircuitOpenError(Exception):
+    """The upstream's circuit breaker is open, so the call was not attempted"""
+
+
+# Absolute time.monotonic() by which the current request has to be done
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('chatbot_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds: Optional[float] = None, at: Optional[float] = None):
+    """Bound every upstream call in the block; a nested deadline can only shorten the outer one"""
+    new = at if at is not None else time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        new = min(new, current)
+    token = _deadline.set(new)
+    try:
+        yield new
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one"""
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
+
+
+def timeout_for(default: float, upstream: str = '') -> float:
+    """The timeout for an upstream call: the default, capped by the time left"""
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        UPSTREAM_EVENTS.inc(upstream=upstream, event='deadline_exceeded')
+        raise DeadlineExceeded(f"No time left for the {upstream or 'upstream'} call")
+    return min(default, left)
+
+
+class CircuitBreaker:
+    """Fails calls fast after repeated upstream failures
+
+    Closed: calls go through, and `failure_threshold` consecutive failures
+    open the breaker. Open: calls are refused until `recovery_seconds` have
+    passed. Half-open: a single trial call is let through, which closes the
+    breaker if it succeeds and reopens it if it fails.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_seconds: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str):
+        if state != self.state:
+            logger.warning(f"Circuit breaker for {self.name} is now {state}")
+            UPSTREAM_EVENTS.inc(upstream=self.name, event=f'breaker_{state}')
+        self.state = state
+
+    def is_open(self) -> bool:
+        """Whether calls would be refused right now; unlike allow(), this starts no trial"""
+        return self.state == 'open' and time.monotonic() - self.opened_at < self.recovery_seconds
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.recovery_seconds:
+                    UPSTREAM_EVENTS.inc(upstream=self.name, event='rejected')
+                    return False
+                self._transition('half_open')
+            # Half-open: only one trial call at a time
+            if self._trial_running:
+                UPSTREAM_EVENTS.inc(upstream=self.name, event='rejected')
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_running = False
+            self._transition('closed')
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._transition('open')
+
+    def call(self, fn: Callable[[], T], is_failure: Callable[[Exception], bool] = lambda e: True) -> T:
+        """Call fn through the breaker; exceptions for which is_failure is False don't count"""
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit breaker for {self.name} is open")
+        try:
+            result = fn()
+        except Exception as e:
+            if is_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    async def acall(self, fn: Callable[[], Awaitable[T]],
+                    is_failure: Callable[[Exception], bool] = lambda e: True) -> T:
+        """call() for coroutines"""
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit breaker for {self.name} is open")
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # Hedged away or abandoned; says nothing about the upstream
+            with self._lock:
+                self._trial_running = False
+            raise
+        except Exception as e:
+            if is_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """The circuit breaker of an upstream, configured by CHATBOT_SETTINGS['CIRCUIT_BREAKERS'][name]"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                config = {**DEFAULT_BREAKER, **chatbot_setting('CIRCUIT_BREAKERS', {}).get(name, {})}
+                breaker = _breakers[name] = CircuitBreaker(name, **config)
+    return breaker
+
+
+_hedge_pool = None
+_hedge_pool_lock = threading.Lock()
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _hedge_pool_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(
+                    max_workers=chatbot_setting('HEDGE_WORKERS', 16), thread_name_prefix='chatbot-hedge'
+                )
+    return _hedge_pool
+
+
+def hedged(fn: Callable[[], T], delay: Optional[float], attempts: int = 2, upstream: str = '') -> T:
+    """Call fn, starting another attempt whenever none has answered within `delay` seconds
+
+    A failed attempt is retried right away, unless it was refused by an open
+    circuit breaker or the deadline, which would refuse the next one too. The
+    first successful result is returned; if every attempt fails, the last
+    error is raised. Only use this for idempotent reads. Without a delay, fn
+    is simply called once.
+    """
+    if not delay or attempts < 2:
+        return fn()
+
+    pool = _get_hedge_pool()
+    # Each attempt runs in a copy of this context, deadline and trace included
+    pending = {pool.submit(contextvars.copy_context().run, fn)}
+    started = 1
+    error = None
+    refused = False
+    try:
+        while pending:
+            can_hedge = started < attempts and not refused
+            done, pending = wait(pending, timeout=delay if can_hedge else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except (CircuitOpenError, DeadlineExceeded) as e:
+                    # Attempts already in flight may still answer; no new ones are started
+                    error = e
+                    refused = True
+                except Exception as e:
+                    error = e
+            if can_hedge and not refused and (not done or not pending):
+                # Slow (or failed) so far: race another attempt
+                UPSTREAM_EVENTS.inc(upstream=upstream, event='hedge' if not done else 'retry')
+                pending.add(pool.submit(contextvars.copy_context().run, fn))
+                started += 1
+    finally:
+        for future in pending:
+            future.cancel()
+    raise error
+
+
+async def ahedged(fn: Callable[[], Awaitable[T]], delay: Optional[float], attempts: int = 2,
+                  upstream: str = '') -> T:
+    """hedged() for coroutines; the attempts are tasks on the running event loop
+
+    Attempts still running once one has answered are cancelled.
+    """
+    if not delay or attempts < 2:
+        return await fn()
+
+    # Tasks run in a copy of this context, deadline and trace included
+    pending = {asyncio.ensure_future(fn())}
+    started = 1
+    error = None
+    refused = False
+    try:
+        while pending:
+            can_hedge = started < attempts and not refused
+            done, pending = await asyncio.wait(
+                pending, timeout=delay if can_hedge else None, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                try:
+                    return task.result()
+                except (CircuitOpenError, DeadlineExceeded) as e:
+                    error = e
+                    refused = True
+                except Exception as e:
+                    error = e
+            if can_hedge and not refused and (not done or not pending):
+                UPSTREAM_EVENTS.inc(upstream=upstream, event='hedge' if not done else 'retry')
+                pending.add(asyncio.ensure_future(fn()))
+                started += 1
+    finally:
+        for task in pending:
+            task.cancel()
+    raise error
@@ -0,0 +1,223 @@
+# chatbot/response_cache.py
+# In-process cache of Gemini answers to prompts asked without earlier turns.
+# Prompts are matched after normalization, and near-duplicates that differ
+# only in filler words ("how do I reset my password on the website" /
+# "...on this website") are found through 64-bit SimHash fingerprints of
+# the character shingles of their other words.
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from . import metrics
+from .conf import chatbot_setting
+
+RESPONSE_CACHE_EVENTS = metrics.registry.counter(
+    'chatbot_response_cache_events_total', "Lookups in the Gemini response cache", ['result']
+)
+
+_WORD = re.compile(r"[a-z0-9]+")
+# Contractions that would otherwise keep two phrasings of a question apart
+_CONTRACTIONS = {"what's": 'what is', "who's": 'who is', "where's": 'where is', "how's": 'how is',
+                 "it's": 'it is', "don't": 'do not', "can't": 'can not', "i'm": 'i am'}
+
+# Words a near-duplicate may add, drop or swap; any other difference can change the answer
+FILLER_WORDS = frozenset({'a', 'an', 'the', 'this', 'that', 'please'})
+
+FINGERPRINT_BITS = 64
+
+# Scope argument of ResponseCache.clear() meaning every personality
+ALL_SCOPES = object()
+
+
+def normalize(prompt: str) -> str:
+    """Lowercase words of a prompt without punctuation, for exact matching"""
+    text = prompt.lower().replace('’', "'")
+    for contraction, expansion in _CONTRACTIONS.items():
+        text = text.replace(contraction, expansion)
+    return ' '.join(_WORD.findall(text))
+
+
+def shingles(normalized: str, size: int = 4) -> FrozenSet[str]:
+    """Character n-grams of a normalized prompt, word boundaries included"""
+    text = f" {normalized} "
+    return frozenset(text[i:i + size] for i in range(max(1, len(text) - size + 1)))
+
+
+def simhash(features: FrozenSet[str]) -> int:
+    """64-bit SimHash: similar feature sets get fingerprints a few bits apart"""
+    weights = [0] * FINGERPRINT_BITS
+    for feature in features:
+        value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def content_words(normalized: str) -> str:
+    """A normalized prompt without its FILLER_WORDS, which is what gets fingerprinted"""
+    return ' '.join(word for word in normalized.split() if word not in FILLER_WORDS)
+
+
+def differ_in_filler_only(a: str, b: str) -> bool:
+    """Whether two normalized prompts have the same words, apart from FILLER_WORDS"""
+    return set(a.split()) ^ set(b.split()) <= FILLER_WORDS
+
+
+class _Entry:
+    __slots__ = ('key', 'response', 'fingerprint', 'features', 'created', 'generation_seconds', 'hits')
+
+    def __init__(self, key, response, fingerprint, features, generation_seconds):
+        self.key = key
+        self.response = response
+        self.fingerprint = fingerprint
+        self.features = features
+        self.created = time.monotonic()
+        self.generation_seconds = generation_seconds
+        self.hits = 0
+
+
+class ResponseCache:
+    """Gemini answers keyed by (BotPersonality, normalized prompt), with TTL and LRU eviction
+
+    With `near_duplicates` off, only exact matches of the normalized prompt
+    are served. Fingerprints leave filler words out, so prompts differing
+    only in those get the same one. Lookups use the pigeonhole trick:
+    fingerprints within `max_distance` bits of each other agree exactly on at
+    least one of `max_distance + 1` bands, so each band is a dict lookup. A
+    band match has to reach `min_similarity` (Jaccard, over the shingles) and
+    differ from the prompt in filler words only before its answer is reused:
+    one changed word ("Francia" for "France", "1st" for "first") can ask
+    something else entirely.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None,
+                 max_distance: Optional[int] = None, min_similarity: Optional[float] = None,
+                 near_min_words: Optional[int] = None, near_duplicates: Optional[bool] = None):
+        self.max_entries = max_entries or chatbot_setting('RESPONSE_CACHE_MAX_ENTRIES', 2000)
+        self.near_duplicates = (
+            chatbot_setting('RESPONSE_CACHE_NEAR_DUPLICATES', True) if near_duplicates is None else near_duplicates
+        )
+        self.ttl = ttl or chatbot_setting('RESPONSE_CACHE_TTL', 3600)
+        self.max_distance = chatbot_setting('RESPONSE_CACHE_MAX_DISTANCE', 3) if max_distance is None else max_distance
+        self.min_similarity = min_similarity or chatbot_setting('RESPONSE_CACHE_MIN_SIMILARITY', 0.8)
+        self.near_min_words = near_min_words or chatbot_setting('RESPONSE_CACHE_NEAR_MIN_WORDS', 4)
+        self._bands = self.max_distance + 1
+        self._band_bits = FINGERPRINT_BITS // self._bands
+        self._entries: 'OrderedDict[Tuple, _Entry]' = OrderedDict()
+        self._index: Dict[Tuple, set] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def _band_keys(self, scope, fingerprint: int):
+        mask = (1 << self._band_bits) - 1
+        return [(scope, band, fingerprint >> (band * self._band_bits) & mask) for band in range(self._bands)]
+
+    def _remove(self, entry: _Entry):
+        self._entries.pop(entry.key, None)
+        if entry.fingerprint is not None:
+            for band_key in self._band_keys(entry.key[0], entry.fingerprint):
+                keys = self._index.get(band_key)
+                if keys is not None:
+                    keys.discard(entry.key)
+                    if not keys:
+                        del self._index[band_key]
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return now - entry.created >= self.ttl
+
+    def _near(self, scope, normalized: str, fingerprint: int, features: FrozenSet[str],
+              now: float) -> Tuple[Optional[_Entry], int]:
+        best, best_distance = None, FINGERPRINT_BITS + 1
+        candidates = set()
+        for band_key in self._band_keys(scope, fingerprint):
+            candidates |= self._index.get(band_key, set())
+        for key in candidates:
+            entry = self._entries[key]
+            distance = bin(entry.fingerprint ^ fingerprint).count('1')
+            if (distance < best_distance and not self._expired(entry, now)
+                    and jaccard(entry.features, features) >= self.min_similarity
+                    and differ_in_filler_only(key[1], normalized)):
+                best, best_distance = entry, distance
+        return best, best_distance
+
+    def _fingerprinted(self, normalized: str) -> bool:
+        return self.near_duplicates and len(normalized.split()) >= self.near_min_words
+
+    def get(self, prompt: str, scope=None) -> Optional[Dict]:
+        """The cached answer for a prompt or a near-duplicate of it, with how it matched"""
+        normalized = normalize(prompt)
+        key = (scope, normalized)
+        now = time.monotonic()
+        match = distance = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                self._remove(entry)
+                entry = None
+            if entry is not None:
+                match, distance = 'exact', 0
+            elif self._fingerprinted(normalized):
+                features = shingles(normalized)
+                fingerprint = simhash(shingles(content_words(normalized)))
+                entry, distance = self._near(scope, normalized, fingerprint, features, now)
+                if entry is not None:
+                    match = 'near'
+            if entry is None:
+                RESPONSE_CACHE_EVENTS.inc(result='miss')
+                return None
+            self._entries.move_to_end(entry.key)
+            entry.hits += 1
+        RESPONSE_CACHE_EVENTS.inc(result=f'{match}_hit')
+        return {
+            'response': entry.response,
+            'match': match,
+            'distance': distance,
+            'age_seconds': round(now - entry.created, 3),
+            'saved_seconds': round(entry.generation_seconds, 6),
+        }
+
+    def set(self, prompt: str, response: str, scope=None, generation_seconds: float = 0.0):
+        normalized = normalize(prompt)
+        key = (scope, normalized)
+        fingerprint = features = None
+        if self._fingerprinted(normalized):
+            features = shingles(normalized)
+            fingerprint = simhash(shingles(content_words(normalized)))
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None:
+                self._remove(previous)
+            entry = _Entry(key, response, fingerprint, features, generation_seconds)
+            self._entries[key] = entry
+            if fingerprint is not None:
+                for band_key in self._band_keys(scope, fingerprint):
+                    self._index[band_key].add(key)
+            self._evict(time.monotonic())
+
+    def _evict(self, now: float):
+        """Drop expired entries from the LRU end, then the least recently used over the cap"""
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if not self._expired(entry, now) and len(self._entries) <= self.max_entries:
+                break
+            self._remove(entry)
+            RESPONSE_CACHE_EVENTS.inc(result='evicted')
+
+    def clear(self, scope=ALL_SCOPES):
+        """Forget every answer, or only those of one personality"""
+        with self._lock:
+            for entry in list(self._entries.values()):
+                if scope is ALL_SCOPES or entry.key[0] == scope:
+                    self._remove(entry)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'size': len(self._entries), 'max_entries': self.max_entries, 'ttl': self.ttl}
@@ -0,0 +1,176 @@
+# chatbot/response_queue.py
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+from typing import Optional, Tuple
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics, resilience
+from .conf import chatbot_setting
+from .models import MESSAGE_PREVIEW_LENGTH, ChatSession, Message, ResponseJob
+
+logger = logging.getLogger(__name__)
+
+ERROR_RESPONSE = "I apologize, but I encountered an error while processing your request. Please try again."
+
+
+def background_responses_enabled() -> bool:
+    return chatbot_setting('BACKGROUND_RESPONSES', False)
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_response(chat_session: ChatSession, content: str) -> Tuple[Message, Message]:
+    """Save the user message and a pending bot message, and queue the bot response"""
+    with transaction.atomic():
+        user_message = Message.objects.create(
+            chat_session=chat_session,
+            message_type='user',
+            content=content
+        )
+        bot_message = Message.objects.create(
+            chat_session=chat_session,
+            message_type='bot',
+            content='',
+            metadata={'status': 'pending'}
+        )
+        ResponseJob.objects.create(user_message=user_message, bot_message=bot_message)
+        chat_session.record_messages(user_message, bot_message)
+    return user_message, bot_message
+
+
+def claim_job(worker: str) -> Optional[ResponseJob]:
+    """Take the oldest pending job off the queue, or return None if there is none"""
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = (
+                ResponseJob.objects
+                .select_for_update(skip_locked=True)
+                .filter(status='pending')
+                .order_by('created_at', 'id')
+                .first()
+            )
+            if job is None:
+                return None
+            job.status = 'running'
+            job.worker = worker
+            job.started_at = timezone.now()
+            job.attempts += 1
+            job.save(update_fields=['status', 'worker', 'started_at', 'attempts'])
+            return job
+
+    # Without row locks (SQLite), claim with a compare-and-set on the status
+    candidates = (
+        ResponseJob.objects
+        .filter(status='pending')
+        .order_by('created_at', 'id')
+        .values_list('id', flat=True)[:10]
+    )
+    for job_id in candidates:
+        claimed = ResponseJob.objects.filter(id=job_id, status='pending').update(
+            status='running',
+            worker=worker,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1
+        )
+        if claimed:
+            return ResponseJob.objects.get(id=job_id)
+    return None
+
+
+def answered_by_gemini(trace: metrics.Trace) -> bool:
+    """Whether the reply made in a trace came from Gemini (or its response cache)"""
+    return trace.outcome('gemini.generate') in ('ok', 'cache_hit')
+
+
+def process_job(job: ResponseJob, chatbot) -> Optional[Message]:
+    """Generate the bot response for a claimed job and fill in the pending bot message
+
+    Returns None, leaving the message alone, if the job was taken away from
+    this worker meanwhile (requeued or failed by requeue_stale_jobs).
+    """
+    user_message = job.user_message
+    bot_message = job.bot_message
+    chat_session = bot_message.chat_session
+
+    start_time = time.time()
+    status = 'done'
+    with metrics.trace() as trace:
+        with metrics.stage('route'):
+            intent = chatbot.route(user_message.content)
+        try:
+            with resilience.deadline(chatbot_setting('REQUEST_DEADLINE_SECONDS', 30)), metrics.stage('respond'):
+                content = chatbot.get_response(user_message.content, chat_session, intent=intent)
+        except Exception as e:
+            logger.error(f"Error generating bot response for job {job.id}: {e}")
+            content = ERROR_RESPONSE
+            status = 'failed'
+    finished_at = timezone.now()
+
+    bot_message.content = content
+    bot_message.metadata = {
+        **bot_message.metadata,
+        'status': status,
+        'response_time': time.time() - start_time,
+        'queue_wait': (job.started_at - job.created_at).total_seconds(),
+        'processing_time': (finished_at - job.started_at).total_seconds(),
+        'intent': intent.name,
+        'used_wikimedia': intent.uses_wikimedia,
+        'used_gemini': answered_by_gemini(trace),
+        'worker': job.worker,
+        'stages': trace.as_metadata(),
+        **trace.notes_metadata(),
+    }
+    with transaction.atomic():
+        # Only while the job is still this worker's claim, so a reply never lands twice
+        finished = ResponseJob.objects.filter(
+            id=job.id, status='running', worker=job.worker, attempts=job.attempts
+        ).update(status=status, finished_at=finished_at)
+        if not finished:
+            logger.warning(f"Response job {job.id} was taken from {job.worker} before it finished; dropping its reply")
+            return None
+        bot_message.save(update_fields=['content', 'metadata'])
+        ChatSession.objects.filter(pk=chat_session.pk).update(
+            updated_at=finished_at,
+            last_message_preview=content[:MESSAGE_PREVIEW_LENGTH]
+        )
+    # The reply is out, so the worker can take the time to summarize
+    chatbot.fold_context(chat_session, background=False)
+    return bot_message
+
+
+def requeue_stale_jobs() -> int:
+    """Put jobs whose worker died back on the queue, or fail them after too many attempts
+
+    A job counts as stale once it has been running for longer than
+    CHATBOT_SETTINGS['RESPONSE_TIMEOUT_MINUTES'].
+    """
+    cutoff = timezone.now() - timedelta(minutes=chatbot_setting('RESPONSE_TIMEOUT_MINUTES', 30))
+    max_attempts = chatbot_setting('BACKGROUND_MAX_ATTEMPTS', 3)
+    stale = ResponseJob.objects.filter(status='running', started_at__lt=cutoff)
+
+    requeued = stale.filter(attempts__lt=max_attempts).update(status='pending', worker='', started_at=None)
+
+    failed = 0
+    for job in stale.filter(attempts__gte=max_attempts).select_related('bot_message'):
+        with transaction.atomic():
+            if ResponseJob.objects.filter(id=job.id, status='running').update(
+                    status='failed', finished_at=timezone.now()):
+                bot_message = job.bot_message
+                bot_message.content = ERROR_RESPONSE
+                bot_message.metadata = {**bot_message.metadata, 'status': 'failed'}
+                bot_message.save(update_fields=['content', 'metadata'])
+                # Moves the cache key of the session's rendered messages
+                ChatSession.objects.filter(pk=bot_message.chat_session_id).update(updated_at=timezone.now())
+                failed += 1
+
+    if requeued or failed:
+        logger.warning(f"Requeued {requeued} and failed {failed} stale response jobs")
+    return requeued + failed
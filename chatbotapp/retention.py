@@ -0,0 +1,285 @@
+# chatbot/retention.py
+# Enforces AUTO_DELETE_OLD_SESSIONS_DAYS and MAX_SESSIONS_PER_USER. Sessions
+# are archived to gzipped JSONL, one line per session with its messages, and
+# then deleted a batch at a time with one DELETE statement per table; Django's
+# cascade collector would load every message just to find their response jobs.
+#
+# Progress is kept in a state file next to the archives, so an interrupted run
+# is picked up where it stopped by the next one.
+import gzip
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.db.models import Exists, F, OuterRef, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .conf import chatbot_setting
+from .models import ChatSession, Message, ResponseJob, RollupWatermark
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = 'retention-state.json'
+ANALYTICS_WATERMARK = 'chatbot_analytics'
+
+# Age first, so sessions it removes no longer count against the per-user limit
+PHASES = ['age', 'limit']
+
+
+def archive_dir() -> Path:
+    return Path(chatbot_setting('RETENTION_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'archive'))
+
+
+class RetentionStats:
+    """Counts and timings of a retention run"""
+
+    def __init__(self):
+        self.sessions = 0
+        self.messages = 0
+        self.bytes = 0
+        self.batches = 0
+        self.seconds = 0.0
+
+    def add(self, sessions: int, messages: int, size: int, seconds: float):
+        self.sessions += sessions
+        self.messages += messages
+        self.bytes += size
+        self.batches += 1
+        self.seconds += seconds
+
+    def __str__(self):
+        seconds = self.seconds or 1e-9
+        return (
+            f"{self.sessions} sessions and {self.messages} messages in {self.batches} batches, "
+            f"{self.bytes / 1024 / 1024:.2f} MB archived, {self.seconds:.2f}s "
+            f"({self.sessions / seconds:,.0f} sessions/s, {self.messages / seconds:,.0f} messages/s)"
+        )
+
+
+class Retention:
+    """Archives and deletes the chat sessions past their age or per-user limit
+
+    A run moves through PHASES, archiving `batch_size` sessions per file and
+    deleting them in the same transaction that re-reads them, so a session that
+    gets a message meanwhile is either archived with it or waits for the next
+    run. The state file records the batch in flight before it is deleted;
+    resuming checks whether that delete committed.
+    """
+
+    def __init__(self, max_age_days: Optional[int] = None, max_sessions_per_user: Optional[int] = None,
+                 batch_size: Optional[int] = None, directory: Optional[Path] = None, using: str = 'default'):
+        self.max_age_days = max_age_days or chatbot_setting('AUTO_DELETE_OLD_SESSIONS_DAYS', 30)
+        self.max_sessions_per_user = max_sessions_per_user or chatbot_setting('MAX_SESSIONS_PER_USER', 50)
+        self.batch_size = batch_size or chatbot_setting('RETENTION_BATCH_SIZE', 100)
+        self.directory = Path(directory or archive_dir())
+        self.using = using
+
+    # Selection
+
+    def candidates(self, phase: str, cutoff):
+        """Sessions due for archival in a phase, oldest activity first"""
+        sessions = ChatSession.objects.using(self.using)
+        if phase == 'age':
+            sessions = sessions.filter(updated_at__lt=cutoff)
+        else:
+            sessions = sessions.filter(user__isnull=False).annotate(
+                newer=Window(RowNumber(), partition_by=F('user'), order_by=[F('updated_at').desc(), F('id').desc()])
+            ).filter(newer__gt=self.max_sessions_per_user)
+
+        # Messages the analytics rollup hasn't counted yet stay until it has
+        watermark = (
+            RollupWatermark.objects.using(self.using)
+            .filter(name=ANALYTICS_WATERMARK).values_list('last_message_id', flat=True).first()
+        )
+        if watermark is not None:
+            sessions = sessions.filter(~Exists(
+                Message.objects.filter(chat_session=OuterRef('pk'), id__gt=watermark)
+            ))
+        return sessions.order_by('updated_at', 'id')
+
+    def count(self, cutoff) -> Dict[str, Dict[str, int]]:
+        """Sessions and messages each phase would archive, for a dry run"""
+        counts = {}
+        excluded = []
+        for phase in PHASES:
+            ids = list(self.candidates(phase, cutoff).exclude(pk__in=excluded).values_list('pk', flat=True))
+            excluded += ids
+            counts[phase] = {
+                'sessions': len(ids),
+                'messages': Message.objects.using(self.using).filter(chat_session__in=ids).count(),
+            }
+        return counts
+
+    # State
+
+    @property
+    def state_path(self) -> Path:
+        return self.directory / STATE_FILE
+
+    def load_state(self) -> Optional[Dict]:
+        try:
+            state = json.loads(self.state_path.read_text())
+        except FileNotFoundError:
+            return None
+        return None if state.get('finished') else state
+
+    def save_state(self, state: Dict):
+        # Written to the side and renamed, so a crash never leaves half a file
+        tmp = self.state_path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(state, cls=DjangoJSONEncoder, indent=2))
+        os.replace(tmp, self.state_path)
+
+    def new_state(self) -> Dict:
+        now = timezone.now()
+        return {
+            'run': now.strftime('%Y%m%dT%H%M%S'),
+            'cutoff': (now - timedelta(days=self.max_age_days)).isoformat(),
+            'phase': PHASES[0],
+            'sequence': 0,
+            'pending': None,
+            'finished': False,
+        }
+
+    # Running
+
+    def run(self, max_batches: Optional[int] = None, pause: float = 0.0, progress=None) -> RetentionStats:
+        """Archive and delete due sessions until none are left or `max_batches` were done"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        state = self.load_state()
+        if state is None:
+            state = self.new_state()
+            self.save_state(state)
+        else:
+            logger.info(f"Resuming retention run {state['run']} in phase {state['phase']}")
+        # Resumed runs keep their cutoff, so their batches stay the same
+        cutoff = parse_datetime(state['cutoff'])
+
+        if state['pending']:
+            self._recover(state)
+
+        stats = RetentionStats()
+        while state['phase'] is not None:
+            if max_batches is not None and stats.batches >= max_batches:
+                return stats
+            started = time.perf_counter()
+            done = self._batch(state, cutoff)
+            if done is None:
+                following = PHASES.index(state['phase']) + 1
+                state['phase'] = PHASES[following] if following < len(PHASES) else None
+                self.save_state(state)
+                continue
+            stats.add(*done, time.perf_counter() - started)
+            if progress:
+                progress(state, stats)
+            if pause:
+                time.sleep(pause)
+
+        state['finished'] = True
+        self.save_state(state)
+        return stats
+
+    def _archive_path(self, state: Dict) -> Path:
+        return self.directory / f"sessions-{state['run']}-{state['sequence']:05d}.jsonl.gz"
+
+    def _batch(self, state: Dict, cutoff):
+        """Archive and delete one batch; (sessions, messages, bytes), or None when the phase is done"""
+        path = self._archive_path(state)
+        due = self.candidates(state['phase'], cutoff)
+        with transaction.atomic(using=self.using):
+            ids = list(due.values_list('pk', flat=True)[:self.batch_size])
+            if not ids:
+                return None
+            # Locked sessions get no new messages; those that got one before
+            # the lock may not be due any more
+            sessions = ChatSession.objects.using(self.using).select_for_update().filter(pk__in=ids)
+            list(sessions.values_list('pk', flat=True))
+            sessions = list(sessions.filter(pk__in=due.values('pk')).order_by('updated_at', 'id'))
+            if not sessions:
+                return 0, 0, 0
+            ids = [session.pk for session in sessions]
+            messages, size = self._write_archive(path, sessions)
+
+            # Recorded before the delete, which may or may not commit
+            state['pending'] = {'file': path.name, 'sessions': ids}
+            self.save_state(state)
+            self._delete(ids)
+
+        self._complete(state)
+        logger.info(f"Archived {len(ids)} chat sessions ({messages} messages) to {path.name}")
+        return len(ids), messages, size
+
+    def _write_archive(self, path: Path, sessions: List[ChatSession]):
+        """One JSON line per session, with its messages in order; returns (messages, bytes)"""
+        by_session = {session.pk: [] for session in sessions}
+        rows = (
+            Message.objects.using(self.using)
+            .filter(chat_session__in=list(by_session))
+            .order_by('chat_session', 'timestamp', 'id')
+            .values('id', 'chat_session_id', 'message_type', 'content', 'timestamp', 'is_read', 'metadata')
+        )
+        count = 0
+        for row in rows.iterator(chunk_size=2000):
+            by_session[row.pop('chat_session_id')].append(row)
+            count += 1
+
+        fields = [field.attname for field in ChatSession._meta.concrete_fields]
+        tmp = path.with_name(f"{path.name}.part")
+        with open(tmp, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+                for session in sessions:
+                    record = {
+                        'session': {name: getattr(session, name) for name in fields},
+                        'messages': by_session[session.pk],
+                    }
+                    archive.write(json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False).encode('utf-8'))
+                    archive.write(b'\n')
+            # On disk before the sessions it holds are deleted
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp, path)
+        return count, path.stat().st_size
+
+    def _delete(self, ids: List[uuid.UUID]):
+        """Delete sessions with their messages and response jobs, one statement per table"""
+        connection = connections[self.using]
+        pk_field = ChatSession._meta.pk
+        params = [pk_field.get_db_prep_value(pk, connection) for pk in ids]
+        placeholders = ', '.join(['%s'] * len(params))
+        qn = connection.ops.quote_name
+        messages = qn(Message._meta.db_table)
+        session_messages = f"SELECT id FROM {messages} WHERE chat_session_id IN ({placeholders})"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {qn(ResponseJob._meta.db_table)} "
+                f"WHERE user_message_id IN ({session_messages}) OR bot_message_id IN ({session_messages})",
+                params + params
+            )
+            cursor.execute(f"DELETE FROM {messages} WHERE chat_session_id IN ({placeholders})", params)
+            cursor.execute(f"DELETE FROM {qn(ChatSession._meta.db_table)} WHERE id IN ({placeholders})", params)
+
+    def _complete(self, state: Dict):
+        state['pending'] = None
+        state['sequence'] += 1
+        self.save_state(state)
+
+    def _recover(self, state: Dict):
+        """Settle the batch an interrupted run was deleting"""
+        pending = state['pending']
+        left = ChatSession.objects.using(self.using).filter(pk__in=pending['sessions']).exists()
+        if left:
+            # The delete never committed; the batch is archived again under the same name
+            logger.info(f"Redoing batch {pending['file']} of an interrupted retention run")
+            state['pending'] = None
+            self.save_state(state)
+        else:
+            self._complete(state)
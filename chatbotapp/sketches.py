@@ -0,0 +1,141 @@
+# chatbot/sketches.py
+# Mergeable sketches for the analytics rollup: each day's sketch is stored and
+# merged with the sketch of newly processed rows instead of rescanning history
+import base64
+import hashlib
+import math
+from typing import Dict, Optional
+
+
+class QuantileSketch:
+    """Quantile sketch with relative-error guarantees (DDSketch)
+
+    Positive values are counted in logarithmically sized buckets, so any
+    quantile is accurate to within `relative_accuracy` of the true value.
+    Merging is adding bucket counts.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: float, count: int = 1):
+        value = max(float(value), 0.0)
+        if value <= 1e-9:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: 'QuantileSketch'):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracies")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Midpoint of the bucket in the relative-error sense
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'buckets': {str(index): count for index, count in self.buckets.items()},
+            'zero_count': self.zero_count,
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict]) -> 'QuantileSketch':
+        data = data or {}
+        sketch = cls(data.get('relative_accuracy', 0.01))
+        sketch.buckets = {int(index): count for index, count in data.get('buckets', {}).items()}
+        sketch.zero_count = data.get('zero_count', 0)
+        sketch.count = data.get('count', 0)
+        sketch.sum = data.get('sum', 0.0)
+        sketch.min = data.get('min')
+        sketch.max = data.get('max')
+        return sketch
+
+
+class HyperLogLog:
+    """Distinct-count sketch (HyperLogLog with linear counting for small sets)
+
+    With the default precision of 12 bits it uses 4 KB and estimates
+    cardinalities to within about 1.6%. Merging is a register-wise max.
+    """
+
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, value):
+        digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'big')
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with different precisions")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def cardinality(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+    def to_string(self) -> str:
+        return base64.b64encode(bytes([self.precision]) + bytes(self.registers)).decode('ascii')
+
+    @classmethod
+    def from_string(cls, data: str) -> 'HyperLogLog':
+        if not data:
+            return cls()
+        raw = base64.b64decode(data)
+        sketch = cls(raw[0])
+        sketch.registers = bytearray(raw[1:])
+        return sketch
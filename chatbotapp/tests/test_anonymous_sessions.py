@@ -0,0 +1,86 @@
+# chatbot/tests/test_anonymous_sessions.py
+import json
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from chatbotapp import anonymous_sessions
+from chatbotapp.models import ChatSession
+
+from .utils import LOCAL_CACHES, chatbot_settings, join_anonymous_chat
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+# Queue the responses, so no upstream is called
+@chatbot_settings(METRICS_DIR=None, RATE_LIMITS={}, BACKGROUND_RESPONSES=True)
+class AnonymousChatSessionTests(TestCase):
+    def send(self, message='Hello', session_id=None):
+        return self.client.post(
+            reverse('send_message'), json.dumps({'message': message, 'session_id': session_id}),
+            content_type='application/json'
+        )
+
+    def get_messages(self, chat_session_id):
+        return self.client.get(reverse('get_messages', args=[chat_session_id]))
+
+    def test_loading_the_page_creates_no_session(self):
+        self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+        self.assertFalse(ChatSession.objects.exists())
+        self.assertNotIn(anonymous_sessions.COOKIE_NAME, self.client.cookies)
+
+    def test_first_message_creates_a_session_behind_a_signed_cookie(self):
+        response = self.send()
+        chat_session = ChatSession.objects.get()
+        self.assertEqual(response.json()['session_id'], str(chat_session.id))
+        self.assertIsNone(chat_session.user)
+
+        cookie = response.cookies[anonymous_sessions.COOKIE_NAME]
+        self.assertTrue(cookie['httponly'])
+        self.assertEqual(cookie['samesite'], 'Lax')
+        self.assertNotEqual(cookie.value, str(chat_session.id))
+
+    def test_later_messages_go_to_the_same_session(self):
+        session_id = self.send().json()['session_id']
+        response = self.send('Again', session_id)
+        self.assertEqual(response.json()['session_id'], session_id)
+        self.assertNotIn(anonymous_sessions.COOKIE_NAME, response.cookies)
+        self.assertEqual(ChatSession.objects.get().message_count, 4)
+
+    def test_visitors_only_reach_their_own_session(self):
+        session_id = self.send().json()['session_id']
+        self.assertEqual(self.get_messages(session_id).status_code, 200)
+
+        other = ChatSession.objects.create()
+        self.assertEqual(self.get_messages(other.id).status_code, 404)
+        self.assertEqual(self.send('Hi', str(other.id)).status_code, 404)
+        self.assertEqual(other.messages.count(), 0)
+
+    def test_other_visitors_cannot_reach_the_session(self):
+        session_id = self.send().json()['session_id']
+        self.client.cookies.clear()
+        self.assertEqual(self.get_messages(session_id).status_code, 404)
+
+    def test_tampered_cookie_is_ignored(self):
+        other = ChatSession.objects.create()
+        self.client.cookies[anonymous_sessions.COOKIE_NAME] = f'{other.id}:forged'
+        self.assertEqual(self.get_messages(other.id).status_code, 404)
+
+    def test_cookie_cannot_reach_a_users_session(self):
+        owned = ChatSession.objects.create(user=User.objects.create_user('alice'))
+        join_anonymous_chat(self.client, owned)
+        self.assertEqual(self.get_messages(owned.id).status_code, 404)
+
+    def test_new_chat_drops_the_cookie(self):
+        self.send()
+        response = self.client.post(reverse('new_chat'))
+        self.assertEqual(response.cookies[anonymous_sessions.COOKIE_NAME].value, '')
+        self.send('Hello again')
+        self.assertEqual(ChatSession.objects.count(), 2)
+
+    def test_users_only_reach_their_own_sessions(self):
+        alice = User.objects.create_user('alice')
+        bob_session = ChatSession.objects.create(user=User.objects.create_user('bob'))
+        self.client.force_login(alice)
+        self.assertEqual(self.get_messages(bob_session.id).status_code, 404)
+        self.assertEqual(self.send('Hi', str(bob_session.id)).status_code, 404)
@@ -0,0 +1,117 @@
+# chatbot/tests/test_chat_export.py
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from chatbotapp.chat_export import HistoryImporter, InvalidExport, export_chunks, export_lines
+from chatbotapp.models import ChatSession, Message
+
+
+class ChatHistoryImportTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.chat_session = ChatSession.objects.create(user=self.alice, session_name='Volcanoes')
+        started = timezone.now() - timedelta(hours=1)
+        self.messages = [
+            Message.objects.create(chat_session=self.chat_session, message_type=message_type, content=content,
+                                   timestamp=started + timedelta(minutes=number))
+            for number, (message_type, content) in enumerate([
+                ('user', 'What is a volcano?'),
+                ('bot', 'A **volcano** is a rupture in the crust.'),
+                ('user', 'Where are they?'),
+                ('bot', ''),
+            ])
+        ]
+        ChatSession.objects.filter(pk=self.chat_session.pk).update(
+            context_summary='Asked about volcanoes',
+            context_summary_until=self.messages[1].timestamp,
+            context_summary_last_id=self.messages[1].id,
+        )
+
+    def export(self, **kwargs):
+        return list(export_lines(ChatSession.objects.filter(pk=self.chat_session.pk), **kwargs))
+
+    def import_lines(self, lines, **kwargs):
+        return HistoryImporter(**kwargs).run(lines)
+
+    def imported(self):
+        return ChatSession.objects.exclude(pk=self.chat_session.pk).get()
+
+    def test_import_gives_new_ids(self):
+        stats = self.import_lines(self.export())
+        self.assertEqual((stats.sessions, stats.messages), (1, 4))
+
+        copy = self.imported()
+        copied = list(copy.messages.order_by('timestamp', 'id'))
+        self.assertEqual(copy.session_name, 'Volcanoes')
+        self.assertEqual(copy.user, self.alice)
+        self.assertEqual([m.content for m in copied], [m.content for m in self.messages])
+        self.assertEqual([m.timestamp for m in copied], [m.timestamp for m in self.messages])
+        self.assertFalse({m.id for m in copied} & {m.id for m in self.messages})
+        self.assertIn('<strong>volcano</strong>', copied[1].content_html)
+
+    def test_import_sets_the_counters(self):
+        self.import_lines(self.export())
+        copy = self.imported()
+        self.assertEqual((copy.message_count, copy.user_message_count, copy.bot_message_count), (4, 2, 2))
+        self.assertEqual(copy.last_message_preview, 'Where are they?')
+        self.assertEqual(copy.last_message_at, self.messages[-1].timestamp)
+
+    def test_context_summary_points_at_the_new_message(self):
+        # Batches of one, so the summarized message is inserted in an earlier batch than its session is finished in
+        self.import_lines(self.export(), batch_size=1)
+        copy = self.imported()
+        summarized = copy.messages.get(content=self.messages[1].content)
+        self.assertEqual(copy.context_summary, 'Asked about volcanoes')
+        self.assertEqual(copy.context_summary_last_id, summarized.id)
+
+    def test_context_summary_is_dropped_without_its_message(self):
+        lines = [line for line in self.export() if json.loads(line).get('id') != self.messages[1].id]
+        self.import_lines(lines)
+        copy = self.imported()
+        self.assertEqual((copy.context_summary, copy.context_summary_last_id), ('', 0))
+        self.assertIsNone(copy.context_summary_until)
+
+    def test_sessions_go_to_the_exported_user_or_the_given_one(self):
+        bob = User.objects.create_user('bob')
+        self.import_lines(self.export(), user=bob)
+        self.assertEqual(self.imported().user, bob)
+
+    def test_unknown_users_sessions_are_imported_without_one(self):
+        lines = [line.replace('"user": "alice"', '"user": "carol"') for line in self.export()]
+        stats = self.import_lines(lines)
+        self.assertIsNone(self.imported().user)
+        self.assertEqual(stats.unknown_users, {'carol'})
+
+    def test_invalid_lines_are_reported_with_their_number(self):
+        header, session, *messages = self.export()
+        cases = [
+            ([header, messages[0]], "Line 2: A message line does not follow its session's line"),
+            ([header.replace('"format": 1', '"format": 2')], "Line 1: Unsupported export format 2"),
+            ([header, '{"type": "other"}'], "Line 2: Unknown line type 'other'"),
+            ([header, session, '{not json'], "Line 3: "),
+        ]
+        for lines, error in cases:
+            with self.subTest(error=error), self.assertRaisesMessage(InvalidExport, error):
+                self.import_lines(lines)
+
+    def test_command_imports_gzipped_exports(self):
+        with tempfile.NamedTemporaryFile(suffix='.jsonl.gz', delete=False) as export_file:
+            for chunk in export_chunks(self.export(), compress=True):
+                export_file.write(chunk)
+        self.addCleanup(os.remove, export_file.name)
+
+        out = StringIO()
+        call_command('import_chat_history', export_file.name, '--user', 'alice', stdout=out)
+        self.assertIn('Imported 1 sessions and 4 messages', out.getvalue())
+        self.assertEqual(self.imported().messages.count(), 4)
+
+        with self.assertRaisesMessage(CommandError, 'No such user: nobody'):
+            call_command('import_chat_history', export_file.name, '--user', 'nobody', stdout=out)
@@ -0,0 +1,110 @@
+# chatbot/tests/test_context_window.py
+import time
+from datetime import timedelta
+
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from chatbotapp.context_window import SUMMARY_PREAMBLE, ContextWindow
+from chatbotapp.models import ChatSession, Message
+
+
+class ConversationMixin:
+    def conversation(self, turns):
+        chat_session = ChatSession.objects.create()
+        started = timezone.now() - timedelta(hours=1)
+        for turn in range(turns):
+            for offset, message_type in enumerate(('user', 'bot')):
+                Message.objects.create(
+                    chat_session=chat_session, message_type=message_type, content=f'{message_type} {turn}',
+                    timestamp=started + timedelta(seconds=turn * 2 + offset)
+                )
+        return chat_session
+
+    def window(self, **options):
+        self.summarized = []
+
+        def summarize(prompt):
+            self.summarized.append(prompt)
+            return f'Summary {len(self.summarized)}'
+
+        return ContextWindow(summarize=summarize, recent_turns=2, fold_batch_turns=2, **options)
+
+
+class ContextWindowTests(ConversationMixin, TestCase):
+    def test_build_never_summarizes(self):
+        chat_session = self.conversation(turns=8)
+        contents = self.window().build(chat_session, 'next question')
+        self.assertEqual(self.summarized, [])
+        self.assertEqual([turn['parts'][0] for turn in contents],
+                         [f'{role} {turn}' for turn in range(8) for role in ('user', 'bot')] + ['next question'])
+
+    def test_build_keeps_turns_past_the_window_until_they_are_folded(self):
+        chat_session = self.conversation(turns=4)
+        # recent_turns * 2 + 1 messages back
+        chat_session.messages.filter(content='bot 1').update(content='My name is Ada')
+        contents = self.window().build(chat_session, 'What is my name?')
+        self.assertEqual(self.summarized, [])
+        self.assertIn('My name is Ada', [part for turn in contents for part in turn['parts']])
+
+    def test_build_drops_the_oldest_turns_over_the_token_budget(self):
+        chat_session = self.conversation(turns=8)
+        # The prompt and two messages of two tokens each
+        contents = self.window(token_budget=7).build(chat_session, 'question')
+        self.assertEqual([turn['parts'][0] for turn in contents], ['user 7', 'bot 7', 'question'])
+
+    def test_fold_due_folds_the_turns_past_the_window(self):
+        chat_session = self.conversation(turns=5)
+        window = self.window()
+        window.fold_due(chat_session)
+
+        self.assertEqual(len(self.summarized), 1)
+        self.assertIn('User: user 0', self.summarized[0])
+        self.assertIn('Assistant: bot 2', self.summarized[0])
+        self.assertNotIn('user 3', self.summarized[0])
+        chat_session.refresh_from_db()
+        self.assertEqual(chat_session.context_summary, 'Summary 1')
+        self.assertEqual(chat_session.context_summary_last_id,
+                         chat_session.messages.get(content='bot 2').id)
+
+        contents = window.build(chat_session, 'next question')
+        self.assertEqual(contents[0]['parts'][0], f'{SUMMARY_PREAMBLE}\nSummary 1')
+        self.assertEqual([turn['parts'][0] for turn in contents[2:]],
+                         ['user 3', 'bot 3', 'user 4', 'bot 4', 'next question'])
+
+    def test_fold_due_folds_a_long_backlog_oldest_first_in_batches(self):
+        chat_session = self.conversation(turns=10)
+        self.window(fold_max_messages=6).fold_due(chat_session)
+
+        # 16 messages past the window: batches of 6, 6 and 4
+        self.assertEqual(len(self.summarized), 3)
+        self.assertIn('User: user 0', self.summarized[0])
+        self.assertNotIn('user 3', self.summarized[0])
+        self.assertIn('User: user 3', self.summarized[1])
+        self.assertIn('Assistant: bot 7', self.summarized[2])
+        self.assertIn('Summary 2', self.summarized[2])
+        chat_session.refresh_from_db()
+        self.assertEqual(chat_session.context_summary, 'Summary 3')
+        self.assertEqual(chat_session.context_summary_last_id,
+                         chat_session.messages.get(content='bot 7').id)
+
+    def test_fold_due_waits_for_a_whole_batch(self):
+        chat_session = self.conversation(turns=3)
+        self.window().fold_due(chat_session)
+        self.assertEqual(self.summarized, [])
+
+    def test_falls_back_to_an_extractive_summary(self):
+        chat_session = self.conversation(turns=4)
+        ContextWindow(summarize=lambda prompt: None, recent_turns=2, fold_batch_turns=2).fold_due(chat_session)
+        chat_session.refresh_from_db()
+        self.assertEqual(chat_session.context_summary, 'User: user 0\nAssistant: bot 0\nUser: user 1\nAssistant: bot 1')
+
+
+class FoldLaterTests(ConversationMixin, TransactionTestCase):
+    def test_folds_in_the_background(self):
+        chat_session = self.conversation(turns=5)
+        self.window().fold_later(chat_session.pk)
+        deadline = time.monotonic() + 5
+        while not ChatSession.objects.get(pk=chat_session.pk).context_summary and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(ChatSession.objects.get(pk=chat_session.pk).context_summary, 'Summary 1')
@@ -0,0 +1,107 @@
+# chatbot/tests/test_conversation_pool.py
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from chatbotapp.context_window import ContextWindow
+from chatbotapp.conversation_pool import ConversationPool
+from chatbotapp.models import ChatSession, Message
+
+
+class ConversationPoolTests(TestCase):
+    def setUp(self):
+        self.pool = ConversationPool(max_sessions=2, idle_seconds=60)
+        self.loads = mock.patch.object(self.pool, '_load', wraps=self.pool._load).start()
+        self.addCleanup(mock.patch.stopall)
+        self.chat_session = ChatSession.objects.create()
+        self.clock = timezone.now() - timedelta(hours=1)
+
+    def say(self, content, message_type='user', chat_session=None, **fields):
+        self.clock += timedelta(minutes=1)
+        return Message.objects.create(chat_session=chat_session or self.chat_session, message_type=message_type,
+                                      content=content, timestamp=fields.pop('timestamp', self.clock), **fields)
+
+    def contents(self, chat_session=None, limit=10):
+        return [row[2] for row in self.pool.recent_messages(chat_session or self.chat_session, limit)]
+
+    def test_hits_read_only_what_is_new(self):
+        self.say('hello')
+        self.say('hi', 'bot')
+        self.assertEqual(self.contents(), ['hi', 'hello'])
+        self.say('how are you?')
+        self.say('fine', 'bot')
+        self.assertEqual(self.contents(), ['fine', 'how are you?', 'hi', 'hello'])
+        self.assertEqual(self.loads.call_count, 1)
+
+    def test_keeps_the_newest_messages_up_to_the_limit(self):
+        for turn in range(4):
+            self.say(f'user {turn}')
+        self.assertEqual(self.contents(limit=3), ['user 3', 'user 2', 'user 1'])
+        self.say('user 4')
+        self.assertEqual(self.contents(limit=3), ['user 4', 'user 3', 'user 2'])
+
+    def test_pending_replies_are_read_again_once_filled_in(self):
+        self.say('question')
+        pending = self.say('', 'bot', metadata={'status': 'pending'})
+        self.assertEqual(self.contents(), ['question'])
+        pending.content = 'answer'
+        pending.save(update_fields=['content'])
+        self.say('next question')
+        self.assertEqual(self.contents(), ['next question', 'answer', 'question'])
+        self.assertEqual(self.loads.call_count, 1)
+
+    def test_messages_saved_late_with_an_earlier_timestamp_are_picked_up(self):
+        self.say('first')
+        self.assertEqual(self.contents(), ['first'])
+        # A reply of a slow request is saved after a message stamped later
+        self.say('second')
+        self.contents()
+        self.say('slow reply', 'bot', timestamp=self.clock - timedelta(seconds=5))
+        self.assertEqual(self.contents(), ['second', 'slow reply', 'first'])
+        self.assertEqual(self.loads.call_count, 1)
+
+    def test_cleared_chat_is_read_again(self):
+        self.say('secret')
+        self.assertEqual(self.contents(), ['secret'])
+        self.chat_session.messages.all().delete()
+        self.chat_session.reset_counters()
+        self.say('fresh start')
+        self.assertEqual(self.contents(), ['fresh start'])
+        self.assertEqual(self.loads.call_count, 2)
+
+    def test_folded_messages_are_dropped_without_reading_again(self):
+        messages = [self.say(f'message {i}', 'user' if i % 2 == 0 else 'bot') for i in range(4)]
+        self.contents()
+        self.chat_session.context_summary_until = messages[1].timestamp
+        self.chat_session.context_summary_last_id = messages[1].id
+        self.assertEqual(self.contents(), ['message 3', 'message 2'])
+        self.assertEqual(self.loads.call_count, 1)
+
+    def test_least_recently_used_sessions_are_evicted(self):
+        other, third = ChatSession.objects.create(), ChatSession.objects.create()
+        for chat_session in (self.chat_session, other, third):
+            self.say('hello', chat_session=chat_session)
+            self.contents(chat_session)
+        self.assertEqual(self.pool.stats()['size'], 2)
+        self.contents(self.chat_session)
+        self.assertEqual(self.loads.call_count, 4)
+
+    def test_idle_sessions_are_evicted(self):
+        self.say('hello')
+        self.contents()
+        with mock.patch('chatbotapp.conversation_pool.time.monotonic', return_value=10 ** 9):
+            self.contents()
+        self.assertEqual(self.loads.call_count, 2)
+
+    def test_context_window_builds_from_the_pool(self):
+        window = ContextWindow(recent_turns=2, pool=self.pool)
+        self.say('hello')
+        self.say('hi', 'bot')
+        window.build(self.chat_session, 'next')
+        self.say('next')
+        self.say('reply', 'bot')
+        contents = window.build(self.chat_session, 'again')
+        self.assertEqual([turn['parts'][0] for turn in contents], ['hello', 'hi', 'next', 'reply', 'again'])
+        self.assertEqual(self.loads.call_count, 1)
@@ -0,0 +1,102 @@
+# chatbot/tests/test_message_rendering.py
+import random
+from html.parser import HTMLParser
+
+from django.test import SimpleTestCase
+
+from chatbotapp.message_rendering import render_message
+
+ALLOWED_TAGS = {'p', 'br', 'ul', 'ol', 'li', 'h4', 'pre', 'code', 'strong', 'em', 'a'}
+LINK_ATTRIBUTES = {'href', 'target', 'rel'}
+
+
+class _TagCollector(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tags = []
+
+    def handle_starttag(self, tag, attrs):
+        self.tags.append((tag, dict(attrs)))
+
+    handle_startendtag = handle_starttag
+
+
+def tags(html):
+    collector = _TagCollector()
+    collector.feed(html)
+    collector.close()
+    return collector.tags
+
+
+class RenderMessageTests(SimpleTestCase):
+    def assertSafe(self, html):
+        for tag, attrs in tags(html):
+            self.assertIn(tag, ALLOWED_TAGS, html)
+            if tag == 'a':
+                self.assertLessEqual(set(attrs), LINK_ATTRIBUTES, html)
+                self.assertRegex(attrs['href'], r'^https?://', html)
+                self.assertEqual(attrs['rel'], 'nofollow noopener noreferrer')
+            else:
+                self.assertEqual(attrs, {}, html)
+
+    def test_user_messages_are_shown_as_typed(self):
+        html = render_message('**not bold** <b>not a tag</b>', 'user')
+        self.assertEqual(html, '**not bold** &lt;b&gt;not a tag&lt;/b&gt;')
+
+    def test_bot_html_is_escaped(self):
+        html = render_message('<script>alert(1)</script> <img src=x onerror=alert(1)>', 'bot')
+        self.assertEqual(tags(html), [('p', {})])
+        self.assertIn('&lt;script&gt;', html)
+
+    def test_markdown(self):
+        html = render_message(
+            '## Python\n\nA **high-level** language, *dynamically* typed; use `print()`.\n\n'
+            '- readable\n- popular\n\n1. first\n2. second\n\n```python\nif a < b:\n    pass\n```',
+            'bot'
+        )
+        self.assertEqual(html, (
+            '<h4>Python</h4>'
+            '<p>A <strong>high-level</strong> language, <em>dynamically</em> typed; use <code>print()</code>.</p>'
+            '<ul><li>readable</li><li>popular</li></ul>'
+            '<ol><li>first</li><li>second</li></ol>'
+            '<pre><code>if a &lt; b:\n    pass</code></pre>'
+        ))
+
+    def test_links(self):
+        html = render_message(
+            'See https://en.wikipedia.org/wiki/Python_(programming_language). Or [the docs](https://docs.python.org/3/)',
+            'bot'
+        )
+        self.assertEqual([attrs['href'] for tag, attrs in tags(html) if tag == 'a'], [
+            'https://en.wikipedia.org/wiki/Python_(programming_language)',
+            'https://docs.python.org/3/',
+        ])
+        self.assertSafe(html)
+
+    def test_only_http_links(self):
+        html = render_message('[click](javascript:alert(1)) [data](data:text/html,<script>x</script>)', 'bot')
+        self.assertEqual(tags(html), [('p', {})])
+
+    def test_link_attributes_cannot_be_broken_out_of(self):
+        html = render_message('[click](https://example.com/"onmouseover="alert(1)) https://example.com/\'x=\'', 'bot')
+        self.assertSafe(html)
+        hrefs = [attrs['href'] for tag, attrs in tags(html) if tag == 'a']
+        self.assertEqual(hrefs[0], 'https://example.com/"onmouseover="alert(1)')
+
+    def test_formatting_inside_links_and_emphasis_is_escaped(self):
+        html = render_message('**<i>bold</i>** [*<b>label</b>*](https://example.com)', 'bot')
+        self.assertSafe(html)
+        self.assertIn('&lt;i&gt;bold&lt;/i&gt;', html)
+        self.assertIn('&lt;b&gt;label&lt;/b&gt;', html)
+
+    def test_unclosed_code_fence_is_escaped(self):
+        html = render_message('```\n</code></pre><script>alert(1)</script>', 'bot')
+        self.assertEqual(tags(html), [('pre', {}), ('code', {})])
+
+    def test_random_markup_stays_safe(self):
+        pieces = ['<', '>', '"', "'", '&', '*', '**', '`', '```', '\n', '\n\n', '- ', '1. ', '# ', '[', ']',
+                  '(', ')', 'https://example.com/', 'javascript:', '<script>', 'onerror=', 'text', ' ']
+        generator = random.Random(20)
+        for _ in range(500):
+            content = ''.join(generator.choice(pieces) for _ in range(generator.randint(1, 30)))
+            self.assertSafe(render_message(content, 'bot'))
@@ -0,0 +1,111 @@
+# chatbot/tests/test_message_search.py
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from chatbotapp.message_search import SQLiteSearchBackend, search_messages
+from chatbotapp.models import ChatSession, Message
+
+from .utils import LOCAL_CACHES, chatbot_settings, join_anonymous_chat
+
+
+class SearchMessagesTests(TestCase):
+    def setUp(self):
+        self.chat_session = ChatSession.objects.create()
+        self.python = self.add('Python is a programming language that emphasizes readability')
+        self.snakes = self.add('A python is a large snake; pythons live in Africa and Asia')
+        self.other = self.add('Paris is the capital of France')
+        self.elsewhere = ChatSession.objects.create()
+        Message.objects.create(chat_session=self.elsewhere, message_type='user', content='Python elsewhere')
+
+    def add(self, content, chat_session=None):
+        return Message.objects.create(chat_session=chat_session or self.chat_session,
+                                      message_type='bot', content=content)
+
+    def search(self, query, **kwargs):
+        results, _ = search_messages(query, ChatSession.objects.filter(pk=self.chat_session.pk), **kwargs)
+        return results
+
+    def test_finds_matches_within_the_sessions_only(self):
+        self.assertCountEqual(self.search('python'), [self.python, self.snakes])
+
+    def test_every_word_has_to_match(self):
+        self.assertEqual(self.search('python language'), [self.python])
+
+    def test_last_word_matches_as_a_prefix(self):
+        self.assertCountEqual(self.search('pyth'), [self.python, self.snakes])
+
+    def test_best_match_first(self):
+        results = self.search('python')
+        self.assertEqual(results[0], self.snakes)
+        self.assertGreater(results[0].rank, results[1].rank)
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(SQLiteSearchBackend.fts_query('python OR "france" NEAR(*'), '"python" "OR" "france" "NEAR"*')
+        self.assertEqual(self.search('python OR paris'), [])
+        self.assertEqual(self.search('"*()'), [])
+
+    def test_snippets_mark_the_match_and_escape_the_message(self):
+        message = self.add('<script>alert(1)</script> python')
+        results = self.search('alert')
+        self.assertEqual(results, [message])
+        self.assertIn('<mark>alert</mark>', results[0].snippet)
+        self.assertNotIn('<script>', results[0].snippet)
+        self.assertIn('&lt;script&gt;', results[0].snippet)
+
+    def test_index_follows_edits_and_deletes(self):
+        self.other.content = 'Berlin is the capital of Germany'
+        self.other.save(update_fields=['content'])
+        self.assertEqual(self.search('paris'), [])
+        self.assertEqual(self.search('berlin'), [self.other])
+        self.other.delete()
+        self.assertEqual(self.search('berlin'), [])
+
+    def test_pages(self):
+        for number in range(5):
+            self.add(f'Note {number} about gardening')
+        first, has_more = search_messages('gardening', ChatSession.objects.all(), page_size=3)
+        second, has_more_after = search_messages('gardening', ChatSession.objects.all(), page=2, page_size=3)
+        self.assertTrue(has_more)
+        self.assertFalse(has_more_after)
+        self.assertEqual(len(first) + len(second), 5)
+        self.assertFalse({m.id for m in first} & {m.id for m in second})
+
+    def test_like_backend_finds_the_same_messages(self):
+        self.assertCountEqual(self.search('python', like=True), self.search('python'))
+        self.assertIn('<mark>', self.search('python', like=True)[0].snippet)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+@chatbot_settings(METRICS_DIR=None, RATE_LIMITS={})
+class SearchViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret')
+        own = ChatSession.objects.create(user=self.user)
+        Message.objects.create(chat_session=own, message_type='user', content='Tell me about volcanoes')
+        someone_else = ChatSession.objects.create(user=User.objects.create_user('bob'))
+        Message.objects.create(chat_session=someone_else, message_type='user', content='Volcanoes in Iceland')
+        self.anonymous = ChatSession.objects.create()
+        Message.objects.create(chat_session=self.anonymous, message_type='user', content='Volcanoes of Japan')
+
+    def get(self, **params):
+        return self.client.get(reverse('search'), params)
+
+    def test_searches_the_users_own_sessions(self):
+        self.client.force_login(self.user)
+        data = self.get(q='volcano').json()
+        self.assertEqual([r['content'] for r in data['results']], ['Tell me about volcanoes'])
+        self.assertFalse(data['has_more'])
+
+    def test_anonymous_visitors_search_their_cookie_session(self):
+        join_anonymous_chat(self.client, self.anonymous)
+        data = self.get(q='volcano').json()
+        self.assertEqual([r['content'] for r in data['results']], ['Volcanoes of Japan'])
+
+    def test_anonymous_visitors_without_a_session_find_nothing(self):
+        self.assertEqual(self.get(q='volcano').json()['results'], [])
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.get().status_code, 400)
+        self.assertEqual(self.get(q='volcano', page='two').status_code, 400)
+        self.assertEqual(self.client.post(reverse('search'), {'q': 'volcano'}).status_code, 405)
@@ -0,0 +1,88 @@
+# chatbot/tests/test_models.py
+import threading
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from chatbotapp.models import ChatSession, Message
+
+
+class SaveMessagesTests(TestCase):
+    def setUp(self):
+        self.chat_session = ChatSession.objects.create()
+
+    def test_saves_messages_and_bumps_counters(self):
+        self.chat_session.save_messages(
+            Message(chat_session=self.chat_session, message_type='user', content='Hello'),
+            Message(chat_session=self.chat_session, message_type='bot', content='Hi, how can I help?'),
+        )
+        self.chat_session.refresh_from_db()
+        self.assertEqual(self.chat_session.messages.count(), 2)
+        self.assertEqual(self.chat_session.message_count, 2)
+        self.assertEqual(self.chat_session.user_message_count, 1)
+        self.assertEqual(self.chat_session.bot_message_count, 1)
+        self.assertEqual(self.chat_session.last_message_preview, 'Hi, how can I help?')
+        self.assertIsNotNone(self.chat_session.last_message_at)
+
+    def test_renders_message_html(self):
+        self.chat_session.save_messages(
+            Message(chat_session=self.chat_session, message_type='user', content='<b>bold</b>'),
+        )
+        message = self.chat_session.messages.get()
+        self.assertNotIn('<b>', message.content_html)
+
+    def test_pending_bot_message_keeps_the_previous_preview(self):
+        self.chat_session.save_messages(
+            Message(chat_session=self.chat_session, message_type='user', content='Hello'),
+            Message(chat_session=self.chat_session, message_type='bot', content='', metadata={'status': 'pending'}),
+        )
+        self.chat_session.refresh_from_db()
+        self.assertEqual(self.chat_session.last_message_preview, 'Hello')
+        self.assertEqual(self.chat_session.bot_message_count, 1)
+
+    def test_messages_are_not_saved_when_the_counters_are_not(self):
+        with mock.patch.object(ChatSession, 'record_messages', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.chat_session.save_messages(
+                    Message(chat_session=self.chat_session, message_type='user', content='Hello'),
+                )
+        self.assertFalse(self.chat_session.messages.exists())
+
+
+class ConcurrentSaveMessagesTests(TransactionTestCase):
+    writers = 8
+    turns = 10
+
+    def test_counters_match_messages_under_concurrent_writers(self):
+        chat_session = ChatSession.objects.create()
+        start = threading.Barrier(self.writers)
+        errors = []
+
+        def write(writer):
+            try:
+                start.wait()
+                for turn in range(self.turns):
+                    # A stale copy, like the one each request works on
+                    ChatSession.objects.get(pk=chat_session.pk).save_messages(
+                        Message(chat_session=chat_session, message_type='user', content=f'{writer}: question {turn}'),
+                        Message(chat_session=chat_session, message_type='bot', content=f'{writer}: answer {turn}'),
+                    )
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write, args=(writer,)) for writer in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        chat_session.refresh_from_db()
+        expected = self.writers * self.turns
+        self.assertEqual(chat_session.messages.count(), 2 * expected)
+        self.assertEqual(chat_session.message_count, 2 * expected)
+        self.assertEqual(chat_session.user_message_count, expected)
+        self.assertEqual(chat_session.bot_message_count, expected)
@@ -0,0 +1,171 @@
+# chatbot/tests/test_rate_limits.py
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from chatbotapp.models import ChatSession
+from chatbotapp.rate_limits import RateLimits, SlidingWindowLimiter, client_ip, request_identities
+
+from .utils import LOCAL_CACHES, chatbot_settings, join_anonymous_chat
+
+# The start of a 60 second window
+WINDOW_START = 1_000_020.0
+
+
+class FakeClock:
+    def __init__(self, now=WINDOW_START):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class SlidingWindowLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('chatbotapp.rate_limits.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = SlidingWindowLimiter()
+        self.limiter.cache.clear()
+
+    def hits(self, count, key='key', limit=3, window=60):
+        return [self.limiter.hit(key, limit, window) for _ in range(count)]
+
+    def test_allows_the_limit_then_refuses(self):
+        self.assertEqual(self.hits(3), [0, 0, 0])
+        self.assertGreater(self.limiter.hit('key', 3, 60), 0)
+        self.assertEqual(self.hits(1, key='other'), [0])
+
+    def test_retry_after_is_when_the_request_would_be_allowed(self):
+        self.hits(3)
+        wait = self.limiter.hit('key', 3, 60)
+        # The next window weighs this one's 3 requests by what still overlaps: 3 * 2/3 + 1 <= 3
+        self.assertAlmostEqual(wait, 80)
+        self.clock.now += wait - 0.5
+        self.assertGreater(self.limiter.hit('key', 3, 60), 0)
+        self.clock.now += 0.5
+        self.assertEqual(self.limiter.hit('key', 3, 60), 0)
+
+    def test_retry_after_within_the_window(self):
+        self.hits(3)
+        self.clock.now += 60 + 15
+        # 3 * 3/4 + 1 > 3 until a third of the previous window has slid out
+        wait = self.limiter.hit('key', 3, 60)
+        self.assertAlmostEqual(wait, 5)
+        self.clock.now += wait
+        self.assertEqual(self.limiter.hit('key', 3, 60), 0)
+
+    def test_refused_requests_are_not_counted(self):
+        self.hits(3)
+        self.hits(10)
+        self.clock.now += 80
+        self.assertEqual(self.hits(1), [0])
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class RateLimitsTests(SimpleTestCase):
+    def setUp(self):
+        self.rate_limits = RateLimits({'view': {'user': (2, 60), 'ip': (3, 60)}})
+        self.rate_limits.limiter.cache.clear()
+
+    def test_each_scope_counts_for_its_own_identity(self):
+        alice = {'user': '1', 'ip': '10.0.0.1'}
+        bob = {'user': '2', 'ip': '10.0.0.1'}
+        self.assertIsNone(self.rate_limits.check('view', alice))
+        self.assertIsNone(self.rate_limits.check('view', alice))
+        self.assertEqual(self.rate_limits.check('view', alice)[0], 'user')
+        # Alice's refused request did not use up the IP's limit
+        self.assertIsNone(self.rate_limits.check('view', bob))
+        self.assertEqual(self.rate_limits.check('view', bob)[0], 'ip')
+        self.assertIsNone(self.rate_limits.check('view', {'user': '2', 'ip': '10.0.0.2'}))
+
+    def test_scopes_without_an_identity_are_skipped(self):
+        for _ in range(3):
+            self.assertIsNone(self.rate_limits.check('view', {'ip': '10.0.0.1'}))
+        self.assertEqual(self.rate_limits.check('view', {'ip': '10.0.0.1'})[0], 'ip')
+
+    def test_views_without_limits_are_not_counted(self):
+        for _ in range(10):
+            self.assertIsNone(self.rate_limits.check('other', {'ip': '10.0.0.1'}))
+
+
+class ClientIpTests(SimpleTestCase):
+    def request(self, forwarded=None):
+        extra = {'HTTP_X_FORWARDED_FOR': forwarded} if forwarded is not None else {}
+        return RequestFactory().get('/', REMOTE_ADDR='10.0.0.9', **extra)
+
+    def test_forwarded_for_is_ignored_without_proxies(self):
+        with chatbot_settings(RATE_LIMIT_PROXY_COUNT=0):
+            self.assertEqual(client_ip(self.request('1.2.3.4')), '10.0.0.9')
+
+    def test_address_added_by_the_proxies(self):
+        request = self.request('6.6.6.6, 1.2.3.4, 172.16.0.1')
+        with chatbot_settings(RATE_LIMIT_PROXY_COUNT=1):
+            self.assertEqual(client_ip(request), '172.16.0.1')
+        with chatbot_settings(RATE_LIMIT_PROXY_COUNT=2):
+            self.assertEqual(client_ip(request), '1.2.3.4')
+
+    def test_missing_forwarded_for_falls_back_to_the_peer(self):
+        with chatbot_settings(RATE_LIMIT_PROXY_COUNT=2):
+            self.assertEqual(client_ip(self.request('1.2.3.4')), '10.0.0.9')
+            self.assertEqual(client_ip(self.request()), '10.0.0.9')
+
+
+LIMITS = {'new_chat': {'user': (2, 60), 'session': (2, 60), 'ip': (3, 60)}}
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+@chatbot_settings(METRICS_DIR=None, RATE_LIMITS=LIMITS, RATE_LIMIT_PROXY_COUNT=1)
+class RateLimitMiddlewareTests(TestCase):
+    def setUp(self):
+        RateLimits().limiter.cache.clear()
+
+    def new_chat(self, ip='1.2.3.4', client=None):
+        return (client or self.client).post(reverse('new_chat'), HTTP_X_FORWARDED_FOR=ip)
+
+    def test_over_the_limit_gets_429_with_retry_after(self):
+        for _ in range(3):
+            self.assertEqual(self.new_chat().status_code, 200)
+        response = self.new_chat()
+        self.assertEqual(response.status_code, 429)
+        retry_after = int(response['Retry-After'])
+        self.assertGreaterEqual(retry_after, 1)
+        self.assertLessEqual(retry_after, 120)
+        self.assertEqual(response.json()['retry_after'], retry_after)
+        self.assertFalse(response.json()['success'])
+
+    def test_reads_are_not_limited(self):
+        for _ in range(5):
+            self.assertEqual(self.client.get(reverse('home'), HTTP_X_FORWARDED_FOR='1.2.3.4').status_code, 200)
+
+    def test_clients_behind_the_proxy_are_counted_apart(self):
+        for _ in range(3):
+            self.new_chat('1.2.3.4')
+        self.assertEqual(self.new_chat('1.2.3.4').status_code, 429)
+        self.assertEqual(self.new_chat('5.6.7.8').status_code, 200)
+        # Addresses the client put in front of the proxy's are not trusted
+        self.assertEqual(self.new_chat('5.6.7.8, 1.2.3.4').status_code, 429)
+
+    def test_users_are_counted_per_user(self):
+        self.client.force_login(User.objects.create_user('alice'))
+        for _ in range(2):
+            self.assertEqual(self.new_chat().status_code, 200)
+        self.assertEqual(self.new_chat().status_code, 429)
+
+    def test_anonymous_chat_sessions_are_counted_per_session(self):
+        join_anonymous_chat(self.client, ChatSession.objects.create())
+        for ip in ('10.0.0.1', '10.0.0.2'):
+            self.assertEqual(self.new_chat(ip).status_code, 200)
+            # new_chat drops the cookie; put it back for the next request
+            self.client.cookies.clear()
+            join_anonymous_chat(self.client, ChatSession.objects.get())
+        self.assertEqual(self.new_chat('10.0.0.3').status_code, 429)
+
+    def test_identities(self):
+        request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.9', HTTP_X_FORWARDED_FOR='1.2.3.4')
+        request.user = User.objects.create_user('bob')
+        self.assertEqual(request_identities(request), {'ip': '1.2.3.4', 'user': str(request.user.pk)})
@@ -0,0 +1,121 @@
+# chatbot/tests/test_resilience.py
+import asyncio
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from chatbotapp.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, ahedged, hedged
+
+
+class Upstream:
+    """Answers each call with the next of `outcomes`: a value, an exception, or a (delay, value) pair"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+            self.calls += 1
+        if isinstance(outcome, tuple):
+            delay, outcome = outcome
+            time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class HedgedTests(SimpleTestCase):
+    def test_without_a_delay_calls_once(self):
+        upstream = Upstream(ConnectionError('down'), 'answer')
+        with self.assertRaises(ConnectionError):
+            hedged(upstream, None)
+        self.assertEqual(upstream.calls, 1)
+
+    def test_failed_attempt_is_retried(self):
+        upstream = Upstream(ConnectionError('down'), 'answer')
+        self.assertEqual(hedged(upstream, 5, attempts=2), 'answer')
+        self.assertEqual(upstream.calls, 2)
+
+    def test_slow_attempt_is_hedged(self):
+        upstream = Upstream((1, 'slow'), 'fast')
+        self.assertEqual(hedged(upstream, 0.05, attempts=2), 'fast')
+        self.assertEqual(upstream.calls, 2)
+
+    def test_every_attempt_failing_raises_the_last_error(self):
+        upstream = Upstream(ConnectionError('first'), TimeoutError('second'))
+        with self.assertRaises(TimeoutError):
+            hedged(upstream, 5, attempts=2)
+
+    def test_open_circuit_is_not_retried(self):
+        upstream = Upstream(CircuitOpenError('open'), 'answer')
+        with self.assertRaises(CircuitOpenError):
+            hedged(upstream, 5, attempts=3)
+        self.assertEqual(upstream.calls, 1)
+
+    def test_exceeded_deadline_is_not_retried(self):
+        upstream = Upstream(DeadlineExceeded('late'), 'answer')
+        with self.assertRaises(DeadlineExceeded):
+            hedged(upstream, 5, attempts=3)
+        self.assertEqual(upstream.calls, 1)
+
+    def test_attempt_in_flight_can_still_answer_after_the_circuit_opens(self):
+        upstream = Upstream((0.2, 'slow'), CircuitOpenError('open'))
+        self.assertEqual(hedged(upstream, 0.05, attempts=3), 'slow')
+        self.assertEqual(upstream.calls, 2)
+
+
+class AsyncUpstream(Upstream):
+    """Upstream for ahedged, sleeping on the event loop; remembers attempts that were cancelled"""
+
+    def __init__(self, *outcomes):
+        super().__init__(*outcomes)
+        self.cancelled = 0
+
+    async def __call__(self):
+        outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+        self.calls += 1
+        if isinstance(outcome, tuple):
+            delay, outcome = outcome
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class AsyncHedgedTests(SimpleTestCase):
+    async def test_failed_attempt_is_retried(self):
+        upstream = AsyncUpstream(ConnectionError('down'), 'answer')
+        self.assertEqual(await ahedged(upstream, 5, attempts=2), 'answer')
+        self.assertEqual(upstream.calls, 2)
+
+    async def test_slow_attempt_is_hedged_and_cancelled(self):
+        upstream = AsyncUpstream((1, 'slow'), 'fast')
+        self.assertEqual(await ahedged(upstream, 0.05, attempts=2), 'fast')
+        await asyncio.sleep(0)
+        self.assertEqual(upstream.calls, 2)
+        self.assertEqual(upstream.cancelled, 1)
+
+    async def test_open_circuit_is_not_retried(self):
+        upstream = AsyncUpstream(CircuitOpenError('open'), 'answer')
+        with self.assertRaises(CircuitOpenError):
+            await ahedged(upstream, 5, attempts=3)
+        self.assertEqual(upstream.calls, 1)
+
+    async def test_cancelled_trial_call_lets_the_next_one_through(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, recovery_seconds=0)
+        breaker.record_failure()
+        trial = asyncio.ensure_future(breaker.acall(lambda: asyncio.sleep(1)))
+        await asyncio.sleep(0)
+        trial.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await trial
+        self.assertEqual(await breaker.acall(AsyncUpstream('answer')), 'answer')
+        self.assertEqual(breaker.state, 'closed')
@@ -0,0 +1,32 @@
+# chatbot/tests/test_response_cache.py
+from django.test import SimpleTestCase
+
+from chatbotapp.response_cache import ResponseCache
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = ResponseCache()
+
+    def test_serves_exact_matches_after_normalization(self):
+        self.cache.set("What's the capital of France?", "Paris")
+        self.assertEqual(self.cache.get("what is the capital of france")['match'], 'exact')
+
+    def test_serves_near_duplicates_differing_in_filler_words(self):
+        self.cache.set("How do I reset my password on the website?", "Use the reset link")
+        hit = self.cache.get("How do I reset my password on this website?")
+        self.assertEqual((hit['response'], hit['match']), ("Use the reset link", 'near'))
+
+    def test_near_duplicates_asking_something_else_miss(self):
+        self.cache.set("What is the capital city of France?", "Paris")
+        self.assertIsNone(self.cache.get("What is the capital city of Francia?"))
+        self.assertIsNone(self.cache.get("Who wrote the capital city of France?"))
+
+    def test_answers_are_kept_apart_per_personality(self):
+        self.cache.set("How do I reset my password on the website?", "Use the reset link", scope=1)
+        self.assertIsNone(self.cache.get("How do I reset my password on this website?", scope=2))
+
+    def test_near_duplicates_can_be_turned_off(self):
+        cache = ResponseCache(near_duplicates=False)
+        cache.set("How do I reset my password on the website?", "Use the reset link")
+        self.assertIsNone(cache.get("How do I reset my password on this website?"))
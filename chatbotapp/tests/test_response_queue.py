@@ -0,0 +1,113 @@
+# chatbot/tests/test_response_queue.py
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, skipIfDBFeature
+from django.utils import timezone
+
+from chatbotapp.intent_router import Intent
+from chatbotapp.models import ChatSession, ResponseJob
+from chatbotapp.response_queue import ERROR_RESPONSE, claim_job, enqueue_response, process_job, requeue_stale_jobs
+
+from .utils import chatbot_settings
+
+
+class EchoBot:
+    """Just enough of EnhancedChatBot for process_job"""
+
+    def route(self, message):
+        return Intent('chat', None, None, message, {})
+
+    def get_response(self, message, chat_session, intent=None):
+        return f"You said: {message}"
+
+    def fold_context(self, chat_session, background=True):
+        pass
+
+
+@chatbot_settings(RESPONSE_TIMEOUT_MINUTES=30, BACKGROUND_MAX_ATTEMPTS=2)
+class ResponseQueueTests(TestCase):
+    def setUp(self):
+        self.chat_session = ChatSession.objects.create()
+
+    def enqueue(self, content='Hello'):
+        _, bot_message = enqueue_response(self.chat_session, content)
+        return bot_message
+
+    def go_stale(self, job):
+        ResponseJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(minutes=31))
+
+    def test_claims_the_oldest_pending_job(self):
+        first, second = self.enqueue('first'), self.enqueue('second')
+        job = claim_job('worker-a')
+        self.assertEqual(job.bot_message_id, first.id)
+        self.assertEqual((job.status, job.worker, job.attempts), ('running', 'worker-a', 1))
+        self.assertEqual(claim_job('worker-b').bot_message_id, second.id)
+        self.assertIsNone(claim_job('worker-c'))
+
+    # With row locks the claimers are kept apart by the database itself
+    @skipIfDBFeature('has_select_for_update_skip_locked')
+    def test_two_claimers_never_get_the_same_job(self):
+        self.enqueue()
+        now = timezone.now
+        racing = []
+
+        # worker-b claims the job after worker-a has picked it but before worker-a marks it running
+        def claim_in_between():
+            if not racing:
+                racing.append(None)
+                racing[0] = claim_job('worker-b')
+            return now()
+
+        with mock.patch('chatbotapp.response_queue.timezone') as patched:
+            patched.now.side_effect = claim_in_between
+            job = claim_job('worker-a')
+
+        self.assertEqual(racing[0].worker, 'worker-b')
+        self.assertIsNone(job)
+        self.assertEqual(ResponseJob.objects.get().attempts, 1)
+
+    def test_finishing_fills_in_the_pending_message(self):
+        bot_message = self.enqueue()
+        self.assertEqual(process_job(claim_job('worker-a'), EchoBot()).content, "You said: Hello")
+        bot_message.refresh_from_db()
+        self.assertEqual(bot_message.content, "You said: Hello")
+        self.assertEqual(bot_message.metadata['status'], 'done')
+        self.assertEqual(ResponseJob.objects.get().status, 'done')
+
+    def test_stale_jobs_are_requeued(self):
+        self.enqueue()
+        job = claim_job('worker-a')
+        self.assertEqual(requeue_stale_jobs(), 0)
+        self.go_stale(job)
+        self.assertEqual(requeue_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.started_at), ('pending', '', None))
+
+    def test_requeued_job_finished_by_its_stale_worker_is_rejected(self):
+        bot_message = self.enqueue()
+        stale = claim_job('worker-a')
+        self.go_stale(stale)
+        requeue_stale_jobs()
+        fresh = claim_job('worker-b')
+
+        self.assertIsNone(process_job(stale, EchoBot()))
+        bot_message.refresh_from_db()
+        self.assertEqual(bot_message.content, '')
+        self.assertEqual(ResponseJob.objects.get().status, 'running')
+
+        self.assertIsNotNone(process_job(fresh, EchoBot()))
+        bot_message.refresh_from_db()
+        self.assertEqual(bot_message.metadata['worker'], 'worker-b')
+
+    def test_fails_jobs_out_of_attempts(self):
+        bot_message = self.enqueue()
+        for worker in ('worker-a', 'worker-b'):
+            self.go_stale(claim_job(worker))
+            requeue_stale_jobs()
+
+        self.assertEqual(ResponseJob.objects.get().status, 'failed')
+        bot_message.refresh_from_db()
+        self.assertEqual(bot_message.content, ERROR_RESPONSE)
+        self.assertEqual(bot_message.metadata['status'], 'failed')
+        self.assertIsNone(claim_job('worker-c'))
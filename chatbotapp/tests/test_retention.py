@@ -0,0 +1,127 @@
+# chatbot/tests/test_retention.py
+import gzip
+import json
+import shutil
+import tempfile
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from chatbotapp.models import ChatSession, Message, ResponseJob, RollupWatermark
+from chatbotapp.retention import ANALYTICS_WATERMARK, Retention
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.user = User.objects.create_user('alice')
+
+    def session(self, days_ago, user=None, messages=2):
+        chat_session = ChatSession.objects.create(user=user)
+        for number in range(messages):
+            Message.objects.create(chat_session=chat_session, message_type='user', content=f'Message {number}')
+        ChatSession.objects.filter(pk=chat_session.pk).update(updated_at=timezone.now() - timedelta(days=days_ago))
+        return chat_session
+
+    def retention(self, **kwargs):
+        return Retention(max_age_days=30, max_sessions_per_user=2, directory=self.directory, **kwargs)
+
+    def archived(self):
+        records = []
+        for path in sorted(self.directory.glob('sessions-*.jsonl.gz')):
+            with gzip.open(path, 'rt', encoding='utf-8') as archive:
+                records += [json.loads(line) for line in archive]
+        return records
+
+    def remaining(self):
+        return set(ChatSession.objects.values_list('pk', flat=True))
+
+    def test_archives_and_deletes_sessions_past_their_age(self):
+        old = self.session(days_ago=40)
+        recent = self.session(days_ago=5)
+        ResponseJob.objects.create(user_message=old.messages.first(), bot_message=old.messages.last())
+
+        stats = self.retention().run()
+
+        self.assertEqual(self.remaining(), {recent.pk})
+        self.assertEqual((stats.sessions, stats.messages), (1, 2))
+        self.assertFalse(Message.objects.filter(chat_session_id=old.pk).exists())
+        self.assertFalse(ResponseJob.objects.exists())
+        [record] = self.archived()
+        self.assertEqual(record['session']['id'], str(old.pk))
+        self.assertEqual([m['content'] for m in record['messages']], ['Message 0', 'Message 1'])
+
+    def test_keeps_each_users_most_recent_sessions(self):
+        sessions = [self.session(days_ago=days, user=self.user) for days in (1, 2, 3, 4)]
+        anonymous = self.session(days_ago=6)
+
+        self.retention().run()
+
+        self.assertEqual(self.remaining(), {sessions[0].pk, sessions[1].pk, anonymous.pk})
+
+    def test_waits_for_the_analytics_rollup(self):
+        counted = self.session(days_ago=40)
+        uncounted = self.session(days_ago=40)
+        RollupWatermark.objects.create(name=ANALYTICS_WATERMARK, last_message_id=counted.messages.last().id)
+
+        self.retention().run()
+
+        self.assertEqual(self.remaining(), {uncounted.pk})
+
+    def test_dry_run_counts(self):
+        self.session(days_ago=40)
+        for days in (1, 2, 3):
+            self.session(days_ago=days, user=self.user, messages=1)
+        counts = self.retention().count(timezone.now() - timedelta(days=30))
+        self.assertEqual(counts, {'age': {'sessions': 1, 'messages': 2}, 'limit': {'sessions': 1, 'messages': 1}})
+
+    def test_stopped_run_is_resumed(self):
+        for days in (40, 41, 42):
+            self.session(days_ago=days)
+
+        self.retention(batch_size=1).run(max_batches=2)
+        self.assertEqual(len(self.remaining()), 1)
+        state = json.loads((self.directory / 'retention-state.json').read_text())
+        self.assertFalse(state['finished'])
+        self.assertEqual(state['sequence'], 2)
+
+        self.retention(batch_size=1).run()
+
+        self.assertEqual(self.remaining(), set())
+        files = sorted(path.name for path in self.directory.glob('sessions-*.jsonl.gz'))
+        self.assertEqual([name.split('-')[-1] for name in files], ['00000.jsonl.gz', '00001.jsonl.gz', '00002.jsonl.gz'])
+        self.assertEqual(len({name.split('-')[1] for name in files}), 1)
+        self.assertEqual(len(self.archived()), 3)
+
+    def test_interrupted_batch_that_was_not_deleted_is_redone(self):
+        old = self.session(days_ago=40)
+        retention = self.retention()
+        state = retention.new_state()
+        retention.directory.mkdir(exist_ok=True)
+        state['pending'] = {'file': retention._archive_path(state).name, 'sessions': [str(old.pk)]}
+        retention.save_state(state)
+
+        retention.run()
+
+        self.assertEqual(self.remaining(), set())
+        self.assertEqual(len(self.archived()), 1)
+        self.assertTrue((self.directory / f"sessions-{state['run']}-00000.jsonl.gz").exists())
+
+    def test_interrupted_batch_that_was_deleted_is_completed(self):
+        retention = self.retention()
+        state = retention.new_state()
+        retention.directory.mkdir(exist_ok=True)
+        state['pending'] = {'file': retention._archive_path(state).name, 'sessions': [str(uuid.uuid4())]}
+        retention.save_state(state)
+        self.session(days_ago=40)
+
+        retention.run()
+
+        self.assertEqual(self.remaining(), set())
+        # The next batch doesn't overwrite the archive of the settled one
+        self.assertTrue((self.directory / f"sessions-{state['run']}-00001.jsonl.gz").exists())
@@ -0,0 +1,93 @@
+# chatbot/tests/test_rollup_analytics.py
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from chatbotapp.models import ChatbotAnalytics, ChatSession, Message, ResponseJob, RollupWatermark
+
+from .utils import chatbot_settings
+
+
+@chatbot_settings(RESPONSE_TIMEOUT_MINUTES=30)
+class RollupAnalyticsTests(TestCase):
+    def exchange(self, chat_session, response_time=0.5, minutes_ago=5):
+        timestamp = timezone.now() - timedelta(minutes=minutes_ago)
+        user_message = Message.objects.create(chat_session=chat_session, message_type='user',
+                                              content='Hello', timestamp=timestamp)
+        bot_message = Message.objects.create(chat_session=chat_session, message_type='bot', content='Hi',
+                                             timestamp=timestamp, metadata={'response_time': response_time})
+        return user_message, bot_message
+
+    def rollup(self, lag_seconds=0, now=None):
+        with mock.patch('django.utils.timezone.now', return_value=now or timezone.now()):
+            call_command('rollup_analytics', '--lag-seconds', str(lag_seconds), stdout=StringIO())
+        return RollupWatermark.objects.get(name='chatbot_analytics').last_message_id
+
+    def test_rolls_up_messages_sessions_and_response_times(self):
+        alice = User.objects.create_user('alice')
+        self.exchange(ChatSession.objects.create(user=alice), response_time=1.0)
+        _, last = self.exchange(ChatSession.objects.create(user=alice), response_time=3.0)
+
+        self.assertEqual(self.rollup(), last.id)
+
+        analytics = ChatbotAnalytics.objects.get()
+        self.assertEqual(analytics.total_messages, 4)
+        self.assertEqual(analytics.total_sessions, 2)
+        self.assertEqual(analytics.response_time_count, 2)
+        self.assertAlmostEqual(analytics.avg_response_time, 2.0)
+
+    def test_counts_signed_in_users_only(self):
+        self.exchange(ChatSession.objects.create(user=User.objects.create_user('alice')))
+        self.exchange(ChatSession.objects.create())
+        self.exchange(ChatSession.objects.create())
+        self.rollup()
+        analytics = ChatbotAnalytics.objects.get()
+        self.assertEqual(analytics.unique_users, 1)
+        self.assertEqual(analytics.total_sessions, 3)
+
+    def test_waits_for_unfinished_responses(self):
+        chat_session = ChatSession.objects.create()
+        self.exchange(chat_session)
+        user_message, pending = self.exchange(chat_session)
+        job = ResponseJob.objects.create(user_message=user_message, bot_message=pending)
+
+        self.assertEqual(self.rollup(), user_message.id)
+        # Rerunning counts nothing twice
+        self.assertEqual(self.rollup(), user_message.id)
+        self.assertEqual(ChatbotAnalytics.objects.get().total_messages, 3)
+
+        ResponseJob.objects.filter(pk=job.pk).update(status='done')
+        self.assertEqual(self.rollup(), pending.id)
+        self.assertEqual(ChatbotAnalytics.objects.get().total_messages, 4)
+
+    def test_stuck_response_does_not_hold_the_watermark_back(self):
+        chat_session = ChatSession.objects.create()
+        user_message, stuck = self.exchange(chat_session, minutes_ago=90)
+        ResponseJob.objects.create(user_message=user_message, bot_message=stuck, status='running',
+                                   created_at=timezone.now() - timedelta(minutes=90))
+        _, last = self.exchange(chat_session)
+
+        self.assertEqual(self.rollup(), last.id)
+
+    def test_counts_messages_committed_out_of_order(self):
+        chat_session = ChatSession.objects.create()
+        started = timezone.now()
+        sent = started - timedelta(minutes=5)
+        first = Message.objects.create(chat_session=chat_session, message_type='user', content='Hello',
+                                       timestamp=sent)
+        # The next id went to a slow transaction, which commits after the one following it
+        Message.objects.create(id=first.id + 2, chat_session=chat_session, message_type='user', content='Hi',
+                               timestamp=sent)
+
+        self.assertEqual(self.rollup(lag_seconds=60, now=started), 0)
+        late = Message.objects.create(id=first.id + 1, chat_session=chat_session, message_type='bot',
+                                      content='Hey', timestamp=sent)
+        self.assertEqual(self.rollup(lag_seconds=60, now=started + timedelta(seconds=30)), 0)
+
+        self.assertEqual(self.rollup(lag_seconds=60, now=started + timedelta(seconds=61)), late.id + 1)
+        self.assertEqual(ChatbotAnalytics.objects.get().total_messages, 3)
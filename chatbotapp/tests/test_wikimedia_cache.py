@@ -0,0 +1,53 @@
+# chatbot/tests/test_wikimedia_cache.py
+import time
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from chatbotapp import resilience
+from chatbotapp.wikimedia_cache import WIKIMEDIA_CACHE_EVENTS, WikimediaCache
+
+from .utils import LOCAL_CACHES, chatbot_settings
+
+
+def events(endpoint):
+    return {labels[1]: count for labels, count in WIKIMEDIA_CACHE_EVENTS.snapshot()['series']
+            if labels[0] == endpoint}
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+@chatbot_settings(WIKIMEDIA_CACHE_LOCK_SECONDS=10)
+class WikimediaCacheTests(SimpleTestCase):
+    def setUp(self):
+        for alias in LOCAL_CACHES:
+            caches[alias].clear()
+        self.cache = WikimediaCache()
+        self.fetches = 0
+
+    def fetch(self):
+        self.fetches += 1
+        return {'title': 'Python'}
+
+    def test_counts_lookups_in_the_registry(self):
+        before = events('summary')
+        for _ in range(2):
+            self.assertEqual(self.cache.get_or_fetch('summary', ('python',), self.fetch), {'title': 'Python'})
+        # A fresh instance in the same process has an empty local cache, but shares the counter
+        WikimediaCache().get_or_fetch('summary', ('Python',), self.fetch)
+
+        after = events('summary')
+        self.assertEqual(self.fetches, 1)
+        for result in ('miss', 'local_hit', 'hit'):
+            self.assertEqual(after.get(result, 0) - before.get(result, 0), 1, result)
+        self.assertEqual(self.cache.stats()['summary']['miss'], after['miss'])
+
+    def test_waits_on_another_process_no_longer_than_the_deadline(self):
+        key = self.cache.make_key('summary', 'python')
+        # Another process holds the fetch lock and never stores the entry
+        self.cache.locks.add(f'{key}:lock', 1, 60)
+
+        started = time.monotonic()
+        with resilience.deadline(0.2):
+            self.cache.get_or_fetch('summary', ('python',), self.fetch)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(self.fetches, 1)
@@ -0,0 +1,168 @@
+# chatbot/tests/test_wikimedia_client.py
+import json
+import tempfile
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from chatbotapp import views
+from chatbotapp.gemini_client import WikimediaClient
+from chatbotapp.http_transport import get_async_transport, get_transport
+from chatbotapp.mediawiki_stub import MediaWikiStub
+
+from .utils import LOCAL_CACHES, chatbot_settings
+
+
+class MediaWikiStubMixin:
+    """Runs a local MediaWiki stub serving the JSON files in responses_dir"""
+
+    responses_dir = None
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = MediaWikiStub(responses_dir=cls.responses_dir).start()
+        cls.addClassCleanup(cls.stub.stop)
+
+    def setUp(self):
+        self.stub.reset_stats()
+        # LocMem entries outlive the cache objects, and so the test that made them
+        for alias in LOCAL_CACHES:
+            caches[alias].clear()
+        self.chatbot_settings(WIKIMEDIA_HEDGE_DELAY=None)
+
+    def chatbot_settings(self, **overrides):
+        override = chatbot_settings(WIKIMEDIA_API_URL=self.stub.url, **overrides)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    async def close_async_transport(self):
+        await get_async_transport().aclose()
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class MediaWikiStubTestCase(MediaWikiStubMixin, SimpleTestCase):
+    pass
+
+
+class WikimediaClientTests(MediaWikiStubTestCase):
+    """WikimediaClient against the canned responses of the stub"""
+
+    def test_search_pages(self):
+        results = WikimediaClient().search_pages('python')
+        self.assertEqual(results[0]['title'], 'Python (programming language)')
+        self.assertEqual(results[0]['pageid'], 23862)
+
+    def test_get_page_summary(self):
+        summary = WikimediaClient().get_page_summary('python (programming language)')
+        self.assertEqual(summary['title'], 'Python (programming language)')
+        self.assertEqual(summary['pageid'], '23862')
+        self.assertTrue(summary['extract'].startswith('Python is a high-level'))
+        self.assertEqual(summary['url'], 'https://en.wikipedia.org/wiki/Python_(programming_language)')
+
+    def test_get_page_content(self):
+        content = WikimediaClient().get_page_content(23862)
+        self.assertTrue(content)
+
+    def test_repeated_lookups_are_served_from_the_cache(self):
+        client = WikimediaClient()
+        client.search_pages('python')
+        client.search_pages('  Python ')
+        WikimediaClient().search_pages('python')
+        self.assertEqual(self.stub.stats()['requests'], 1)
+
+    def test_requests_reuse_a_kept_alive_gzipped_connection(self):
+        client = WikimediaClient()
+        for title in ('Python', 'Java', 'Rust'):
+            client.get_page_summary(title)
+        stats = self.stub.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['gzipped'], 3)
+        self.assertLessEqual(stats['connections'], 1)
+
+
+class AsyncWikimediaClientTests(MediaWikiStubTestCase):
+    """The async lookups, through the event loop's httpx transport"""
+
+    async def test_async_lookups_match_the_sync_ones(self):
+        client = WikimediaClient()
+        self.assertTrue(client.supports_async)
+        self.assertEqual((await client.asearch_pages('python'))[0]['pageid'], 23862)
+        summary = await client.aget_page_summary('python (programming language)')
+        self.assertEqual(summary['title'], 'Python (programming language)')
+        self.assertEqual(await client.aget_page_content(23862), client.get_page_content(23862))
+        await self.close_async_transport()
+
+    async def test_async_lookups_share_the_cache(self):
+        client = WikimediaClient()
+        client.search_pages('python')
+        await client.asearch_pages('Python')
+        await client.asearch_pages('python')
+        self.assertEqual(self.stub.stats()['requests'], 1)
+        await self.close_async_transport()
+
+    async def test_async_requests_reuse_a_kept_alive_gzipped_connection(self):
+        client = WikimediaClient()
+        for title in ('Python', 'Java', 'Rust'):
+            await client.aget_page_summary(title)
+        stats = client.async_transport.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertEqual(stats['connections_reused'], 2)
+        self.assertEqual(self.stub.stats()['gzipped'], 3)
+        await self.close_async_transport()
+
+
+class WikimediaClientErrorTests(MediaWikiStubTestCase):
+    """A stub with no canned responses, so every query gets a 400"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.responses_dir = tempfile.mkdtemp()
+        super().setUpClass()
+
+    def test_errors_come_back_empty_and_are_not_cached(self):
+        client = WikimediaClient()
+        with self.assertLogs('chatbotapp.gemini_client', 'ERROR'):
+            self.assertEqual(client.search_pages('python'), [])
+            self.assertIsNone(client.get_page_summary('Python'))
+            self.assertEqual(client.search_pages('python'), [])
+        self.assertEqual(self.stub.stats()['requests'], 3)
+
+    def test_failed_reads_are_retried_by_hedging_alone(self):
+        self.chatbot_settings(WIKIMEDIA_HEDGE_DELAY=5, WIKIMEDIA_HEDGE_ATTEMPTS=2)
+        with self.assertLogs('chatbotapp.gemini_client', 'ERROR'):
+            self.assertEqual(WikimediaClient().search_pages('python'), [])
+        # One retry from the hedge, none from the HTTP transport underneath
+        self.assertEqual(self.stub.stats()['requests'], 2)
+
+    async def test_failed_async_reads_are_retried_by_hedging_alone(self):
+        self.chatbot_settings(WIKIMEDIA_HEDGE_DELAY=5, WIKIMEDIA_HEDGE_ATTEMPTS=2)
+        with self.assertLogs('chatbotapp.gemini_client', 'ERROR'):
+            self.assertEqual(await WikimediaClient().asearch_pages('python'), [])
+        self.assertEqual(self.stub.stats()['requests'], 2)
+        await self.close_async_transport()
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+@chatbot_settings(METRICS_DIR=None, RATE_LIMITS={})
+class StreamWikimediaTests(MediaWikiStubMixin, TestCase):
+    """send_message_stream asks Wikimedia through the async client"""
+
+    async def test_stream_answers_from_the_async_client(self):
+        sync_requests = get_transport().stats()['requests']
+        with mock.patch.object(views.chatbot, 'wikimedia', WikimediaClient()):
+            response = await AsyncClient().post(
+                reverse('send_message_stream'), json.dumps({'message': 'What is Python?'}),
+                content_type='application/json'
+            )
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        self.assertIn('event: wikipedia', body)
+        self.assertIn('Python is a high-level', body)
+        self.assertGreater(self.stub.stats()['requests'], 0)
+        self.assertEqual(get_async_transport().stats()['requests'], self.stub.stats()['requests'])
+        self.assertEqual(get_transport().stats()['requests'], sync_requests)
+        await self.close_async_transport()
@@ -0,0 +1,24 @@
+# chatbot/tests/utils.py
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import override_settings
+
+from chatbotapp import anonymous_sessions
+
+# Process-local caches, so tests neither share nor leave state behind
+LOCAL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'chatbot-tests'},
+    'coordination': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'chatbot-tests-coordination'},
+}
+
+
+def chatbot_settings(**overrides) -> override_settings:
+    """override_settings for some CHATBOT_SETTINGS, keeping the rest"""
+    return override_settings(CHATBOT_SETTINGS={**settings.CHATBOT_SETTINGS, **overrides})
+
+
+def join_anonymous_chat(client, chat_session):
+    """Give a test client the cookie of an anonymous visitor's chat session"""
+    response = HttpResponse()
+    anonymous_sessions.remember(response, chat_session)
+    client.cookies.update(response.cookies)
@@ -8,20 +8,17 @@ urlpatterns = [
     
     # Chat functionality
     path('send-message/', views.send_message, name='send_message'),
-    path('get-messages/<int:session_id>/', views.get_messages, name='get_messages'),
+    path('send-message/stream/', views.send_message_stream, name='send_message_stream'),
+    path('get-messages/<uuid:session_id>/', views.get_messages, name='get_messages'),
+    path('search/', views.search, name='search'),
     path('new-chat/', views.new_chat, name='new_chat'),
     path('clear-chat/', views.clear_chat, name='clear_chat'),
+    path('export/', views.export_history, name='export_history'),
     
-    # Wikimedia API endpoints
-    path('wikimedia-search/', views.wikimedia_search, name='wikimedia_search'),
-    path('get-page-content/', views.get_page_content, name='get_page_content'),
+    # Prometheus metrics of all worker processes
+    path('metrics/', views.metrics_view, name='metrics'),
     
-    # User management
+    # User management (signing in goes through the admin's login page)
     path('login/', views.login_view, name='login'),
-    path('register/', views.register_view, name='register'),
     path('logout/', views.logout_view, name='logout'),
-    path('settings/', views.settings_view, name='settings'),
-    
-    # Chat history
-    path('history/', views.chat_history, name='history'),
 ]
@@ -1,21 +1,33 @@
 # chatbot/views.py (Updated with Wikimedia integration)
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib import messages
+from django.conf import settings
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q
+from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import url_has_allowed_host_and_scheme
 import json
 import random
+from urllib.parse import urlencode
 import time
 import logging
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from . import anonymous_sessions, chat_export, metrics, resilience
+from .conf import chatbot_setting
+from .message_search import search_messages
 from .models import ChatSession, Message, BotPersonality, UserPreferences
 from .bot_logic import EnhancedChatBot
 from .gemini_client import GeminiClient
+from .response_queue import answered_by_gemini, background_responses_enabled, enqueue_response
 
 
 # Initialize the enhanced chatbot
@@ -32,31 +44,108 @@ def home(request):
             defaults={'session_name': f'Chat {timezone.now().strftime("%Y-%m-%d %H:%M")}'}
         )
     else:
-        # For anonymous users, use session
-        session_id = request.session.get('chat_session_id')
-        if session_id:
-            try:
-                chat_session = ChatSession.objects.get(id=session_id, user=None)
-            except ChatSession.DoesNotExist:
-                chat_session = ChatSession.objects.create(session_name="Anonymous Chat")
-                request.session['chat_session_id'] = str(chat_session.id)
-        else:
-            chat_session = ChatSession.objects.create(session_name="Anonymous Chat")
-            request.session['chat_session_id'] = str(chat_session.id)
+        # Anonymous visitors get a chat session with their first message
+        chat_session = anonymous_sessions.get_chat_session(request)
     
-    # Get recent messages
-    messages_list = chat_session.messages.all()[:50]  # Last 50 messages
+    # Get recent messages, only if the cached fragment is missing
+    messages_list = SimpleLazyObject(
+        lambda: _message_page(chat_session)[0] if chat_session else []  # Last 50 messages
+    )
     
     # Get available bot personalities
     bot_personalities = BotPersonality.objects.filter(is_active=True)
     
     context = {
         'chat_session': chat_session,
-        'messages': messages_list,
+        # Not 'messages', which base.html shows as django.contrib.messages
+        'chat_messages': messages_list,
+        'messages_cache_seconds': chatbot_setting('MESSAGES_FRAGMENT_CACHE_SECONDS', 3600),
         'bot_personalities': bot_personalities,
+        'background_responses': background_responses_enabled(),
+        'response_wait_seconds': chatbot_setting('BACKGROUND_RESPONSE_WAIT_SECONDS', 120),
     }
     
     return render(request, 'chat.html', context)
+
+
+def login_view(request):
+    """Send visitors to the login page, coming back to where they were"""
+    login_url = settings.LOGIN_URL
+    next_url = request.GET.get('next')
+    if next_url and url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        login_url = f"{login_url}?{urlencode({'next': next_url})}"
+    return redirect(login_url)
+
+
+def logout_view(request):
+    """Log the user out and go back to the chat"""
+    logout(request)
+    return redirect(settings.LOGOUT_REDIRECT_URL)
+
+
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+
+
+def _get_chat_session(request, session_id, create=False):
+    """The user's chat session with this id, or the anonymous visitor's own
+    
+    Anonymous visitors only ever reach the chat session named in their signed
+    cookie. With `create`, one is created for a visitor who has none yet.
+    Returns the session and whether it was created; raises Http404.
+    """
+    if request.user.is_authenticated:
+        return get_object_or_404(ChatSession, id=session_id, user=request.user), False
+    
+    chat_session = anonymous_sessions.get_chat_session(request)
+    if chat_session is None and create:
+        return anonymous_sessions.create_chat_session(), True
+    if chat_session is None or (session_id and str(chat_session.id) != str(session_id)):
+        raise Http404("No ChatSession matches the given query.")
+    return chat_session, False
+
+
+def _message_page(chat_session, since=None, before=None, limit=MESSAGE_PAGE_SIZE):
+    """Get a page of a session's messages in chronological order, using keyset pagination
+    
+    With `since`, the messages after that message; with `before`, the ones
+    right before it; otherwise the most recent ones. Pages are read straight off
+    the (chat_session, timestamp, id) index, so they cost the same however long
+    the conversation is. Returns the page and whether there are more messages
+    beyond it. Raises Message.DoesNotExist for a cursor outside the session.
+    """
+    messages = chat_session.messages.all()
+    if since is not None:
+        cursor_timestamp = messages.values_list('timestamp', flat=True).get(id=since)
+    elif before is not None:
+        cursor_timestamp = messages.values_list('timestamp', flat=True).get(id=before)
+    
+    if since is not None:
+        page = list(
+            messages
+            .filter(Q(timestamp__gt=cursor_timestamp) | Q(timestamp=cursor_timestamp, id__gt=since))
+            .order_by('timestamp', 'id')[:limit + 1]
+        )
+        return page[:limit], len(page) > limit
+    
+    if before is not None:
+        messages = messages.filter(Q(timestamp__lt=cursor_timestamp) | Q(timestamp=cursor_timestamp, id__lt=before))
+    page = list(messages.order_by('-timestamp', '-id')[:limit + 1])
+    has_more = len(page) > limit
+    return page[:limit][::-1], has_more
+
+
+def _serialize_message(message):
+    """Represent a message for the JSON API"""
+    return {
+        'id': message.id,
+        'content': message.content,
+        'html': message.html,
+        'timestamp': message.timestamp.isoformat(),
+        'type': message.message_type,
+        'status': message.metadata.get('status', 'done'),
+    }
+
 # In your views.py, update the send_message view
 @csrf_exempt
 def send_message(request):
@@ -71,62 +160,79 @@ def send_message(request):
                 return JsonResponse({'error': 'Empty message'}, status=400)
             
             # Get chat session
-            if request.user.is_authenticated:
-                chat_session = get_object_or_404(ChatSession, id=session_id, user=request.user)
-            else:
-                chat_session = get_object_or_404(ChatSession, id=session_id, user=None)
+            chat_session, created = _get_chat_session(request, session_id, create=True)
+            
+            # Leave the response to the background workers and return right away;
+            # the page picks it up through get_messages
+            if background_responses_enabled():
+                user_message, bot_message = enqueue_response(chat_session, message_content)
+                with metrics.stage('encode'):
+                    response = JsonResponse({
+                        'success': True,
+                        'session_id': chat_session.id,
+                        'user_message': _serialize_message(user_message),
+                        'bot_message': _serialize_message(bot_message)
+                    })
+                if created:
+                    anonymous_sessions.remember(response, chat_session)
+                return response
             
-            # Save user message
-            user_message = Message.objects.create(
+            # Saved together with the bot message once the response is ready, so
+            # the slow upstream calls never happen inside a transaction
+            user_message = Message(
                 chat_session=chat_session,
                 message_type='user',
-                content=message_content
+                content=message_content,
+                timestamp=timezone.now()
             )
             
             # Generate bot response using enhanced chatbot
             start_time = time.time()
+            with metrics.stage('route'):
+                intent = chatbot.route(message_content)
             try:
-                bot_response_content = chatbot.get_response(message_content, chat_session)
+                with resilience.deadline(_request_deadline()), metrics.stage('respond'):
+                    bot_response_content = chatbot.get_response(message_content, chat_session, intent=intent)
             except Exception as e:
                 logger.error(f"Error generating bot response: {e}")
                 bot_response_content = "I apologize, but I encountered an error while processing your request. Please try again."
             
             response_time = time.time() - start_time
             
-            # Save bot message
-            bot_message = Message.objects.create(
+            bot_message = Message(
                 chat_session=chat_session,
                 message_type='bot',
                 content=bot_response_content,
                 metadata={
                     'response_time': response_time,
-                    'used_wikimedia': chatbot.should_use_wikimedia(message_content),
-                    'used_gemini': True  # Indicate Gemini was used
+                    'intent': intent.name,
+                    'used_wikimedia': intent.uses_wikimedia,
+                    'used_gemini': _answered_by_gemini(),
+                    'stages': _stage_metadata(),
+                    **_trace_notes()
                 }
             )
             
-            # Update chat session
-            chat_session.updated_at = timezone.now()
-            chat_session.save()
+            # Save both messages and update the chat session in one transaction
+            with metrics.stage('persist'):
+                chat_session.save_messages(user_message, bot_message)
+            chatbot.fold_context(chat_session)
             
-            return JsonResponse({
-                'success': True,
-                'user_message': {
-                    'id': user_message.id,
-                    'content': user_message.content,
-                    'timestamp': user_message.timestamp.isoformat(),
-                    'type': 'user'
-                },
-                'bot_message': {
-                    'id': bot_message.id,
-                    'content': bot_message.content,
-                    'timestamp': bot_message.timestamp.isoformat(),
-                    'type': 'bot'
-                }
-            })
+            with metrics.stage('encode'):
+                response = JsonResponse({
+                    'success': True,
+                    'session_id': chat_session.id,
+                    'user_message': _serialize_message(user_message),
+                    'bot_message': _serialize_message(bot_message)
+                })
+            if created:
+                anonymous_sessions.remember(response, chat_session)
+            return response
             
         except json.JSONDecodeError:
             return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        except Http404:
+            raise
         except Exception as e:
             logger.error(f"Error in send_message: {e}")
             return JsonResponse({'error': 'An error occurred while processing your message'}, status=500)
@@ -134,10 +240,223 @@ def send_message(request):
     return JsonResponse({'error': 'Method not allowed'}, status=405)
 
 
+def _request_deadline():
+    """Seconds a request may spend waiting on Gemini and Wikimedia"""
+    return chatbot_setting('REQUEST_DEADLINE_SECONDS', 30)
+
+
+def _stage_metadata():
+    """The stage timings of the current request, for Message.metadata"""
+    trace = metrics.current_trace()
+    return trace.as_metadata() if trace else {}
+
+
+def _answered_by_gemini():
+    trace = metrics.current_trace()
+    return answered_by_gemini(trace) if trace else False
+
+
+def _trace_notes():
+    """What the current request noted about how it was handled, e.g. response cache hits"""
+    trace = metrics.current_trace()
+    return trace.notes_metadata() if trace else {}
+
+
+def _sse_event(event, data):
+    """Encode a single Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@csrf_exempt
+async def send_message_stream(request):
+    """Handle sending messages, streaming the bot response as Server-Sent Events
+    
+    Meant to be served through the ASGI application so that a worker isn't held
+    while the response is generated. The bot message is saved once the stream ends.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    
+    message_content = data.get('message', '').strip()
+    session_id = data.get('session_id')
+    
+    if not message_content:
+        return JsonResponse({'error': 'Empty message'}, status=400)
+    
+    # Get chat session
+    try:
+        chat_session, created = await sync_to_async(_get_chat_session)(request, session_id, create=True)
+    except (ValidationError, ValueError):
+        raise Http404("No ChatSession matches the given query.")
+    
+    # Save user message
+    user_message = Message(
+        chat_session=chat_session,
+        message_type='user',
+        content=message_content
+    )
+    await chat_session.asave_messages(user_message)
+    
+    async def event_stream():
+        # The request's own trace is over once the response starts, so the
+        # stream keeps its own and makes it current around each step
+        stream_trace = metrics.Trace()
+        stream_deadline = time.monotonic() + _request_deadline()
+        start_time = time.time()
+        first_token_time = None
+        parts = []
+        sources = set()
+        saved = False
+        
+        async def save_bot_message(interrupted=False):
+            metadata = {
+                'response_time': time.time() - start_time,
+                'time_to_first_token': first_token_time,
+                'intent': intent.name,
+                'used_wikimedia': 'wikipedia' in sources,
+                'used_gemini': 'chunk' in sources,
+                'streamed': True,
+                'stages': stream_trace.as_metadata(),
+                **stream_trace.notes_metadata(),
+            }
+            if interrupted:
+                metadata['stream_interrupted'] = True
+            bot_message = Message(
+                chat_session=chat_session,
+                message_type='bot',
+                content=''.join(parts),
+                metadata=metadata
+            )
+            await chat_session.asave_messages(bot_message)
+            return bot_message
+        
+        yield _sse_event('start', {
+            'session_id': str(chat_session.id),
+            'user_message': _serialize_message(user_message)
+        })
+        
+        with metrics.trace(stream_trace), metrics.stage('route'):
+            intent = chatbot.route(message_content)
+        # Wikimedia is asked on the event loop; only Gemini's blocking stream takes a worker thread
+        parts_iter = chatbot.astream_response(message_content, chat_session, intent=intent)
+        try:
+            while True:
+                # Tasks and worker threads inherit the context, and the trace with it
+                with metrics.trace(stream_trace), resilience.deadline(at=stream_deadline):
+                    part = await anext(parts_iter, None)
+                if part is None:
+                    break
+                event, text = part
+                if first_token_time is None:
+                    first_token_time = time.time() - start_time
+                parts.append(text)
+                sources.add(event)
+                yield _sse_event(event, {'text': text})
+            
+            if not parts:
+                parts.append("I apologize, but I encountered an error while processing your request. Please try again.")
+                yield _sse_event('fallback', {'text': parts[0]})
+            
+            bot_message = await save_bot_message()
+            saved = True
+            chatbot.fold_context(chat_session)
+            yield _sse_event('done', {'bot_message': _serialize_message(bot_message)})
+        except Exception as e:
+            logger.error(f"Error in send_message_stream: {e}")
+            yield _sse_event('error', {'error': 'An error occurred while processing your message'})
+        finally:
+            # Keep whatever was streamed if the client went away mid-response
+            if not saved and parts:
+                await save_bot_message(interrupted=True)
+    
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+    if created:
+        anonymous_sessions.remember(response, chat_session)
+    return response
 
 
+def get_messages(request, session_id):
+    """Get a page of messages of a chat session
+    
+    Query parameters: `since=<message id>` for the messages after that one
+    (polling for new messages), `before=<message id>` for older history, and
+    `limit`. Without a cursor the most recent messages are returned.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    chat_session, _ = _get_chat_session(request, session_id)
+    
+    try:
+        since = int(request.GET['since']) if 'since' in request.GET else None
+        before = int(request.GET['before']) if 'before' in request.GET else None
+        limit = min(max(int(request.GET.get('limit', MESSAGE_PAGE_SIZE)), 1), MAX_MESSAGE_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid pagination parameters'}, status=400)
+    if since is not None and before is not None:
+        return JsonResponse({'error': 'Use either since or before, not both'}, status=400)
+    
+    try:
+        messages_list, has_more = _message_page(chat_session, since=since, before=before, limit=limit)
+    except Message.DoesNotExist:
+        return JsonResponse({'error': 'Unknown message cursor'}, status=400)
+    
+    return JsonResponse({
+        'success': True,
+        'messages': [_serialize_message(message) for message in messages_list],
+        'has_more': has_more,
+        # Cursors for the next older page and for polling
+        'before': messages_list[0].id if messages_list else before,
+        'since': messages_list[-1].id if messages_list else since,
+    })
 
 
+def search(request):
+    """Full-text search over the messages of the requesting user's chat sessions
+    
+    Query parameters: `q`, and `page` for further pages of results, best
+    matches first. Anonymous users search their current chat session only.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid page'}, status=400)
+    if not query:
+        return JsonResponse({'error': 'Missing search query'}, status=400)
+    
+    if request.user.is_authenticated:
+        chat_sessions = ChatSession.objects.filter(user=request.user)
+    else:
+        chat_sessions = ChatSession.objects.filter(id=anonymous_sessions.get_chat_session_id(request), user=None)
+    
+    results, has_more = search_messages(query, chat_sessions, page=page)
+    return JsonResponse({
+        'success': True,
+        'query': query,
+        'page': page,
+        'has_more': has_more,
+        'results': [
+            {
+                **_serialize_message(message),
+                'session_id': message.chat_session_id,
+                'session_name': message.chat_session.session_name,
+                'snippet': message.snippet,
+                'rank': message.rank,
+            }
+            for message in results
+        ],
+    })
 
 
 @csrf_exempt
@@ -155,13 +474,14 @@ def new_chat(request):
                 is_active=True
             )
         else:
-            # For anonymous users
-            chat_session = ChatSession.objects.create(session_name="Anonymous Chat")
-            request.session['chat_session_id'] = str(chat_session.id)
-        
-        # Reset the Gemini chat session if it exists
-        if hasattr(chatbot, 'gemini') and chatbot.gemini:
-            chatbot.gemini.reset_chat()
+            # For anonymous users, the next message starts a new session
+            response = JsonResponse({
+                'success': True,
+                'session_id': None,
+                'redirect_url': '/'
+            })
+            anonymous_sessions.forget(response)
+            return response
         
         return JsonResponse({
             'success': True,
@@ -169,4 +489,79 @@ def new_chat(request):
             'redirect_url': '/'
         })
     
-    return JsonResponse({'error': 'Method not allowed'}, status=405)
\ No newline at end of file
+    return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+@csrf_exempt
+def clear_chat(request):
+    """Delete all messages of a chat session"""
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body or '{}')
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        
+        chat_session, _ = _get_chat_session(request, data.get('session_id'))
+        
+        with transaction.atomic():
+            chat_session.messages.all().delete()
+            chat_session.reset_counters()
+        
+        return JsonResponse({'success': True})
+    
+    return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+
+def _async_chunks(chunks):
+    """Serve a blocking iterator from ASGI a chunk at a time (Django would read it all first)"""
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    
+    async def stream():
+        while True:
+            chunk = await next_chunk(chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    
+    return stream()
+
+
+def export_history(request):
+    """Download the requesting user's chat history as JSONL, gzipped with `?gzip=1`
+    
+    Anonymous visitors get their current chat session. The file is generated
+    while it is sent, so memory use does not grow with the history.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    if request.user.is_authenticated:
+        username = request.user.get_username()
+        chat_sessions = ChatSession.objects.filter(user=request.user)
+    else:
+        username = None
+        chat_sessions = ChatSession.objects.filter(id=anonymous_sessions.get_chat_session_id(request), user=None)
+    
+    compress = request.GET.get('gzip') in ('1', 'true')
+    chunks = chat_export.export_chunks(chat_export.export_lines(chat_sessions, username), compress=compress)
+    if isinstance(request, ASGIRequest):
+        chunks = _async_chunks(chunks)
+    
+    filename = f"chat-history-{timezone.now():%Y%m%d-%H%M%S}.jsonl" + ('.gz' if compress else '')
+    response = StreamingHttpResponse(
+        chunks, content_type='application/gzip' if compress else 'application/x-ndjson; charset=utf-8'
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def metrics_view(request):
+    """Serve the request and stage latency histograms of all worker processes for Prometheus"""
+    allowed_ips = chatbot_setting('METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+    if request.META.get('REMOTE_ADDR') not in allowed_ips and not request.user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    
+    return HttpResponse(
+        metrics.render_prometheus(metrics.registry.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -0,0 +1,238 @@
+# chatbot/wikimedia_cache.py
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from django.core.cache import caches
+
+from . import metrics, resilience
+from .conf import chatbot_setting, coordination_cache
+
+logger = logging.getLogger(__name__)
+
+WIKIMEDIA_CACHE_EVENTS = metrics.registry.counter(
+    'chatbot_wikimedia_cache_events_total', "Lookups in the Wikimedia cache", ['endpoint', 'result']
+)
+
+# Stored in place of empty results so "not found" can be told apart from a miss
+NOT_FOUND = {'__wikimedia_not_found__': True}
+
+DEFAULT_TTLS = {
+    'search': 60 * 60,
+    'page': 24 * 60 * 60,
+    'summary': 24 * 60 * 60,
+}
+
+
+def normalize_term(term) -> str:
+    """Normalize a search term so that trivially different queries share an entry"""
+    return ' '.join(str(term).lower().split())
+
+
+class _LocalCache:
+    """Small in-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class _Flight:
+    """An upstream request in progress that other threads can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class WikimediaCache:
+    """Two-level cache for Wikimedia lookups
+
+    Entries live in Django's cache framework, so every worker sharing the cache
+    backend shares them, with a small in-process LRU in front for repeat hits.
+    Empty results are cached for a short time, and concurrent misses for the same
+    key are collapsed into a single upstream request: within a process through
+    an in-flight table, across processes through a short-lived lock in the
+    coordination cache.
+    """
+
+    def __init__(self, cache_alias: Optional[str] = None, ttls: Optional[Dict[str, int]] = None,
+                 negative_ttl: Optional[int] = None, local_max_entries: Optional[int] = None,
+                 lock_cache_alias: Optional[str] = None):
+        self.cache = caches[cache_alias or chatbot_setting('WIKIMEDIA_CACHE_ALIAS', 'default')]
+        self.locks = coordination_cache('WIKIMEDIA_LOCK_CACHE_ALIAS', lock_cache_alias)
+        self.ttls = {**DEFAULT_TTLS, **chatbot_setting('WIKIMEDIA_CACHE_TTLS', {}), **(ttls or {})}
+        self.negative_ttl = negative_ttl or chatbot_setting('WIKIMEDIA_NEGATIVE_CACHE_TTL', 5 * 60)
+        self.lock_timeout = chatbot_setting('WIKIMEDIA_CACHE_LOCK_SECONDS', 10)
+        self.local = _LocalCache(local_max_entries or chatbot_setting('WIKIMEDIA_LOCAL_CACHE_SIZE', 1024))
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    def make_key(self, endpoint: str, *parts) -> str:
+        raw = ':'.join(normalize_term(part) for part in parts)
+        digest = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+        return f"wikimedia:v1:{endpoint}:{digest}"
+
+    def _count(self, endpoint: str, outcome: str):
+        WIKIMEDIA_CACHE_EVENTS.inc(endpoint=endpoint, result=outcome)
+
+    def _wait_seconds(self) -> float:
+        """How long to wait on someone else's fetch: the lock timeout, capped by the time left"""
+        left = resilience.remaining()
+        return self.lock_timeout if left is None else max(0.0, min(self.lock_timeout, left))
+
+    def _unwrap(self, value):
+        return None if value == NOT_FOUND else value
+
+    def get_or_fetch(self, endpoint: str, key_parts: tuple, fetch: Callable[[], Any],
+                     is_empty: Callable[[Any], bool] = lambda value: not value):
+        """Return the cached value for key_parts, calling fetch() on a miss
+
+        Exceptions raised by fetch() propagate and are never cached.
+        """
+        key = self.make_key(endpoint, *key_parts)
+
+        value = self.local.get(key)
+        if value is not None:
+            self._count(endpoint, 'local_hit')
+            return self._unwrap(value)
+
+        value = self.cache.get(key)
+        if value is not None:
+            self._count(endpoint, 'hit')
+            self.local.set(key, value, self.negative_ttl if value == NOT_FOUND else self.ttls[endpoint])
+            return self._unwrap(value)
+
+        # Collapse concurrent misses in this process onto one flight
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            self._count(endpoint, 'coalesced')
+            flight.done.wait(self._wait_seconds())
+            if flight.error is not None:
+                raise flight.error
+            if flight.done.is_set():
+                return self._unwrap(flight.value)
+            # The leader is taking too long; go upstream ourselves
+
+        try:
+            value = self._fetch_and_store(endpoint, key, fetch, is_empty)
+            if leader:
+                flight.value = value
+            return self._unwrap(value)
+        except Exception as e:
+            if leader:
+                flight.error = e
+            raise
+        finally:
+            if leader:
+                flight.done.set()
+                with self._flights_lock:
+                    self._flights.pop(key, None)
+
+    def _fetch_and_store(self, endpoint: str, key: str, fetch: Callable[[], Any], is_empty):
+        # Collapse concurrent misses across processes: whoever gets the lock goes
+        # upstream while the others wait briefly for the entry to show up
+        lock_key = f"{key}:lock"
+        locked = self.locks.add(lock_key, 1, self.lock_timeout)
+        if not locked:
+            deadline = time.monotonic() + self._wait_seconds()
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                value = self.cache.get(key)
+                if value is not None:
+                    self._count(endpoint, 'coalesced')
+                    self.local.set(key, value, self.negative_ttl if value == NOT_FOUND else self.ttls[endpoint])
+                    return value
+
+        try:
+            self._count(endpoint, 'miss')
+            result = fetch()
+            if is_empty(result):
+                value, ttl = NOT_FOUND, self.negative_ttl
+            else:
+                value, ttl = result, self.ttls[endpoint]
+            self.cache.set(key, value, ttl)
+            self.local.set(key, value, ttl)
+            return value
+        finally:
+            if locked:
+                self.locks.delete(lock_key)
+
+    async def aget_or_fetch(self, endpoint: str, key_parts: tuple, fetch: Callable[[], Awaitable[Any]],
+                            is_empty: Callable[[Any], bool] = lambda value: not value):
+        """get_or_fetch for async callers, where fetch() returns an awaitable
+
+        Entries are shared with the sync path, but concurrent misses are not
+        collapsed here.
+        """
+        key = self.make_key(endpoint, *key_parts)
+
+        value = self.local.get(key)
+        if value is not None:
+            self._count(endpoint, 'local_hit')
+            return self._unwrap(value)
+
+        value = await self.cache.aget(key)
+        if value is not None:
+            self._count(endpoint, 'hit')
+            self.local.set(key, value, self.negative_ttl if value == NOT_FOUND else self.ttls[endpoint])
+            return self._unwrap(value)
+
+        self._count(endpoint, 'miss')
+        result = await fetch()
+        if is_empty(result):
+            value, ttl = NOT_FOUND, self.negative_ttl
+        else:
+            value, ttl = result, self.ttls[endpoint]
+        await self.cache.aset(key, value, ttl)
+        self.local.set(key, value, ttl)
+        return self._unwrap(value)
+
+    def invalidate(self, endpoint: str, *key_parts):
+        key = self.make_key(endpoint, *key_parts)
+        self.cache.delete(key)
+        self.local.delete(key)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Hit and miss counters of this process, per endpoint"""
+        stats = defaultdict(lambda: {'local_hit': 0, 'hit': 0, 'coalesced': 0, 'miss': 0})
+        for (endpoint, outcome), count in WIKIMEDIA_CACHE_EVENTS.snapshot()['series']:
+            stats[endpoint][outcome] = int(count)
+        return dict(stats)
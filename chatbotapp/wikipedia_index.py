@@ -0,0 +1,478 @@
+# chatbot/wikipedia_index.py
+# Offline Wikipedia backend: a Wikipedia abstracts dump (the XML abstract dump,
+# or JSONL) imported into one read-only index file that is memory-mapped, so
+# every worker process serves lookups from the same pages of the OS page cache.
+#
+# The file holds fixed-size record tables that are binary searched in place:
+# documents, normalized title -> document, page id -> document, and the term
+# vocabulary. Postings carry precomputed BM25 term weights and are stored in
+# descending weight order, so a query can stop after the best few thousand.
+import bz2
+import gzip
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import random
+import re
+import struct
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from array import array
+from collections import Counter, defaultdict
+from html import escape
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+from django.conf import settings
+
+from . import metrics
+from .conf import chatbot_setting
+from .gemini_client import WikimediaClient
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CBWIKI01'
+HEADER = struct.Struct('<8sQQ')  # magic, metadata offset, metadata length
+DOC = struct.Struct('<IQIQII')  # page id, title offset, title length, extract offset, extract length, length in tokens
+KEY = struct.Struct('<QII')  # key offset, key length, document (titles and terms alike)
+PAGE = struct.Struct('<II')  # page id, document
+TERM = struct.Struct('<QIQI')  # term offset, term length, first posting, document frequency
+POSTING = struct.Struct('<If')  # document, BM25 term weight
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has he in is it its of on or that the to was were will with".split()
+)
+# Title words count this many times over, so "Python" ranks the page titled so
+TITLE_WEIGHT = 3
+K1, B = 1.2, 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def title_key(title: str) -> bytes:
+    """Titles match case-insensitively, with underscores for spaces as in URLs"""
+    return ' '.join(title.replace('_', ' ').split()).casefold().encode('utf-8')
+
+
+# Dumps
+
+def _open(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_xml_abstracts(path: str) -> Iterator[Dict]:
+    """Pages of an enwiki-*-abstract.xml dump, which has no page ids"""
+    with _open(path) as dump:
+        for _, element in ElementTree.iterparse(dump):
+            if element.tag != 'doc':
+                continue
+            title = element.findtext('title') or ''
+            if title.startswith('Wikipedia: '):
+                title = title[len('Wikipedia: '):]
+            yield {'title': title, 'extract': element.findtext('abstract') or '', 'url': element.findtext('url')}
+            element.clear()
+
+
+def read_jsonl_abstracts(path: str) -> Iterator[Dict]:
+    """Pages of a JSONL file with title, extract (or abstract/text) and optionally pageid and url"""
+    with _open(path) as dump:
+        for line in dump:
+            if not line.strip():
+                continue
+            page = json.loads(line)
+            yield {
+                'title': page.get('title', ''),
+                'extract': page.get('extract') or page.get('abstract') or page.get('text') or '',
+                'pageid': page.get('pageid') or page.get('id'),
+                'url': page.get('url'),
+            }
+
+
+def read_abstracts(path: str, format: Optional[str] = None) -> Iterator[Dict]:
+    stem = re.sub(r"\.(gz|bz2)$", '', path)
+    format = format or ('xml' if stem.endswith('.xml') else 'jsonl')
+    return read_xml_abstracts(path) if format == 'xml' else read_jsonl_abstracts(path)
+
+
+# Building
+
+def build_index(pages: Iterable[Dict], output: str, progress=None) -> Dict:
+    """Write the index of `pages` to `output`, replacing it atomically; returns its metadata
+
+    Extracts are streamed to disk as they are read. Titles, document lengths
+    and the postings stay in memory until the end.
+    """
+    directory = os.path.dirname(os.path.abspath(output))
+    strings = tempfile.TemporaryFile(dir=directory)
+    strings_size = 0
+
+    def put(data: bytes) -> Tuple[int, int]:
+        nonlocal strings_size
+        strings.write(data)
+        offset, strings_size = strings_size, strings_size + len(data)
+        return offset, len(data)
+
+    docs = []
+    keys = []
+    page_ids = []
+    lengths = array('I')
+    postings = defaultdict(lambda: array('I'))  # term -> doc, tf, doc, tf...
+    wiki_url = None
+    used_ids = set()
+    for page in pages:
+        title = (page.get('title') or '').strip()
+        if not title:
+            continue
+        doc = len(docs)
+        page_id = page.get('pageid')
+        # The XML dump has no page ids, so such pages are numbered from the top
+        page_id = int(page_id) if page_id else None
+        if page_id is None or page_id in used_ids:
+            page_id = 2 ** 31 + doc
+        used_ids.add(page_id)
+        if wiki_url is None and page.get('url'):
+            wiki_url = page['url'].rsplit('/', 1)[0] + '/'
+
+        extract = page.get('extract') or ''
+        title_off, title_len = put(title.encode('utf-8'))
+        extract_off, extract_len = put(extract.encode('utf-8'))
+        counts = Counter(tokenize(extract))
+        for token in tokenize(title):
+            counts[token] += TITLE_WEIGHT
+        for term, tf in counts.items():
+            postings[term].extend((doc, tf))
+        lengths.append(sum(counts.values()))
+        docs.append((page_id, title_off, title_len, extract_off, extract_len))
+        keys.append(title_key(title))
+        page_ids.append((page_id, doc))
+        if progress and len(docs) % 100000 == 0:
+            progress(len(docs))
+
+    total = len(docs)
+    avgdl = (sum(lengths) / total) if total else 0.0
+
+    # Title keys and terms go into the strings section too
+    title_table = []
+    for doc, key in sorted(enumerate(keys), key=lambda item: item[1]):
+        title_table.append((*put(key), doc))
+    del keys
+    terms = sorted(postings)
+    term_strings = [put(term.encode('utf-8')) for term in terms]
+
+    tmp = f"{output}.tmp"
+    with open(tmp, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, 0, 0))
+        sections = {}
+
+        def section(name, write):
+            start = out.tell()
+            write()
+            sections[name] = [start, out.tell() - start]
+
+        def write_strings():
+            strings.seek(0)
+            while True:
+                chunk = strings.read(1 << 20)
+                if not chunk:
+                    break
+                out.write(chunk)
+
+        section('strings', write_strings)
+        section('docs', lambda: out.writelines(
+            DOC.pack(*doc, lengths[i]) for i, doc in enumerate(docs)))
+        section('titles', lambda: out.writelines(KEY.pack(*entry) for entry in title_table))
+        section('pages', lambda: out.writelines(PAGE.pack(*entry) for entry in sorted(page_ids)))
+
+        term_table = []
+
+        def write_postings():
+            first = 0
+            for term, (term_off, term_len) in zip(terms, term_strings):
+                entries = postings.pop(term)
+                weighted = []
+                for i in range(0, len(entries), 2):
+                    doc, tf = entries[i], entries[i + 1]
+                    norm = K1 * (1 - B + B * lengths[doc] / avgdl) if avgdl else K1
+                    weighted.append((-(tf * (K1 + 1) / (tf + norm)), doc))
+                weighted.sort()
+                out.writelines(POSTING.pack(doc, -weight) for weight, doc in weighted)
+                term_table.append((term_off, term_len, first, len(weighted)))
+                first += len(weighted)
+
+        section('postings', write_postings)
+        section('terms', lambda: out.writelines(TERM.pack(*entry) for entry in term_table))
+
+        meta = {
+            'docs': total,
+            'terms': len(terms),
+            'avgdl': avgdl,
+            'k1': K1,
+            'b': B,
+            'wiki_url': wiki_url or 'https://en.wikipedia.org/wiki/',
+            'built_at': time.time(),
+            'sections': sections,
+        }
+        meta_bytes = json.dumps(meta).encode('utf-8')
+        meta_off = out.tell()
+        out.write(meta_bytes)
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, meta_off, len(meta_bytes)))
+        out.flush()
+        os.fsync(out.fileno())
+    strings.close()
+    # Processes that have the old file mapped keep reading it until they reopen
+    os.replace(tmp, output)
+    return meta
+
+
+# Reading
+
+class _Table:
+    """Fixed-size records of one section of the mapped file"""
+
+    def __init__(self, buffer, offset: int, length: int, record: struct.Struct):
+        self.buffer = buffer
+        self.offset = offset
+        self.record = record
+        self.count = length // record.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i: int) -> tuple:
+        return self.record.unpack_from(self.buffer, self.offset + i * self.record.size)
+
+
+class WikipediaIndex:
+    """Read-only view of an index file written by build_index()"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, meta_off, meta_len = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a Wikipedia index")
+        self.meta = json.loads(self._mmap[meta_off:meta_off + meta_len])
+        sections = self.meta['sections']
+        self._strings = sections['strings'][0]
+        self.docs = _Table(self._mmap, *sections['docs'], DOC)
+        self.titles = _Table(self._mmap, *sections['titles'], KEY)
+        self.pages = _Table(self._mmap, *sections['pages'], PAGE)
+        self.terms = _Table(self._mmap, *sections['terms'], TERM)
+        self._postings = sections['postings'][0]
+
+    def close(self):
+        self._mmap.close()
+
+    def _string(self, offset: int, length: int) -> bytes:
+        start = self._strings + offset
+        return self._mmap[start:start + length]
+
+    @staticmethod
+    def _bisect(table: _Table, key, key_of) -> Optional[tuple]:
+        low, high = 0, len(table)
+        while low < high:
+            middle = (low + high) // 2
+            if key_of(table[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(table):
+            entry = table[low]
+            if key_of(entry) == key:
+                return entry
+        return None
+
+    def document(self, doc: int) -> Dict:
+        page_id, title_off, title_len, extract_off, extract_len, length = self.docs[doc]
+        title = self._string(title_off, title_len).decode('utf-8')
+        return {
+            'pageid': page_id,
+            'title': title,
+            'extract': self._string(extract_off, extract_len).decode('utf-8'),
+            'url': f"{self.meta['wiki_url']}{quote(title.replace(' ', '_'))}",
+            'length': length,
+        }
+
+    def find_title(self, title: str) -> Optional[int]:
+        """The document titled so, ignoring case"""
+        entry = self._bisect(self.titles, title_key(title), lambda e: self._string(e[0], e[1]))
+        return entry[2] if entry else None
+
+    def find_page(self, page_id: int) -> Optional[int]:
+        entry = self._bisect(self.pages, int(page_id), lambda e: e[0])
+        return entry[1] if entry else None
+
+    def _term(self, term: str) -> Optional[tuple]:
+        return self._bisect(self.terms, term.encode('utf-8'), lambda e: self._string(e[0], e[1]))
+
+    def search(self, query: str, limit: int = 5, max_postings: Optional[int] = None) -> List[Tuple[int, float]]:
+        """(document, BM25 score) of the best matches
+
+        Each term contributes its `max_postings` highest-weighted postings, so
+        very common words cost the same as rare ones.
+        """
+        max_postings = max_postings or chatbot_setting('WIKIMEDIA_OFFLINE_MAX_POSTINGS', 1000)
+        total = self.meta['docs']
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            entry = self._term(term)
+            if entry is None:
+                continue
+            _, _, first, df = entry
+            idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+            start = self._postings + first * POSTING.size
+            end = start + min(df, max_postings) * POSTING.size
+            for doc, weight in POSTING.iter_unpack(self._mmap[start:end]):
+                scores[doc] += idf * weight
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        # A page titled exactly after the query comes first, as on Wikipedia
+        exact = self.find_title(query)
+        if exact is not None:
+            best = [(exact, scores.get(exact, 0.0))] + [item for item in best if item[0] != exact]
+        return best[:limit]
+
+    def snippet(self, extract: str, query: str, length: int = 200) -> str:
+        """The start of an extract as HTML, with query words marked like the search API does"""
+        terms = set(tokenize(query))
+        text = extract[:length]
+        html = []
+        position = 0
+        for match in _TOKEN.finditer(text):
+            if match.group().lower() in terms:
+                html.append(escape(text[position:match.start()]))
+                html.append(f'<span class="searchmatch">{escape(match.group())}</span>')
+                position = match.end()
+        html.append(escape(text[position:]))
+        return ''.join(html)
+
+    def random_document(self) -> Optional[int]:
+        return random.randrange(len(self.docs)) if len(self.docs) else None
+
+
+_indexes: Dict[str, WikipediaIndex] = {}
+_indexes_lock = threading.Lock()
+_checked_at: Dict[str, float] = {}
+REOPEN_CHECK_SECONDS = 5
+
+
+def get_index(path: Optional[str] = None) -> WikipediaIndex:
+    """The process's mapping of an index file, reopened once the file is replaced"""
+    path = str(path or chatbot_setting('WIKIMEDIA_OFFLINE_INDEX', os.path.join(settings.BASE_DIR, 'wikipedia.idx')))
+    index = _indexes.get(path)
+    now = time.monotonic()
+    if index is not None and now - _checked_at.get(path, 0) < REOPEN_CHECK_SECONDS:
+        return index
+    with _indexes_lock:
+        index = _indexes.get(path)
+        _checked_at[path] = now
+        if index is not None:
+            stat = os.stat(path)
+            if (stat.st_ino, stat.st_mtime_ns) == (index.stat.st_ino, index.stat.st_mtime_ns):
+                return index
+            # The old mapping is left to the garbage collector, as requests may still use it
+            logger.info(f"Reopening the replaced Wikipedia index {path}")
+        index = _indexes[path] = WikipediaIndex(path)
+        return index
+
+
+class _NoCache:
+    """Index lookups are cheaper than any cache in front of them"""
+
+    def get_or_fetch(self, kind, key, fetch, is_empty=None):
+        return fetch()
+
+    async def aget_or_fetch(self, kind, key, fetch, is_empty=None):
+        return await fetch()
+
+
+class OfflineWikimediaClient(WikimediaClient):
+    """WikimediaClient answering from a local Wikipedia index instead of the API
+
+    Searches are BM25 over the abstracts, page content and summaries are the
+    abstracts. Nothing goes over the network.
+    """
+
+    def __init__(self, index_path: Optional[str] = None):
+        super().__init__()
+        self.index_path = index_path
+        self.cache = _NoCache()
+        # Fails early when the index is missing
+        get_index(self.index_path)
+
+    @property
+    def supports_async(self) -> bool:
+        return True
+
+    @property
+    def index(self) -> WikipediaIndex:
+        return get_index(self.index_path)
+
+    def _fetch_search_pages(self, query: str, limit: int) -> List[Dict]:
+        with metrics.stage('wikimedia.search.index'):
+            index = self.index
+            results = []
+            for doc, score in index.search(query, limit):
+                page = index.document(doc)
+                results.append({
+                    'ns': 0,
+                    'title': page['title'],
+                    'pageid': page['pageid'],
+                    'snippet': index.snippet(page['extract'], query),
+                    'wordcount': page['length'],
+                    'score': round(score, 4),
+                })
+            return results
+
+    def _fetch_page_content(self, page_id: int) -> Optional[str]:
+        with metrics.stage('wikimedia.page.index'):
+            doc = self.index.find_page(page_id)
+            return self.index.document(doc)['extract'] if doc is not None else None
+
+    def _fetch_page_summary(self, title: str) -> Optional[Dict]:
+        with metrics.stage('wikimedia.summary.index'):
+            doc = self.index.find_title(title)
+            if doc is None:
+                return None
+            page = self.index.document(doc)
+            return {'title': page['title'], 'extract': page['extract'], 'url': page['url'], 'pageid': page['pageid']}
+
+    # Lookups never block for long, so the async variants run them inline
+
+    async def _afetch_search_pages(self, query: str, limit: int) -> List[Dict]:
+        return self._fetch_search_pages(query, limit)
+
+    async def _afetch_page_content(self, page_id: int) -> Optional[str]:
+        return self._fetch_page_content(page_id)
+
+    async def _afetch_page_summary(self, title: str) -> Optional[Dict]:
+        return self._fetch_page_summary(title)
+
+    def _get_random_page(self) -> Optional[Dict]:
+        doc = self.index.random_document()
+        if doc is None:
+            return None
+        page = self.index.document(doc)
+        return {'title': page['title'], 'content': page['extract'], 'pageid': page['pageid']}
+
+
+def create_wikimedia_client() -> WikimediaClient:
+    """The Wikimedia client of the configured WIKIMEDIA_BACKEND ('api' or 'offline')"""
+    if chatbot_setting('WIKIMEDIA_BACKEND', 'api') == 'offline':
+        return OfflineWikimediaClient()
+    return WikimediaClient()
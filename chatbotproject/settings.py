@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,11 +42,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chatbotapp.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'chatbotapp.middleware.RateLimitMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -74,13 +77,80 @@ WSGI_APPLICATION = 'chatbotproject.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLITE_PRAGMAS are run on every new connection. WAL lets readers carry on
+# while a write commits, and synchronous=NORMAL is durable enough under WAL.
+# Transactions take the write lock when they begin (IMMEDIATE) and wait up to
+# `timeout` seconds for it, instead of failing with "database is locked".
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',  # KiB
+]
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': '; '.join(SQLITE_PRAGMAS),
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # An in-memory test database fails concurrent writers with "database
+        # table is locked" instead of letting them wait; tests use a file too
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Set CHATBOT_DB_ENGINE=postgresql to run on PostgreSQL instead
+if os.getenv('CHATBOT_DB_ENGINE') == 'postgresql':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('CHATBOT_DB_NAME', 'chatbot'),
+        'USER': os.getenv('CHATBOT_DB_USER', ''),
+        'PASSWORD': os.getenv('CHATBOT_DB_PASSWORD', ''),
+        'HOST': os.getenv('CHATBOT_DB_HOST', ''),
+        'PORT': os.getenv('CHATBOT_DB_PORT', ''),
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# 'default' holds shared entries (Wikimedia lookups, page fragments);
+# 'coordination' holds the counters and locks of rate limits, Gemini
+# admission and Wikimedia fetches, which need atomic add() and incr().
+# Set CHATBOT_REDIS_URL to run both on Redis, as any deployment with more
+# than one worker process should: without it, entries go to the file cache
+# (which lists its directory on every write to cull it) and each process
+# counts on its own in local memory.
+
+if os.getenv('CHATBOT_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CHATBOT_REDIS_URL'),
+            'TIMEOUT': 300,
+            'KEY_PREFIX': 'chatbot',
+        },
+    }
+    CACHES['coordination'] = CACHES['default']
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / '.cache',
+            'TIMEOUT': 300,
+            'OPTIONS': {
+                'MAX_ENTRIES': 10000,
+            },
+        },
+        'coordination': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'chatbot-coordination',
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -131,10 +201,10 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-# Session configuration for anonymous users
+# Session configuration (anonymous chats are tracked by their own signed
+# cookie, see ANONYMOUS_CHAT_COOKIE_AGE, and need no session row)
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = 86400  # 24 hours
-SESSION_SAVE_EVERY_REQUEST = True
 
 # Login/Logout URLs
 LOGIN_URL = '/admin/login/'
@@ -146,7 +216,127 @@ CHATBOT_SETTINGS = {
     'MAX_MESSAGE_LENGTH': 5000,
     'MAX_SESSIONS_PER_USER': 50,
     'AUTO_DELETE_OLD_SESSIONS_DAYS': 30,
+    # `manage.py enforce_retention` archives the sessions past either limit
+    # to gzipped JSONL here before deleting them
+    'RETENTION_ARCHIVE_DIR': BASE_DIR / 'archive',
+    'RETENTION_BATCH_SIZE': 100,
+    # Chat history export (/export/, `manage.py export_chat_history`) and
+    # `manage.py import_chat_history`
+    'EXPORT_CHUNK_SIZE': 2000,  # Rows per database fetch
+    'IMPORT_BATCH_SIZE': 1000,  # Rows per bulk_create transaction
     'RESPONSE_TIMEOUT_MINUTES': 30,
+    # Anonymous visitors' chat session is created with their first message
+    # and remembered in a signed cookie for this many seconds
+    'ANONYMOUS_CHAT_COOKIE_AGE': 30 * 24 * 60 * 60,
+    # Gemini context window: the turns not yet summarized go in verbatim,
+    # newest first, under a token budget; turns older than the latest
+    # CONTEXT_RECENT_TURNS are folded a batch at a time into a summary on the ChatSession
+    'CONTEXT_TOKEN_BUDGET': 3000,
+    'CONTEXT_RECENT_TURNS': 6,
+    'CONTEXT_SUMMARY_TOKENS': 400,
+    'CONTEXT_FOLD_BATCH_TURNS': 4,
+    'CONTEXT_FOLD_MAX_MESSAGES': 40,  # Messages summarized per call when folding a backlog
+    'CONTEXT_FOLD_WORKERS': 2,  # Threads folding old turns into summaries after replies
+    'CONTEXT_CHARS_PER_TOKEN': 4,
+    # Per-process pool of the unsummarized messages of recently active chat
+    # sessions, so each turn only reads what is new
+    'CONVERSATION_POOL_MAX_SESSIONS': 500,
+    'CONVERSATION_POOL_IDLE_SECONDS': 1800,
+    # Per-process cache of Gemini answers to prompts asked without earlier
+    # turns, per BotPersonality, matching normalized prompts. Near-duplicates
+    # found by SimHash distance are reused only if they differ in filler words
+    'RESPONSE_CACHE_ENABLED': True,
+    'RESPONSE_CACHE_MAX_ENTRIES': 2000,
+    'RESPONSE_CACHE_TTL': 3600,
+    'RESPONSE_CACHE_NEAR_DUPLICATES': True,
+    'RESPONSE_CACHE_MAX_DISTANCE': 3,  # Bits out of 64 that are sure to be searched
+    'RESPONSE_CACHE_MIN_SIMILARITY': 0.8,  # Jaccard similarity of character 4-grams
+    'RESPONSE_CACHE_NEAR_MIN_WORDS': 4,  # Shorter prompts only match exactly
+    # The chat page's message list is cached per session, keyed by its
+    # message count and last update, so any new message moves the key
+    'MESSAGES_FRAGMENT_CACHE_SECONDS': 3600,
+    # Full-text message search (FTS5 on SQLite, tsvector on PostgreSQL)
+    'SEARCH_PAGE_SIZE': 20,
+    'SEARCH_SNIPPET_WORDS': 16,
+    'SEARCH_CONFIG': 'english',  # PostgreSQL text search configuration
+    # Wikimedia lookup cache (seconds)
+    'WIKIMEDIA_CACHE_TTLS': {
+        'search': 3600,
+        'page': 86400,
+        'summary': 86400,
+    },
+    'WIKIMEDIA_NEGATIVE_CACHE_TTL': 300,
+    'WIKIMEDIA_LOCAL_CACHE_SIZE': 1024,
+    'WIKIMEDIA_LOCK_CACHE_ALIAS': 'coordination',  # Collapses concurrent misses across processes
+    # Query the Wikipedia sources in parallel for information queries
+    'CONCURRENT_RESOLUTION': True,
+    'CONCURRENT_RESOLUTION_WORKERS': 16,
+    'CONCURRENT_RESOLUTION_TIMEOUT': 15,
+    # Let Gemini answer information queries Wikipedia has nothing on, once
+    # every Wikipedia source has come back empty
+    'INFORMATION_GEMINI_FALLBACK': False,
+    # Generate bot responses in `manage.py run_response_workers` processes
+    'BACKGROUND_RESPONSES': False,
+    'BACKGROUND_MAX_ATTEMPTS': 3,
+    'BACKGROUND_RESPONSE_WAIT_SECONDS': 120,  # The chat page stops polling for a reply after this
+    # Latency histograms; each process writes its own to METRICS_DIR, and
+    # /metrics/ adds them up
+    'METRICS_DIR': BASE_DIR / '.metrics',
+    'METRICS_FLUSH_SECONDS': 5,
+    # Files of processes on other hosts are dropped after going this long unwritten
+    'METRICS_STALE_SECONDS': 600,
+    'METRICS_ALLOWED_IPS': ['127.0.0.1', '::1'],
+    # Upstream resilience: every response gets REQUEST_DEADLINE_SECONDS for
+    # its Gemini and Wikimedia calls, each call is also capped by its own
+    # timeout, and an upstream that keeps failing is skipped for a while
+    'REQUEST_DEADLINE_SECONDS': 30,
+    'GEMINI_TIMEOUT': 30,
+    # Replies use the system instruction of the user's BotPersonality, which
+    # gemini-pro does not support
+    'GEMINI_MODEL': 'gemini-1.5-flash',
+    'PERSONALITY_CACHE_CHECK_SECONDS': 5,  # How soon other processes' personality edits apply
+    'PERSONALITY_CACHE_USERS': 10000,  # Preferred personalities remembered per process
+    # Gemini admission control: at most GEMINI_MAX_CONCURRENCY calls per
+    # process, GEMINI_QUEUE_SIZE more waiting (signed-in users first) for up to
+    # GEMINI_QUEUE_TIMEOUT seconds, and per-minute budgets shared by every
+    # process through the cache. Calls that cannot get in use the local fallback
+    'GEMINI_MAX_CONCURRENCY': 8,
+    'GEMINI_QUEUE_SIZE': 32,
+    'GEMINI_QUEUE_TIMEOUT': 5,
+    'GEMINI_REQUESTS_PER_MINUTE': 300,  # None disables a budget
+    'GEMINI_TOKENS_PER_MINUTE': 1000000,
+    'GEMINI_EXPECTED_OUTPUT_TOKENS': 512,  # Charged up front, settled once the usage is known
+    'ADMISSION_CACHE_ALIAS': 'coordination',
+    # Requests per view and scope, as (requests, seconds): per signed-in
+    # user, per anonymous chat session and per client IP. Counted in the
+    # cache; refused requests get 429 with Retry-After
+    'RATE_LIMITS': {
+        'send_message': {'user': (30, 60), 'session': (20, 60), 'ip': (60, 60)},
+        'send_message_stream': {'user': (30, 60), 'session': (20, 60), 'ip': (60, 60)},
+        'new_chat': {'user': (10, 60), 'session': (10, 60), 'ip': (20, 60)},
+        'clear_chat': {'user': (10, 60), 'session': (10, 60), 'ip': (20, 60)},
+    },
+    'RATE_LIMIT_CACHE_ALIAS': 'coordination',
+    'RATE_LIMIT_PROXY_COUNT': 0,  # Reverse proxies adding X-Forwarded-For in front of the site
+    'WIKIMEDIA_TIMEOUT': (3.05, 10),  # (connect, read)
+    'WIKIMEDIA_HEDGE_DELAY': 0.5,  # Race a second request after this long; None disables
+    'WIKIMEDIA_HEDGE_ATTEMPTS': 2,
+    'HEDGE_WORKERS': 16,
+    # Wikimedia HTTP transport: one pooled keep-alive session per process, and
+    # one httpx client per event loop for the ASGI stream view (needs httpx).
+    # Point WIKIMEDIA_API_URL at `manage.py stub_mediawiki` to work offline
+    'WIKIMEDIA_API_URL': 'https://en.wikipedia.org/w/api.php',
+    'WIKIMEDIA_POOL_SIZE': None,  # None: CONCURRENT_RESOLUTION_WORKERS + HEDGE_WORKERS
+    'WIKIMEDIA_KEEPALIVE_SECONDS': 60,  # Idle connections of the async transport are closed after this
+    # 'offline' answers Wikipedia lookups from a local abstracts index instead,
+    # built by `manage.py import_wikipedia_abstracts`
+    'WIKIMEDIA_BACKEND': 'api',
+    'WIKIMEDIA_OFFLINE_INDEX': BASE_DIR / 'wikipedia.idx',
+    'WIKIMEDIA_OFFLINE_MAX_POSTINGS': 1000,  # Best postings read per query term
+    'CIRCUIT_BREAKERS': {
+        'gemini': {'failure_threshold': 5, 'recovery_seconds': 30},
+        'wikimedia': {'failure_threshold': 5, 'recovery_seconds': 30},
+    },
 }
 
 # Logging configuration